@@ -1,3 +1,11 @@
+import os
+import sys
+import glob
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 from openpyxl import load_workbook
@@ -5,6 +13,16 @@ from openpyxl.styles import Alignment
 from openpyxl.utils import get_column_letter
 
 
+DEPART_FILE = 'FICHE2.xls'
+REFERENCE_FILE = 'REF-LISTE.xls'
+OUTPUT_FILE = 'resultat.xlsx'
+OUTPUT_SUFFIX = '_resultat.xlsx'
+EXCEL_EXTENSIONS = ('.xls', '.xlsx')
+
+# Index de la référence dans chaque processus du mode lot (voir init_worker)
+_reference_index = None
+
+
 def read_excel_files(depart_file, reference_file):
     """Lit les fichiers Excel et retourne les DataFrames correspondants."""
     depart_df = pd.read_excel(depart_file)
@@ -24,8 +42,27 @@ def find_match(value, reference_df):
     return np.nan, np.nan
 
 
-def process_columns(depart_df, reference_df):
+def build_reference_index(reference_df):
+    """Indexe la référence : valeur -> (place, nombre de partants), avec les mêmes résultats que
+    find_match (colonnes I-Place dans l'ordre, première ligne trouvée), en un seul parcours."""
+    index = {}
+    for col in reference_df.columns:
+        if col.startswith('I-Place'):
+            places = reference_df[col.replace('I-Place', 'Place')].values
+            nbr_partants = reference_df[col.replace('I-Place', 'NbrPartants')].values
+            for row, value in enumerate(reference_df[col].values):
+                # Une valeur vide ne correspond jamais à rien (NaN != NaN)
+                if not pd.isna(value) and value not in index:
+                    index[value] = (places[row], nbr_partants[row])
+    return index
+
+
+def process_columns(depart_df, reference_df, reference_index=None):
     """Traite les colonnes et crée le DataFrame résultant."""
+    if reference_index is None:
+        reference_index = build_reference_index(reference_df)
+    not_found = (np.nan, np.nan)
+
     result_df = pd.DataFrame()
     for i in range(1, 5):
         i_place_col = f'I-Place-{i}'
@@ -35,7 +72,7 @@ def process_columns(depart_df, reference_df):
 
         result_df[t_place_col] = depart_df[i_place_col]
         result_df[place_col], result_df[nbr_partants_col] = zip(
-            *depart_df[i_place_col].apply(lambda x: find_match(x, reference_df)))
+            *depart_df[i_place_col].apply(lambda x: reference_index.get(x, not_found)))
 
     return result_df
 
@@ -80,16 +117,107 @@ def save_result(df, output_file):
     print(f"Le fichier {output_file} a été créé avec succès et formaté.")
 
 
-def main():
-    depart_file = 'FICHE2.xls'
-    reference_file = 'REF-LISTE.xls'
-    output_file = 'resultat.xlsx'
-
+def main(depart_file=DEPART_FILE, reference_file=REFERENCE_FILE, output_file=OUTPUT_FILE):
     depart_df, reference_df = read_excel_files(depart_file, reference_file)
     result_df = process_columns(depart_df, reference_df)
     result_df = reorder_columns(result_df)
     save_result(result_df, output_file)
 
 
+def list_depart_files(sources, reference_file=REFERENCE_FILE):
+    """Fichiers départ donnés directement, par dossier (tous les fichiers Excel du dossier et de ses
+    sous-dossiers, par exemple un dossier par jour) ou par motif glob. La référence, le résultat du
+    mode simple (resultat.xlsx) et les résultats d'un lot précédent sont ignorés, y compris leurs
+    copies dans les sous-dossiers."""
+    excluded_names = {OUTPUT_FILE, REFERENCE_FILE, Path(reference_file).name}
+    files = []
+    for source in sources:
+        path = Path(source)
+        if path.is_dir():
+            candidates = sorted(p for p in path.rglob('*') if p.suffix.lower() in EXCEL_EXTENSIONS and p.is_file())
+        elif path.exists():
+            candidates = [path]
+        else:
+            candidates = sorted(Path(p) for p in glob.glob(source, recursive=True))
+        files.extend(p for p in candidates
+                     if not p.name.endswith(OUTPUT_SUFFIX) and p.name not in excluded_names)
+
+    reference = Path(reference_file).resolve()
+    unique_files = []
+    for path in files:
+        if path.resolve() != reference and path not in unique_files:
+            unique_files.append(path)
+    return unique_files
+
+
+def output_path(depart_file, output_dir=None):
+    """Résultat de FICHE2.xls : FICHE2_resultat.xlsx, à côté du fichier départ ou dans `output_dir`."""
+    depart_file = Path(depart_file)
+    return Path(output_dir or depart_file.parent) / (depart_file.stem + OUTPUT_SUFFIX)
+
+
+def init_worker(reference_index):
+    """Initialisation d'un processus du lot : l'index de la référence n'est transmis qu'une fois."""
+    global _reference_index
+    _reference_index = reference_index
+
+
+def map_file(depart_file, output_file):
+    """Mappe un fichier départ avec l'index de la référence du processus ; retourne le nombre de
+    lignes, ou le message d'erreur."""
+    try:
+        depart_df = pd.read_excel(depart_file)
+        result_df = reorder_columns(process_columns(depart_df, None, _reference_index))
+        save_result(result_df, output_file)
+        return len(result_df), None
+    except Exception as e:
+        return 0, f"{type(e).__name__}: {e}"
+
+
+def main_batch(sources, reference_file=REFERENCE_FILE, output_dir=None, workers=None):
+    """Mode lot : lit la référence une seule fois et mappe tous les fichiers départ de `sources`
+    (dossiers, motifs glob ou fichiers) sur `workers` processus (un par cœur par défaut)."""
+    depart_files = list_depart_files(sources, reference_file)
+    if not depart_files:
+        print(f"Aucun fichier départ trouvé dans {', '.join(sources)}")
+        return
+
+    outputs = [output_path(depart_file, output_dir) for depart_file in depart_files]
+    if len(set(outputs)) < len(outputs):
+        raise ValueError("Plusieurs fichiers départ ont le même nom : sans dossier de sortie, "
+                         "les résultats sont écrits à côté de chaque fichier départ")
+    if output_dir:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    reference_index = build_reference_index(pd.read_excel(reference_file))
+    print(f"Référence {reference_file} : {len(reference_index)} valeur(s) indexée(s)")
+
+    # Chaque processus recharge pandas au démarrage : pas plus de processus que de fichiers
+    workers = min(workers or os.cpu_count() or 1, len(depart_files))
+    errors = []
+    rows = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_worker, initargs=(reference_index,)) as executor:
+        futures = {executor.submit(map_file, str(depart_file), str(output)): depart_file
+                   for depart_file, output in zip(depart_files, outputs)}
+        for future in as_completed(futures):
+            file_rows, error = future.result()
+            rows += file_rows
+            if error:
+                errors.append(futures[future])
+                print(f"Erreur sur {futures[future]} : {error}")
+
+    duration = time.perf_counter() - start
+    mapped = len(depart_files) - len(errors)
+    print(f"{mapped} fichier(s) mappé(s) ({rows} lignes) en {duration:.2f} s, "
+          f"soit {mapped / duration:.2f} fichiers/s, {len(errors)} erreur(s)")
+
+
 if __name__ == "__main__":
-    main()
+    # profilage.py se trouve à la racine du projet
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    from profilage import lancer_point_entree
+
+    lancer_point_entree(main, OUTPUT_FILE)
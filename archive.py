@@ -0,0 +1,223 @@
+"""Archive de pages : toutes les pages d'un crawl dans un seul fichier, lisible sans réseau.
+
+Les pages sont ajoutées en fin de fichier, compressées une à une (zstandard s'il est installé,
+zlib sinon). Un index texte à côté de l'archive (`<archive>.index`, une ligne par page) donne pour
+chaque URL la position et la taille de la page dans l'archive ; l'archive est lue par mmap, sans
+ouvrir un fichier par page.
+
+Le fichier d'archive n'est jamais réécrit : une page ajoutée deux fois garde ses deux versions,
+l'index pointe vers la plus récente. Si une exécution s'arrête entre l'écriture d'une page et celle
+de sa ligne d'index, la page n'est simplement pas référencée.
+"""
+import os
+import mmap
+import zlib
+import hashlib
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from loguru import logger
+
+from repartition import MOTIF_COURSE
+
+
+EXTENSION_INDEX = ".index"
+NIVEAU_ZLIB = 6
+NIVEAU_ZSTD = 10
+# Fin de l'index relue à l'ouverture pour retirer une ligne interrompue (bien plus qu'une ligne)
+TAILLE_FIN_INDEX = 64 * 1024
+
+
+class EntreeArchive(NamedTuple):
+    url: str
+    course: str
+    position: int
+    taille: int
+    compression: str
+    charset: str
+    horodatage: str
+
+
+def compression_disponible() -> str:
+    try:
+        import zstandard  # noqa: F401
+        return "zstd"
+    except ImportError:
+        return "zlib"
+
+
+def compresser(contenu: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=NIVEAU_ZSTD).compress(contenu)
+    return zlib.compress(contenu, NIVEAU_ZLIB)
+
+
+def decompresser(donnees: bytes, compression: str) -> bytes:
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(donnees)
+    return zlib.decompress(donnees)
+
+
+def identifiant_course(url: str) -> str:
+    correspondance = MOTIF_COURSE.search(url)
+    return correspondance.group(1) if correspondance else ""
+
+
+def nom_fichier_page(url: str) -> str:
+    """Nom de fichier d'une page extraite : son chemin, avec l'identifiant de course s'il n'y figure
+    pas (arrivee-et-rapports-pmu?id_course=...), sinon une empreinte de l'URL si elle a des paramètres."""
+    morceaux = urlsplit(url)
+    nom = morceaux.path.strip('/').replace('/', '_') or morceaux.hostname or "page"
+    course = identifiant_course(url)
+    if course and f"_c{course}" not in nom:
+        nom += f"_c{course}"
+    elif morceaux.query and not course:
+        nom += "_" + hashlib.blake2b(url.encode('utf-8'), digest_size=4).hexdigest()
+    return nom
+
+
+def nom_libre(nom: str, deja_pris: Set[str]) -> str:
+    """`nom`.html, ou `nom`_2.html, `nom`_3.html... s'il est déjà pris."""
+    candidat, numero = f"{nom}.html", 1
+    while candidat in deja_pris:
+        numero += 1
+        candidat = f"{nom}_{numero}.html"
+    deja_pris.add(candidat)
+    return candidat
+
+
+class ArchivePages:
+    """Archive de pages ouverte en lecture et en ajout."""
+
+    def __init__(self, chemin: str):
+        self.chemin = chemin
+        self.chemin_index = chemin + EXTENSION_INDEX
+        self.compression = compression_disponible()
+        self.entrees: Dict[str, EntreeArchive] = {}
+        self.par_course: Dict[str, List[str]] = {}
+        self._fichier = None
+        self._index = None
+        self._carte: Optional[mmap.mmap] = None
+        self._taille_carte = 0
+        self.charger_index()
+
+    def charger_index(self):
+        if not os.path.exists(self.chemin_index):
+            return
+        taille_archive = os.path.getsize(self.chemin) if os.path.exists(self.chemin) else 0
+        with open(self.chemin_index, 'r', encoding='utf-8') as f:
+            for ligne in f:
+                # Une ligne sans fin de ligne a été interrompue pendant l'écriture
+                if not ligne.endswith('\n'):
+                    break
+                champs = ligne.rstrip('\n').split('\t')
+                entree = EntreeArchive(champs[0], champs[1], int(champs[2]), int(champs[3]), *champs[4:7])
+                if entree.position + entree.taille > taille_archive:
+                    logger.warning(f"Page {entree.url} hors de l'archive {self.chemin}, ignorée")
+                    continue
+                self.indexer(entree)
+        logger.info(f"Archive {self.chemin} : {len(self.entrees)} page(s)")
+
+    def indexer(self, entree: EntreeArchive):
+        if entree.url not in self.entrees and entree.course:
+            self.par_course.setdefault(entree.course, []).append(entree.url)
+        self.entrees[entree.url] = entree
+
+    def retirer_ligne_interrompue(self):
+        """Coupe l'index après sa dernière ligne complète, pour que la ligne suivante ne s'y colle pas."""
+        if not os.path.exists(self.chemin_index):
+            return
+        with open(self.chemin_index, 'rb') as f:
+            taille = f.seek(0, os.SEEK_END)
+            f.seek(max(0, taille - TAILLE_FIN_INDEX))
+            fin = f.read()
+        if fin and not fin.endswith(b'\n'):
+            os.truncate(self.chemin_index, taille - len(fin) + fin.rfind(b'\n') + 1)
+
+    def __len__(self) -> int:
+        return len(self.entrees)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.entrees
+
+    def ajouter(self, url: str, contenu: bytes, charset: Optional[str] = None):
+        """Ajoute une page en fin d'archive, puis sa ligne d'index."""
+        if self._fichier is None:
+            self.retirer_ligne_interrompue()
+            self._fichier = open(self.chemin, 'ab')
+            self._index = open(self.chemin_index, 'a', encoding='utf-8', newline='\n')
+
+        donnees = compresser(contenu, self.compression)
+        position = self._fichier.seek(0, os.SEEK_END)
+        self._fichier.write(donnees)
+        self._fichier.flush()
+
+        entree = EntreeArchive(url, identifiant_course(url), position, len(donnees), self.compression,
+                               charset or "", datetime.now().strftime('%d/%m/%Y %H:%M:%S'))
+        self._index.write('\t'.join(str(champ) for champ in entree) + '\n')
+        self._index.flush()
+        self.indexer(entree)
+
+    def carte(self) -> mmap.mmap:
+        """Projection mémoire de l'archive, refaite si des pages ont été ajoutées depuis."""
+        taille = os.path.getsize(self.chemin)
+        if self._carte is None or taille > self._taille_carte:
+            if self._carte is not None:
+                self._carte.close()
+            with open(self.chemin, 'rb') as f:
+                self._carte = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._taille_carte = taille
+        return self._carte
+
+    def lire_entree(self, entree: EntreeArchive) -> bytes:
+        carte = self.carte()
+        return decompresser(carte[entree.position:entree.position + entree.taille], entree.compression)
+
+    def lire(self, url: str) -> Optional[Tuple[bytes, Optional[str]]]:
+        """Contenu et charset de la dernière version de la page (None si elle n'est pas archivée)."""
+        entree = self.entrees.get(url)
+        if entree is None:
+            return None
+        return self.lire_entree(entree), entree.charset or None
+
+    def urls_course(self, course: str) -> List[str]:
+        """URLs archivées d'une course (partants, arrivée...), dans leur ordre d'ajout."""
+        return self.par_course.get(course, [])
+
+    def pages(self, courses: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, bytes]]:
+        """Parcourt les pages (toutes, ou celles des `courses` données) dans l'ordre de l'archive :
+        le fichier est lu séquentiellement, une page à la fois."""
+        if courses is None:
+            entrees = self.entrees.values()
+        else:
+            entrees = [self.entrees[url] for course in courses for url in self.urls_course(course)]
+        for entree in sorted(entrees, key=lambda e: e.position):
+            yield entree.url, self.lire_entree(entree)
+
+    def extraire(self, dossier: str, courses: Optional[Iterable[str]] = None) -> int:
+        """Écrit les pages (toutes, ou celles des `courses` données) en fichiers HTML dans `dossier`,
+        sans jamais écraser une page par une autre. Retourne le nombre de pages écrites."""
+        os.makedirs(dossier, exist_ok=True)
+        noms: Set[str] = set()
+        for url, contenu in self.pages(courses):
+            with open(os.path.join(dossier, nom_libre(nom_fichier_page(url), noms)), 'wb') as f:
+                f.write(contenu)
+        return len(noms)
+
+    def etat(self) -> str:
+        if not self.entrees:
+            return f"Archive {self.chemin} vide"
+        taille_compressee = sum(entree.taille for entree in self.entrees.values())
+        compressions = ', '.join(sorted({entree.compression for entree in self.entrees.values()}))
+        return (f"{len(self.entrees)} page(s) de {len(self.par_course)} course(s), "
+                f"{taille_compressee / 1024 / 1024:.1f} Mio compressés ({compressions}), "
+                f"fichier de {os.path.getsize(self.chemin) / 1024 / 1024:.1f} Mio")
+
+    def fermer(self):
+        for fichier in (self._fichier, self._index, self._carte):
+            if fichier is not None:
+                fichier.close()
+        self._fichier = self._index = self._carte = None
@@ -1,28 +1,52 @@
-import csv
-import sys
 import re
 import asyncio
 import aiohttp
-from typing import Dict, List, Tuple, Set
+from contextlib import suppress
+from typing import Dict, List, Tuple, Set, Union
 from selectolax.parser import HTMLParser
 from loguru import logger
+from chronometre import chronometrer, terminer_rapport
+from journalisation import configurer_logger
+import metriques
+from profilage import lancer_point_entree
+from concurrence import CONCURRENCE_ARRIVEES, concurrence_par_defaut, rassembler
+from fichiers import ecrire_csv, lire_csv_dictionnaires
+from tri import cle_tri
+from flux_arrivees import ResultatArrivee, ecrire_arrivees_en_flux
+from telechargement import telecharger, telecharger_et_extraire, construire_arbre
+from hippodromes import MOTIF_NOM_REUNION, MOTIF_CARACTERES_NON_AUTORISES, appliquer_alias
 from typing import Optional
-from collections import defaultdict
-
-# Configuration du logger
-def configurer_logger():
-    """Configure le logger avec les paramètres appropriés."""
-    logger.remove()
-    fichier_log = "log_partants.log"
-    logger.add(fichier_log, rotation="500 KB",
-               retention="3 days", level="WARNING")
-    logger.add(sys.stderr, level="INFO")
 
 
+FICHIER_PARTANTS = "donnees_courses_partants.csv"
+FICHIER_ARRIVEES = "donnees_courses_arrivees.csv"
+
+URLS_ARRIVEES = [
+    "https://www.geny.com/arrivee-et-rapports-pmu?id_course=1518523&info=2024-09-11-Marseille-Bor%c3%a9ly-pmu-Prix+de+Ch%c3%a2telneuf",
+    "https://www.geny.com/arrivee-et-rapports-pmu?id_course=1517317&info=2024-09-07-Vincennes-pmu-Prix+de+B%c3%a9ziers",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-de-lusigny_c1517311",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-de-la-roche-posay_c1517316",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-du-mont-saint-michel_c1517312",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-de-montier-en-der_c1517315",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-pmu-prix-joseph-aveline_c1517314",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-de-bagnols-sur-ceze_c1517319",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-emile-wendling_c1517318",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-d-eaubonne_c1517313",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-pmu-prix-de-la-source-chomel_c1517307",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-d-yzeure_c1517305",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-de-nevers_c1517309",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-de-billy_c1517304",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-raymond-despres_c1517308",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-traveller_c1517306",
+    "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-de-la-federation-du-centre-est_c1517310"
+]
+
+
+@chronometrer("lecture_csv")
 async def lire_csv(nom_fichier: str) -> List[Dict[str, str]]:
+    """Lit le CSV des partants dans un thread, sans bloquer les téléchargements en cours."""
     try:
-        with open(nom_fichier, 'r', encoding='utf-8-sig') as f:
-            return list(csv.DictReader(f))
+        return await asyncio.to_thread(lire_csv_dictionnaires, nom_fichier)
     except FileNotFoundError:
         logger.error(f"Le fichier CSV {nom_fichier} n'a pas été trouvé.")
         return []
@@ -32,6 +56,7 @@ async def lire_csv(nom_fichier: str) -> List[Dict[str, str]]:
         return []
 
 
+@chronometrer()
 def extraire_numero_course(arbre: HTMLParser) -> Optional[str]:
     """Extrait le numéro de course du HTML."""
     try:
@@ -40,16 +65,20 @@ def extraire_numero_course(arbre: HTMLParser) -> Optional[str]:
             numero_course_text = noeud_numero_course.text().strip()
             return numero_course_text[0]
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
             logger.error("Aucun noeud correspondant au Numéro de course")
             return None
     except IndexError as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
         logger.error("Erreur d'accès au numéro de course dans le texte")
         return None
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
         logger.error(f"Erreur lors de l'extraction du numéro de course : {e}")
         return None 
 
 
+@chronometrer()
 def extraire_hippodrome(arbre: HTMLParser) -> Optional[str]:
     """Extrait le nom de l'hippodrome du HTML en préservant les accents."""
     try:
@@ -61,7 +90,7 @@ def extraire_hippodrome(arbre: HTMLParser) -> Optional[str]:
         if not texte_hippodrome:
             raise ValueError("Le texte de l'hippodrome est vide")
 
-        match = re.search(r':\s*(.+?)\s*\(', texte_hippodrome)
+        match = MOTIF_NOM_REUNION.search(texte_hippodrome)
         if match:
             hippodrome = match.group(1).strip()
         else:
@@ -71,25 +100,28 @@ def extraire_hippodrome(arbre: HTMLParser) -> Optional[str]:
             else:
                 hippodrome = texte_hippodrome
 
-        hippodrome_nettoye = re.sub(r'[^A-Za-zÀ-ÿ0-9\s-]', '', hippodrome)
+        hippodrome_nettoye = MOTIF_CARACTERES_NON_AUTORISES.sub('', hippodrome)
         hippodrome_nettoye = ' '.join(hippodrome_nettoye.split())
 
         if not hippodrome_nettoye:
             raise ValueError("Le nom de l'hippodrome est vide après nettoyage")
 
-        return hippodrome_nettoye
+        return appliquer_alias(hippodrome_nettoye)
 
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_hippodrome")
         logger.error(f"Erreur lors de l'extraction de l'hippodrome : {e}")
         return None
     
 
+@chronometrer()
 def extraire_numero_partant(arbre: HTMLParser) -> Optional[str]:
     try:
         noeud_partant = arbre.css_first("span.infoCourse")
         if noeud_partant:
-            texte_partant = noeud_partant.text().replace("ï¿½", "")
+            texte_partant = noeud_partant.text()
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_partant")
             logger.error(
                 "Aucun element avec l'attribut 'span.infoCourse' trouvé lors de l'extraction du 'partant'")
             return None
@@ -98,21 +130,25 @@ def extraire_numero_partant(arbre: HTMLParser) -> Optional[str]:
         if match:
             partant = match.group(1).strip()
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_partant")
             logger.error("Le partant n'a pas été trouvé lors de l'extraction")
             return None
         
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_partant")
         logger.error("Une exception s'est produite lors de la récuperation du numero partant")
         return None
     
     return partant
 
 
+@chronometrer()
 def extraire_places(arbre: HTMLParser) -> Dict[str, int]:
     places = {}
     try:
         table_arrivees = arbre.css_first('table#arrivees')
         if not table_arrivees:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_places")
             logger.warning("Tableau des arrivées non trouvé dans le HTML.")
             return places
 
@@ -138,11 +174,13 @@ def extraire_places(arbre: HTMLParser) -> Dict[str, int]:
                 places[numero] = 12
 
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_places")
         logger.error(f"Erreur lors de l'extraction des places : {e}")
 
     return places
 
 
+@chronometrer()
 def extraire_non_partants(arbre: HTMLParser) -> Set[str]:
     non_partants = set()
     try:
@@ -155,11 +193,13 @@ def extraire_non_partants(arbre: HTMLParser) -> Set[str]:
                 non_partants = set(numero.strip()
                                    for numero in numeros if numero.strip().isdigit())
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_non_partants")
         logger.error(f"Erreur lors de l'extraction des non partants : {e}")
     return non_partants
 
 
-async def extraire_donnees_arrivee(html_content: str) -> Tuple[Dict[str, Tuple[str, str]], Dict[str, int], Optional[str], Optional[str], Set[str], Optional[str]]:
+@chronometrer()
+async def extraire_donnees_arrivee(html_content: Union[bytes, str], url: str = "") -> Tuple[Dict[str, Tuple[str, str]], Dict[str, int], Optional[str], Optional[str], Set[str], Optional[str]]:
     resultats_pmu = {}
     places = {}
     numero_course = None
@@ -167,13 +207,14 @@ async def extraire_donnees_arrivee(html_content: str) -> Tuple[Dict[str, Tuple[s
     partant = None
     non_partants = set()
     try:
-        parser = HTMLParser(html_content)
+        parser = construire_arbre(html_content, url)
 
         numero_course = extraire_numero_course(parser)
         hippodrome = extraire_hippodrome(parser)
         partant = extraire_numero_partant(parser)
 
         if not numero_course or not hippodrome or not partant:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_donnees_arrivee")
             logger.warning(
                 "Numéro de course ou hippodrome ou partant non trouvé dans le HTML.")
             return resultats_pmu, places, numero_course, hippodrome, non_partants, partant
@@ -189,6 +230,7 @@ async def extraire_donnees_arrivee(html_content: str) -> Tuple[Dict[str, Tuple[s
                 break
 
         if not pmu_div:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_donnees_arrivee")
             logger.warning("Section PMU non trouvée dans le HTML.")
             return resultats_pmu, places, numero_course, hippodrome, non_partants, partant
 
@@ -198,6 +240,7 @@ async def extraire_donnees_arrivee(html_content: str) -> Tuple[Dict[str, Tuple[s
             table = table.next
 
         if not table:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_donnees_arrivee")
             logger.warning("Tableau PMU non trouvé dans le HTML.")
             return resultats_pmu, places, numero_course, hippodrome, non_partants, partant
 
@@ -224,12 +267,14 @@ async def extraire_donnees_arrivee(html_content: str) -> Tuple[Dict[str, Tuple[s
                     resultats_pmu[numero][1] = montant
 
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_donnees_arrivee")
         logger.error(
             f"Erreur lors de l'extraction des données d'arrivée PMU: {e}")
 
     return resultats_pmu, places, numero_course, hippodrome, non_partants, partant
 
 
+@chronometrer("mise_a_jour_csv")
 async def mettre_a_jour_csv(donnees_csv: List[Dict[str, str]], resultats_pmu: Dict[str, Tuple[str, str]], places: Dict[str, int], numero_course: str, hippodrome: str, non_partants: Set[str], partant: Optional[str]) -> List[Dict[str, str]]:
     try:
         if not numero_course or not hippodrome or not partant:
@@ -262,104 +307,140 @@ async def mettre_a_jour_csv(donnees_csv: List[Dict[str, str]], resultats_pmu: Di
         return donnees_csv
 
 
+@chronometrer("tri_csv")
 def trier_chevaux_par_hippodrome_et_classement(donnees_csv: List[Dict[str, str]]) -> List[Dict[str, str]]:
     try:
-        hippodromes = defaultdict(lambda: defaultdict(list))
-        for ligne in donnees_csv:
-            hippodrome = ligne['Hippodrome']
-            course = ligne['COURSE']
-            hippodromes[hippodrome][course].append(ligne)
-
-        for hippodrome in hippodromes:
-            for course in hippodromes[hippodrome]:
-                hippodromes[hippodrome][course] = sorted(
-                    hippodromes[hippodrome][course], key=lambda x: int(x['PLACE']))
-
-        donnees_triees = []
-        for hippodrome in sorted(hippodromes.keys()):
-            for course in sorted(hippodromes[hippodrome].keys()):
-                donnees_triees.extend(hippodromes[hippodrome][course])
-
-        return donnees_triees
+        return sorted(donnees_csv, key=cle_tri)
     except Exception as e:
         logger.error(
             f"Erreur lors du tri des chevaux par hippodrome et classement : {e}")
         return donnees_csv
 
 
+@chronometrer("ecriture_csv")
 async def sauvegarder_csv(donnees: List[Dict[str, str]], nom_fichier: str):
+    """Écrit le CSV dans un thread, via un fichier temporaire renommé une fois complet."""
     try:
-        with open(nom_fichier, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=donnees[0].keys())
-            writer.writeheader()
-            writer.writerows(donnees)
+        await asyncio.to_thread(ecrire_csv, nom_fichier, list(donnees[0].keys()), donnees)
         logger.info(f"Sauvegarde du fichier CSV {nom_fichier} réussie.")
     except Exception as e:
         logger.error(
             f"Erreur lors de la sauvegarde du fichier CSV {nom_fichier}: {e}")
 
 
-async def fetch_html(url: str, session: aiohttp.ClientSession) -> str:
+async def fetch_html(url: str, session: aiohttp.ClientSession) -> bytes:
     try:
-        async with session.get(url) as response:
-            return await response.text()
+        return await telecharger(url, session)
     except Exception as e:
         logger.error(
             f"Erreur lors de la récupération du contenu HTML pour {url}: {e}")
-        return ""
+        return b""
 
 
-async def traiter_url(url: str, session: aiohttp.ClientSession, donnees_csv: List[Dict[str, str]]) -> List[Dict[str, str]]:
-    html_content = await fetch_html(url, session)
+async def appliquer_arrivee(url: str, html_content: bytes, donnees_csv: List[Dict[str, str]]) -> List[Dict[str, str]]:
     if not html_content:
         logger.error(
             f"Impossible de continuer sans contenu HTML valide pour {url}")
         return donnees_csv
 
-    resultats_pmu, places, numero_course, hippodrome, non_partants, partant = await extraire_donnees_arrivee(html_content)
+    resultats_pmu, places, numero_course, hippodrome, non_partants, partant = await extraire_donnees_arrivee(html_content, url)
     donnees_mises_a_jour = await mettre_a_jour_csv(donnees_csv, resultats_pmu, places, numero_course, hippodrome, non_partants, partant)
     return donnees_mises_a_jour
 
 
-async def main():
+async def traiter_url(url: str, session: aiohttp.ClientSession, donnees_csv: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    html_content = await fetch_html(url, session)
+    return await appliquer_arrivee(url, html_content, donnees_csv)
+
+
+async def telecharger_resultat(url: str, session: aiohttp.ClientSession) -> Optional[ResultatArrivee]:
+    """Télécharge une page d'arrivée et n'en garde que le résultat extrait (pas le HTML).
+    Si la page n'a pas changé depuis le relevé précédent (304), le résultat précédent est réutilisé.
+    Une erreur de téléchargement est levée (pour la file de travaux, qui retente le travail)."""
+    async def extraire(html_content: bytes) -> Optional[ResultatArrivee]:
+        if not html_content:
+            logger.error(
+                f"Impossible de continuer sans contenu HTML valide pour {url}")
+            return None
+        return await extraire_donnees_arrivee(html_content, url)
+
+    return await telecharger_et_extraire(url, session, "arrivees", extraire)
+
+
+async def recuperer_resultat(url: str, session: aiohttp.ClientSession) -> Optional[ResultatArrivee]:
+    """Comme telecharger_resultat, mais une erreur est journalisée et donne None."""
+    try:
+        return await telecharger_resultat(url, session)
+    except Exception as e:
+        logger.error(
+            f"Erreur lors de la récupération du contenu HTML pour {url}: {e}")
+        return None
+
+
+async def recuperer_resultats(urls: List[str], concurrence: Optional[int] = None) -> List[Optional[ResultatArrivee]]:
+    """Récupère les résultats d'arrivée en parallèle (au plus `concurrence` pages à la fois, ou
+    CONCURRENCE_ARRIVEES sans limite donnée), dans l'ordre des URLs."""
+    concurrence = concurrence_par_defaut(concurrence, CONCURRENCE_ARRIVEES)
+    async with aiohttp.ClientSession() as session:
+        return await rassembler([recuperer_resultat(url, session) for url in urls], concurrence)
+
+
+async def appliquer_resultats(resultats: List[Optional[ResultatArrivee]], donnees_csv: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    for resultat in resultats:
+        if resultat is not None:
+            donnees_csv = await mettre_a_jour_csv(donnees_csv, *resultat)
+    return donnees_csv
+
+
+async def traiter_en_flux(urls: List[str], fichier_partants: str, fichier_sortie: str,
+                          concurrence: Optional[int] = None) -> int:
+    """Mode flux : les résultats d'arrivée sont extraits d'abord, puis le CSV des partants est
+    complété course par course sans être chargé en entier."""
+    resultats = await recuperer_resultats(urls, concurrence)
+    return await asyncio.to_thread(ecrire_arrivees_en_flux, fichier_partants, fichier_sortie, resultats)
+
+
+async def traiter_urls(urls: List[str], donnees_csv: List[Dict[str, str]], concurrence: Optional[int] = None) -> List[Dict[str, str]]:
+    """Télécharge les pages d'arrivée en parallèle, puis applique les résultats dans l'ordre des URLs."""
+    resultats = await recuperer_resultats(urls, concurrence)
+    return await appliquer_resultats(resultats, donnees_csv)
+
+
+async def main(urls: Optional[List[str]] = None, fichier_partants: str = FICHIER_PARTANTS,
+               fichier_sortie: str = FICHIER_ARRIVEES, concurrence: Optional[int] = None, flux: bool = False):
     configurer_logger()
 
     logger.info("Début du traitement des arrivées")
 
-    donnees_csv = await lire_csv('donnees_courses_partants.csv')
+    if urls is None:
+        urls = URLS_ARRIVEES
+
+    if flux:
+        await traiter_en_flux(urls, fichier_partants, fichier_sortie, concurrence)
+        logger.info("Fin du traitement des arrivées")
+        terminer_rapport()
+        return
+
+    # Le CSV des partants est lu pendant le téléchargement des pages d'arrivée ; s'il est absent ou
+    # vide, les téléchargements sont annulés aussitôt
+    telechargements = asyncio.create_task(recuperer_resultats(urls, concurrence))
+    donnees_csv = await lire_csv(fichier_partants)
     if not donnees_csv:
         logger.error("Impossible de continuer sans données CSV valides.")
+        telechargements.cancel()
+        with suppress(asyncio.CancelledError):
+            await telechargements
         return
+    resultats = await telechargements
 
-    urls_resultats = [
-        "https://www.geny.com/arrivee-et-rapports-pmu?id_course=1518523&info=2024-09-11-Marseille-Bor%c3%a9ly-pmu-Prix+de+Ch%c3%a2telneuf",
-        "https://www.geny.com/arrivee-et-rapports-pmu?id_course=1517317&info=2024-09-07-Vincennes-pmu-Prix+de+B%c3%a9ziers",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-de-lusigny_c1517311",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-de-la-roche-posay_c1517316",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-du-mont-saint-michel_c1517312",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-de-montier-en-der_c1517315",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-pmu-prix-joseph-aveline_c1517314",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-de-bagnols-sur-ceze_c1517319",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-emile-wendling_c1517318",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vincennes-pmu-prix-d-eaubonne_c1517313",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-pmu-prix-de-la-source-chomel_c1517307",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-d-yzeure_c1517305",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-de-nevers_c1517309",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-de-billy_c1517304",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-raymond-despres_c1517308",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-traveller_c1517306",
-        "https://www.geny.com/arrivee-et-rapports-pmu/2024-09-07-vichy-pmu-prix-de-la-federation-du-centre-est_c1517310"
-    ]
-
-    async with aiohttp.ClientSession() as session:
-        for url in urls_resultats:
-            donnees_csv = await traiter_url(url, session, donnees_csv)
+    donnees_csv = await appliquer_resultats(resultats, donnees_csv)
 
     donnees_triees = trier_chevaux_par_hippodrome_et_classement(donnees_csv)
 
-    await sauvegarder_csv(donnees_triees, 'donnees_courses_arrivees.csv')
+    await sauvegarder_csv(donnees_triees, fichier_sortie)
 
     logger.info("Fin du traitement des arrivées")
+    terminer_rapport()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    lancer_point_entree(main, FICHIER_ARRIVEES)
@@ -0,0 +1,341 @@
+"""Banc d'essai des extracteurs et du pipeline complet sur des pages geny.com sauvegardées.
+
+Le corpus mêle pages de partants (index.html) et pages d'arrivée (benchmarks/pages/arrivee.html,
+même course) : chaque extracteur est mesuré sur les pages de son type, et le serveur local sert
+les unes ou les autres selon l'URL demandée.
+
+Exemples :
+    python benchmarks/banc_essai.py extracteurs
+    python benchmarks/banc_essai.py pipeline --pages 200
+    python benchmarks/banc_essai.py enrichissement --courses 50000
+    python benchmarks/banc_essai.py tout --json resultats.json --reference reference.json
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+RACINE = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RACINE))
+
+from aiohttp import web
+from loguru import logger
+from selectolax.parser import HTMLParser
+
+import partants
+import arrivees
+import enrichissement
+from decoupage import REGIONS_PARTANTS, decouper_regions
+from telechargement import construire_arbre, memoriser_encodage
+
+
+DOSSIER_PAGES = Path(__file__).resolve().parent / "pages"
+# Marque d'une page d'arrivée : le tableau lu par arrivees.extraire_places
+MARQUE_ARRIVEE = b'id="arrivees"'
+PORT_PAR_DEFAUT = 0  # port libre choisi par le système
+
+
+def charger_corpus(dossier: Path) -> Dict[str, bytes]:
+    """Charge les pages du corpus : index.html à la racine du projet, puis les .html du dossier donné."""
+    corpus = {}
+    fichiers = [RACINE / "index.html"]
+    if dossier.is_dir():
+        fichiers += sorted(dossier.glob("*.html"))
+    for fichier in fichiers:
+        if fichier.is_file():
+            corpus[fichier.name] = fichier.read_bytes()
+    return corpus
+
+
+def separer_corpus(corpus: Dict[str, bytes]) -> Tuple[Dict[str, bytes], Dict[str, bytes]]:
+    """Pages de partants et pages d'arrivée du corpus."""
+    arrivees_corpus = {nom: contenu for nom, contenu in corpus.items() if MARQUE_ARRIVEE in contenu}
+    partants_corpus = {nom: contenu for nom, contenu in corpus.items() if nom not in arrivees_corpus}
+    return partants_corpus, arrivees_corpus
+
+
+def decoder_page(contenu: bytes) -> str:
+    """Décode une page sauvegardée (UTF-8 si possible, sinon Windows-1252 comme index.html)."""
+    try:
+        return contenu.decode('utf-8')
+    except UnicodeDecodeError:
+        return contenu.decode('cp1252', errors='replace')
+
+
+def url_corpus(nom: str, contenu: bytes) -> str:
+    """URL fictive d'une page du corpus, dont l'hôte reçoit l'encodage détecté pour cette page."""
+    url = f"http://{nom}/"
+    memoriser_encodage(url, contenu, None)
+    return url
+
+
+def mesurer_fonction(fonction: Callable, iterations: int) -> Dict[str, float]:
+    """Exécute la fonction `iterations` fois et retourne le temps par appel et le pic mémoire.
+
+    Le pic mémoire est mesuré sur un appel séparé, tracemalloc faussant les temps."""
+    fonction()
+    debut = time.perf_counter()
+    for _ in range(iterations):
+        fonction()
+    duree = time.perf_counter() - debut
+    tracemalloc.start()
+    fonction()
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "us_par_appel": round(duree / iterations * 1e6, 2),
+        "appels_par_seconde": round(iterations / duree, 1) if duree > 0 else 0.0,
+        "pic_memoire_ko": round(pic / 1024, 1),
+    }
+
+
+def banc_extracteurs(corpus: Dict[str, bytes], iterations: int) -> Dict[str, Dict[str, float]]:
+    resultats = {}
+    urls = {nom: url_corpus(nom, contenu) for nom, contenu in corpus.items()}
+    arbres = {nom: construire_arbre(contenu, urls[nom]) for nom, contenu in corpus.items()}
+    pages_partants, pages_arrivees = separer_corpus(corpus)
+
+    # Extracteur -> (fonction appliquée au nom d'une page, pages sur lesquelles la mesurer)
+    extracteurs = {
+        "HTMLParser": (lambda nom: HTMLParser(decoder_page(corpus[nom])), corpus),
+        "construire_arbre": (lambda nom: construire_arbre(corpus[nom], urls[nom]), corpus),
+        "construire_arbre_regions": (lambda nom: construire_arbre(corpus[nom], urls[nom], REGIONS_PARTANTS),
+                                     pages_partants),
+        "extraire_hippodrome": (lambda nom: partants.extraire_hippodrome(arbres[nom]), pages_partants),
+        "extraire_prix_et_partants": (lambda nom: partants.extraire_prix_et_partants(arbres[nom]), pages_partants),
+        "extraire_chevaux_et_gains": (lambda nom: partants.extraire_chevaux_et_gains(arbres[nom]), pages_partants),
+        "extraire_places": (lambda nom: arrivees.extraire_places(arbres[nom]), pages_arrivees),
+        "extraire_non_partants": (lambda nom: arrivees.extraire_non_partants(arbres[nom]), pages_arrivees),
+        "extraire_donnees_arrivee": (
+            lambda nom: asyncio.run(arrivees.extraire_donnees_arrivee(corpus[nom], urls[nom])), pages_arrivees),
+    }
+
+    for nom_extracteur, (extracteur, pages) in extracteurs.items():
+        if not pages:
+            continue
+        mesures = [mesurer_fonction(lambda: extracteur(nom), iterations) for nom in pages]
+        resultats[nom_extracteur] = {
+            "us_par_appel": round(sum(m["us_par_appel"] for m in mesures) / len(mesures), 2),
+            "appels_par_seconde": round(sum(m["appels_par_seconde"] for m in mesures) / len(mesures), 1),
+            "pic_memoire_ko": max(m["pic_memoire_ko"] for m in mesures),
+        }
+    return resultats
+
+
+def comparer_decoupage(corpus: Dict[str, bytes], iterations: int) -> Dict[str, Dict[str, float]]:
+    """Compare l'analyse complète d'une page de partants à l'analyse des seules régions utiles.
+
+    La mémoire de l'arbre selectolax (allouée en C, invisible pour tracemalloc) est proportionnelle
+    à la taille du document analysé, d'où la comparaison des tailles."""
+    resultats = {}
+    extracteurs = [partants.extraire_hippodrome, partants.extraire_numero_course,
+                   partants.extraire_prix_et_partants, partants.extraire_chevaux_et_gains]
+
+    for nom, contenu in separer_corpus(corpus)[0].items():
+        texte = decoder_page(contenu)
+        document = decouper_regions(texte, REGIONS_PARTANTS)
+        if document is None:
+            continue
+
+        def complet():
+            arbre = HTMLParser(texte)
+            return [extracteur(arbre) for extracteur in extracteurs]
+
+        def regions():
+            arbre = HTMLParser(decouper_regions(texte, REGIONS_PARTANTS))
+            return [extracteur(arbre) for extracteur in extracteurs]
+
+        mesure_complete = mesurer_fonction(complet, iterations)
+        mesure_regions = mesurer_fonction(regions, iterations)
+        resultats[f"decoupage[{nom}]"] = {
+            "ko_page": round(len(texte) / 1024, 1),
+            "ko_regions": round(len(document) / 1024, 1),
+            "us_complet": mesure_complete["us_par_appel"],
+            "us_regions": mesure_regions["us_par_appel"],
+            "acceleration": round(mesure_complete["us_par_appel"] / mesure_regions["us_par_appel"], 2),
+            "resultats_identiques": complet() == regions(),
+        }
+    return resultats
+
+
+def banc_enrichissement(corpus: Dict[str, bytes], nombre_courses: int, iterations: int) -> Dict[str, Dict[str, float]]:
+    """Compare les deux moteurs d'enrichissement sur une saison fictive : les courses extraites du
+    corpus sont répétées jusqu'à `nombre_courses`."""
+    courses = [partants.analyser_page(url_corpus(nom, contenu), contenu)
+               for nom, contenu in separer_corpus(corpus)[0].items()]
+    courses = [donnees for donnees in courses if donnees['donnees_chevaux']]
+    if not courses:
+        return {}
+    saison = [courses[i % len(courses)] for i in range(nombre_courses)]
+
+    resultats = {}
+    with tempfile.TemporaryDirectory() as dossier:
+        fichiers = {}
+        for moteur in enrichissement.MOTEURS:
+            fichiers[moteur] = Path(dossier) / f"{moteur}.csv"
+            enrichissement.choisir_moteur(moteur)
+            mesure = mesurer_fonction(lambda: partants.sauvegarder_en_csv(saison, str(fichiers[moteur]), {}), iterations)
+            mesure["lignes_par_seconde"] = round(
+                sum(len(donnees['donnees_chevaux']) for donnees in saison) / mesure["us_par_appel"] * 1e6, 1)
+            resultats[f"enrichissement_{moteur}"] = mesure
+        enrichissement.choisir_moteur(enrichissement.MOTEUR_PAR_DEFAUT)
+        resultats["enrichissement_vectorise"]["resultats_identiques"] = (
+            fichiers["python"].read_bytes() == fichiers["vectorise"].read_bytes())
+    return resultats
+
+
+async def demarrer_serveur_local(corpus: Dict[str, bytes], port: int) -> Tuple[web.AppRunner, int]:
+    """Démarre un serveur HTTP local servant le corpus en boucle, à la place de geny.com, et
+    retourne le port réellement ouvert (utile avec le port 0, choisi par le système). Les URLs
+    /arrivee-et-rapports-pmu/ reçoivent les pages d'arrivée, les autres les pages de partants.
+
+    Les pages sont servies telles quelles, sans charset dans l'en-tête : l'encodage est détecté
+    par la couche de téléchargement, comme pour une page dont le serveur ne l'annonce pas."""
+    pages_partants, pages_arrivees = (list(pages.values()) for pages in separer_corpus(corpus))
+
+    async def servir_page(request: web.Request) -> web.Response:
+        pages = pages_arrivees if request.match_info['type'] == 'arrivee-et-rapports-pmu' else pages_partants
+        if not pages:
+            raise web.HTTPNotFound()
+        index = int(request.match_info['index']) % len(pages)
+        return web.Response(body=pages[index], content_type='text/html')
+
+    application = web.Application()
+    application.router.add_get(r'/{type}/2024-08-29-page-{index:\d+}_c{id}', servir_page)
+    runner = web.AppRunner(application, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner, runner.addresses[0][1]
+
+
+async def mesurer_pipeline(executer: Callable) -> Dict[str, float]:
+    """Mesure le débit d'un pipeline, puis son pic mémoire lors d'une seconde exécution tracée."""
+    debut = time.perf_counter()
+    pages = await executer()
+    duree = time.perf_counter() - debut
+    tracemalloc.start()
+    await executer()
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "pages": pages,
+        "pages_par_seconde": round(pages / duree, 1) if duree > 0 else 0.0,
+        "pic_memoire_ko": round(pic / 1024, 1),
+    }
+
+
+async def banc_pipeline(corpus: Dict[str, bytes], nombre_pages: int, port: int) -> Dict[str, Dict[str, float]]:
+    resultats = {}
+    runner, port = await demarrer_serveur_local(corpus, port)
+    try:
+        urls_partants = [f"http://127.0.0.1:{port}/partants-pmu/2024-08-29-page-{i}_c{i}"
+                         for i in range(nombre_pages)]
+        urls_arrivees = [url.replace('/partants-pmu/', '/arrivee-et-rapports-pmu/')
+                         for url in urls_partants]
+
+        with tempfile.TemporaryDirectory() as dossier:
+            fichier_partants = str(Path(dossier) / "partants.csv")
+            fichier_arrivees = str(Path(dossier) / "arrivees.csv")
+
+            async def executer_partants():
+                toutes_donnees = await partants.traiter_urls(urls_partants)
+                partants.sauvegarder_en_csv(
+                    toutes_donnees, fichier_partants, {})
+                return len(toutes_donnees)
+
+            async def executer_arrivees():
+                donnees_csv = await arrivees.lire_csv(fichier_partants)
+                donnees_csv = await arrivees.traiter_urls(urls_arrivees, donnees_csv)
+                donnees_triees = arrivees.trier_chevaux_par_hippodrome_et_classement(donnees_csv)
+                await arrivees.sauvegarder_csv(donnees_triees, fichier_arrivees)
+                return len(urls_arrivees)
+
+            resultats["pipeline_partants"] = await mesurer_pipeline(executer_partants)
+            if separer_corpus(corpus)[1]:
+                resultats["pipeline_arrivees"] = await mesurer_pipeline(executer_arrivees)
+    finally:
+        await runner.cleanup()
+    return resultats
+
+
+def afficher_resultats(resultats: Dict[str, Dict[str, float]]):
+    for nom, mesures in resultats.items():
+        details = "  ".join(f"{cle}={valeur}" for cle, valeur in mesures.items())
+        print(f"{nom:<28} {details}")
+
+
+def comparer_a_reference(resultats: Dict[str, Dict[str, float]], chemin_reference: str, tolerance: float) -> List[str]:
+    """Retourne la liste des régressions par rapport à un fichier de résultats de référence."""
+    with open(chemin_reference, 'r', encoding='utf-8') as f:
+        reference = json.load(f)
+
+    regressions = []
+    for nom, mesures in resultats.items():
+        if nom not in reference:
+            continue
+        if "us_par_appel" in mesures and mesures["us_par_appel"] > reference[nom]["us_par_appel"] * (1 + tolerance):
+            regressions.append(
+                f"{nom}: {mesures['us_par_appel']} us/appel (référence {reference[nom]['us_par_appel']})")
+        if "pages_par_seconde" in mesures and mesures["pages_par_seconde"] < reference[nom]["pages_par_seconde"] * (1 - tolerance):
+            regressions.append(
+                f"{nom}: {mesures['pages_par_seconde']} pages/s (référence {reference[nom]['pages_par_seconde']})")
+    return regressions
+
+
+def main():
+    parseur = argparse.ArgumentParser(description="Banc d'essai des extracteurs geny.com")
+    parseur.add_argument("mode", choices=["extracteurs", "pipeline", "enrichissement", "tout"], nargs="?", default="tout")
+    parseur.add_argument("--corpus", type=Path, default=DOSSIER_PAGES,
+                         help="Dossier de pages .html (partants ou arrivées) à ajouter à index.html")
+    parseur.add_argument("--iterations", type=int, default=200)
+    parseur.add_argument("--pages", type=int, default=100,
+                         help="Nombre de pages servies pour le pipeline complet")
+    parseur.add_argument("--courses", type=int, default=20000,
+                         help="Nombre de courses de la saison fictive pour comparer les moteurs d'enrichissement")
+    parseur.add_argument("--port", type=int, default=PORT_PAR_DEFAUT,
+                         help="Port du serveur local (par défaut, un port libre)")
+    parseur.add_argument("--json", help="Fichier où sauvegarder les résultats")
+    parseur.add_argument("--reference", help="Résultats de référence à ne pas dégrader")
+    parseur.add_argument("--tolerance", type=float, default=0.2,
+                         help="Dégradation relative tolérée par rapport à la référence")
+    arguments = parseur.parse_args()
+
+    logger.remove()
+
+    corpus = charger_corpus(arguments.corpus)
+    if not corpus:
+        print("Aucune page trouvée pour le banc d'essai.")
+        return 1
+
+    resultats = {}
+    if arguments.mode in ("extracteurs", "tout"):
+        resultats.update(banc_extracteurs(corpus, arguments.iterations))
+        resultats.update(comparer_decoupage(corpus, arguments.iterations))
+    if arguments.mode in ("pipeline", "tout"):
+        resultats.update(asyncio.run(banc_pipeline(corpus, arguments.pages, arguments.port)))
+    if arguments.mode in ("enrichissement", "tout"):
+        resultats.update(banc_enrichissement(corpus, arguments.courses, max(1, arguments.iterations // 100)))
+
+    print(f"Corpus : {len(corpus)} page(s)")
+    afficher_resultats(resultats)
+
+    if arguments.json:
+        with open(arguments.json, 'w', encoding='utf-8') as f:
+            json.dump(resultats, f, ensure_ascii=False, indent=2)
+
+    if arguments.reference:
+        regressions = comparer_a_reference(resultats, arguments.reference, arguments.tolerance)
+        for regression in regressions:
+            print(f"RÉGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
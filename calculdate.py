@@ -1,41 +1,60 @@
 import pandas as pd
 from pathlib import Path
+from typing import List, Optional
 
+from profilage import lancer_point_entree
 
-def calculer_jour_de_annee(date):
-    return date.timetuple().tm_yday
 
+CHEMIN_FICHIER = r"CALCULDATE.xls"
+FICHIER_SORTIE = Path(CHEMIN_FICHIER).stem + '_resultat.csv'
 
-def calculer_jours_entre(date1, date2):
-     resultat = (date2 - date1)
-     return abs(resultat.days)
 
+COLONNE_CHEVAL = 'CHEVAL'
 
-def traiter_fichier_excel(fichier_entree):
+
+def completer_dates(df, index_historique, colonne_cheval: str = COLONNE_CHEVAL):
+    """Remplit Date-1..Date-4 avec les dernières courses de chaque cheval avant Date-du-Jour.
+    Les dates déjà saisies dans le fichier sont conservées."""
+    dates_precedentes = index_historique.dates_precedentes(df[colonne_cheval], df['Date-du-Jour'])
+    for i, dates in enumerate(dates_precedentes, start=1):
+        colonne = f'Date-{i}'
+        df[colonne] = df[colonne].fillna(dates) if colonne in df else dates
+
+
+def traiter_fichier_excel(fichier_entree, index_historique=None, colonne_cheval: str = COLONNE_CHEVAL):
     df = pd.read_excel(fichier_entree)
 
     colonnes_date = ['Date-du-Jour', 'Date-1', 'Date-2', 'Date-3', 'Date-4']
     for col in colonnes_date:
-        df[col] = pd.to_datetime(df[col], format='%d/%m/%Y')
+        if col in df:
+            df[col] = pd.to_datetime(df[col], format='%d/%m/%Y')
 
-    df['Nieme jour'] = df['Date-du-Jour'].apply(calculer_jour_de_annee)
+    if index_historique is not None:
+        completer_dates(df, index_historique, colonne_cheval)
+
+    df['Nieme jour'] = df['Date-du-Jour'].dt.dayofyear.astype('int64')
 
     for i in range(1, 5):
-        df[f'Nbr-jours-{i}'] = df.apply(lambda ligne: calculer_jours_entre(
-            ligne['Date-du-Jour'], ligne[f'Date-{i}']), axis=1)
+        df[f'Nbr-jours-{i}'] = (df[f'Date-{i}'] - df['Date-du-Jour']).dt.days.abs()
 
     return df 
 
 
-def main():
-    chemin_fichier = r"CALCULDATE.xls"
-
+def main(chemin_fichier: str = CHEMIN_FICHIER, fichier_sortie: str = None,
+         fichiers_historique: Optional[List[str]] = None, colonne_cheval: str = COLONNE_CHEVAL):
+    """Avec `fichiers_historique` (CSV de partants ou d'arrivées), les colonnes Date-1..Date-4
+    manquantes sont complétées à partir de l'historique des chevaux."""
     fichier = Path(chemin_fichier)
+    fichier_sortie = fichier_sortie or fichier.stem + '_resultat.csv'
 
     try:
-        df_resultat = traiter_fichier_excel(fichier)
+        index_historique = None
+        if fichiers_historique:
+            from historique import construire_index
+            index_historique = construire_index(fichiers_historique)
+
+        df_resultat = traiter_fichier_excel(fichier, index_historique, colonne_cheval)
 
-        fichier_sortie = fichier.stem + '_resultat.csv'
         df_resultat.to_csv(fichier_sortie, index=False, date_format='%d/%m/%Y')
         print(f"Le fichier résultat a été sauvegardé sous : {fichier_sortie}")
 
@@ -46,4 +65,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    lancer_point_entree(main, FICHIER_SORTIE)
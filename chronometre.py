@@ -0,0 +1,238 @@
+import os
+import json
+import math
+import time
+import asyncio
+import functools
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Callable
+
+from loguru import logger
+
+import metriques
+
+
+VARIABLE_RAPPORT_JSON = "RAPPORT_EXECUTION_JSON"
+
+# Vrai dans une commande qui enchaîne plusieurs scripts (voir rapport_unique)
+rapport_differe = False
+
+# Seaux des durées du rapport : chacun couvre 2 % de plus que le précédent à partir d'une
+# microseconde, soit un percentile estimé à 1 % près et un millier de seaux au plus jusqu'à une heure
+PRECISION_DUREES = 0.02
+DUREE_MINIMALE = 1e-6
+LOG_BASE_SEAUX = math.log1p(PRECISION_DUREES)
+
+
+def calculer_percentile(valeurs_triees: List[float], percentile: float) -> float:
+    """Calcule un percentile (rang le plus proche) sur une liste déjà triée."""
+    if not valeurs_triees:
+        return 0.0
+    rang = max(0, min(len(valeurs_triees) - 1,
+                      round(percentile / 100 * len(valeurs_triees) + 0.5) - 1))
+    return valeurs_triees[rang]
+
+
+class DistributionDurees:
+    """Durées d'une étape en mémoire bornée, quel que soit le nombre d'appels : nombre, total et
+    maximum exacts, percentiles estimés par un histogramme à seaux logarithmiques, fusionnable avec
+    celui d'un autre processus."""
+
+    def __init__(self):
+        self.appels = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.seaux: Dict[int, int] = {}
+
+    @staticmethod
+    def seau(duree: float) -> int:
+        if duree <= DUREE_MINIMALE:
+            return 0
+        return 1 + int(math.log(duree / DUREE_MINIMALE) / LOG_BASE_SEAUX)
+
+    @staticmethod
+    def valeur_seau(seau: int) -> float:
+        """Milieu géométrique du seau."""
+        if seau == 0:
+            return DUREE_MINIMALE
+        return DUREE_MINIMALE * math.exp((seau - 0.5) * LOG_BASE_SEAUX)
+
+    def ajouter(self, duree: float):
+        self.appels += 1
+        self.total += duree
+        self.maximum = max(self.maximum, duree)
+        seau = self.seau(duree)
+        self.seaux[seau] = self.seaux.get(seau, 0) + 1
+
+    def fusionner(self, autre: "DistributionDurees"):
+        self.appels += autre.appels
+        self.total += autre.total
+        self.maximum = max(self.maximum, autre.maximum)
+        for seau, compte in autre.seaux.items():
+            self.seaux[seau] = self.seaux.get(seau, 0) + compte
+
+    def percentile(self, percentile: float) -> float:
+        """Percentile (rang le plus proche, comme calculer_percentile), au plus le maximum observé."""
+        if not self.appels:
+            return 0.0
+        rang = max(0, min(self.appels - 1, round(percentile / 100 * self.appels + 0.5) - 1))
+        cumul = 0
+        for seau in sorted(self.seaux):
+            cumul += self.seaux[seau]
+            if cumul > rang:
+                return min(self.valeur_seau(seau), self.maximum)
+        return self.maximum
+
+
+class RapportExecution:
+    """Agrège les durées par étape, les octets téléchargés et le nombre de pages d'une exécution."""
+
+    def __init__(self):
+        self.reinitialiser()
+
+    def reinitialiser(self):
+        self.durees: Dict[str, DistributionDurees] = defaultdict(DistributionDurees)
+        self.octets_telecharges = 0
+        self.pages = 0
+        self.pages_non_modifiees = 0
+        self.debut = time.perf_counter()
+
+    def enregistrer(self, etape: str, duree: float):
+        self.durees[etape].ajouter(duree)
+        metriques.DUREE_ETAPES.observer(duree, etape=etape)
+
+    @contextmanager
+    def mesurer(self, etape: str):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.enregistrer(etape, time.perf_counter() - debut)
+
+    def ajouter_page(self, nb_octets: int):
+        self.pages += 1
+        self.octets_telecharges += nb_octets
+        if metriques.actif:
+            metriques.PAGES_TELECHARGEES.inc()
+            metriques.OCTETS_TELECHARGES.inc(nb_octets)
+            metriques.DERNIERE_PAGE.definir(time.time())
+
+    def ajouter_page_non_modifiee(self):
+        """Réponse 304 : la page n'a pas été retransférée ni analysée."""
+        self.pages_non_modifiees += 1
+        metriques.PAGES_NON_MODIFIEES.inc()
+
+    def donnees_brutes(self) -> Dict[str, any]:
+        """Mesures brutes, transmissibles à un autre processus pour y être fusionnées."""
+        return {"durees": dict(self.durees), "pages": self.pages, "octets_telecharges": self.octets_telecharges,
+                "pages_non_modifiees": self.pages_non_modifiees}
+
+    def fusionner(self, donnees: Dict[str, any]):
+        """Ajoute au rapport les mesures brutes d'un autre processus (voir donnees_brutes)."""
+        for etape, distribution in donnees["durees"].items():
+            self.durees[etape].fusionner(distribution)
+        self.pages += donnees["pages"]
+        self.octets_telecharges += donnees["octets_telecharges"]
+        self.pages_non_modifiees += donnees.get("pages_non_modifiees", 0)
+
+    def resume(self) -> Dict[str, any]:
+        """Retourne le rapport sous forme de dictionnaire (durées en millisecondes)."""
+        duree_totale = time.perf_counter() - self.debut
+        etapes = {}
+        for etape, distribution in self.durees.items():
+            etapes[etape] = {
+                "appels": distribution.appels,
+                "total_ms": round(distribution.total * 1000, 3),
+                "p50_ms": round(distribution.percentile(50) * 1000, 3),
+                "p95_ms": round(distribution.percentile(95) * 1000, 3),
+                "max_ms": round(distribution.maximum * 1000, 3),
+            }
+        return {
+            "duree_totale_s": round(duree_totale, 3),
+            "pages": self.pages,
+            "octets_telecharges": self.octets_telecharges,
+            "pages_non_modifiees": self.pages_non_modifiees,
+            "pages_par_seconde": round(self.pages / duree_totale, 3) if duree_totale > 0 else 0.0,
+            "etapes": etapes,
+        }
+
+    def journaliser(self):
+        resume = self.resume()
+        logger.info(
+            f"Rapport d'exécution : {resume['pages']} pages, {resume['pages_non_modifiees']} non modifiées (304), "
+            f"{resume['octets_telecharges']} octets, "
+            f"{resume['pages_par_seconde']} pages/s en {resume['duree_totale_s']} s")
+        for etape, stats in sorted(resume['etapes'].items(), key=lambda e: -e[1]['total_ms']):
+            logger.info(
+                f"  {etape:<28} appels={stats['appels']:<6} total={stats['total_ms']:.1f}ms "
+                f"p50={stats['p50_ms']:.2f}ms p95={stats['p95_ms']:.2f}ms max={stats['max_ms']:.2f}ms")
+
+    def exporter_json(self, chemin_fichier: str):
+        try:
+            with open(chemin_fichier, 'w', encoding='utf-8') as f:
+                json.dump(self.resume(), f, ensure_ascii=False, indent=2)
+            logger.info(f"Rapport d'exécution sauvegardé dans {chemin_fichier}")
+        except Exception as e:
+            logger.error(
+                f"Erreur lors de la sauvegarde du rapport d'exécution {chemin_fichier}: {e}")
+
+
+rapport = RapportExecution()
+
+
+def mesurer(etape: str):
+    """Context manager chronométrant un bloc dans le rapport global."""
+    return rapport.mesurer(etape)
+
+
+def chronometrer(etape: Optional[str] = None) -> Callable:
+    """Décorateur chronométrant une fonction (synchrone ou asynchrone) dans le rapport global."""
+    def decorateur(fonction: Callable) -> Callable:
+        nom_etape = etape or fonction.__name__
+
+        if asyncio.iscoroutinefunction(fonction):
+            @functools.wraps(fonction)
+            async def enveloppe_async(*args, **kwargs):
+                with rapport.mesurer(nom_etape):
+                    return await fonction(*args, **kwargs)
+            return enveloppe_async
+
+        @functools.wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            with rapport.mesurer(nom_etape):
+                return fonction(*args, **kwargs)
+        return enveloppe
+
+    return decorateur
+
+
+def terminer_rapport(chemin_json: Optional[str] = None):
+    """Journalise le rapport de l'exécution et l'exporte en JSON si un chemin est fourni
+    (ou défini par la variable d'environnement RAPPORT_EXECUTION_JSON), puis résume les
+    avertissements et erreurs de l'exécution. Ne fait rien dans un bloc rapport_unique."""
+    if rapport_differe:
+        return
+    from concurrence import terminer_limite_adaptative, terminer_requetes_secours
+    from journalisation import terminer_journal
+
+    rapport.journaliser()
+    terminer_limite_adaptative()
+    terminer_requetes_secours()
+    chemin_json = chemin_json or os.environ.get(VARIABLE_RAPPORT_JSON)
+    if chemin_json:
+        rapport.exporter_json(chemin_json)
+    terminer_journal()
+
+
+@contextmanager
+def rapport_unique():
+    """Pour une commande qui enchaîne plusieurs scripts (backfill) : les appels de chaque script à
+    terminer_rapport sont ignorés, le rapport de toute la commande est terminé une fois à la sortie."""
+    global rapport_differe
+    rapport_differe = True
+    try:
+        yield
+    finally:
+        rapport_differe = False
+        terminer_rapport()
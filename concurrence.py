@@ -0,0 +1,347 @@
+import time
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Tuple
+
+from loguru import logger
+
+import metriques
+
+
+# Valeur de --concurrence qui active la limite adaptative
+CONCURRENCE_AUTO = "auto"
+LIMITE_INITIALE = 4
+LIMITE_MINIMALE = 1
+LIMITE_MAXIMALE = 64
+FACTEUR_REDUCTION = 0.7
+# Latence lissée au-delà de laquelle le site est jugé saturé, en multiple de la latence de base
+TOLERANCE_LATENCE = 3.0
+# En dessous, un écart de latence n'est pas significatif (secondes)
+LATENCE_PLANCHER = 0.05
+LISSAGE_LATENCE = 0.2
+# Hausse relative de la latence de base à chaque réponse, pour suivre un site durablement plus lent
+DERIVE_LATENCE_BASE = 0.0005
+INTERVALLE_JOURNAL = 5.0
+
+# Part maximale de requêtes supplémentaires envoyées en secours d'une requête lente
+BUDGET_SECOURS = 0.05
+MARGE_SECOURS = 2
+PERCENTILE_SECOURS = 95
+FENETRE_LATENCES_SECOURS = 500
+ECHANTILLONS_MINIMUM_SECOURS = 20
+RECALCUL_DELAI_SECOURS = 20
+DELAI_MINIMUM_SECOURS = 0.05
+
+# Pages d'arrivée téléchargées en parallèle quand aucune limite n'est donnée (ni --concurrence, ni
+# limite adaptative) : une page d'arrivée par course, soit bien plus de requêtes que de réunions
+CONCURRENCE_ARRIVEES = 10
+
+
+async def rassembler(coroutines: List[Awaitable], concurrence: Optional[int] = None) -> List[any]:
+    """Équivalent de asyncio.gather limitant le nombre de coroutines en cours à `concurrence`
+    (sans limite si `concurrence` vaut None ou 0). L'ordre des résultats est conservé."""
+    if not concurrence:
+        return await asyncio.gather(*coroutines)
+
+    semaphore = asyncio.Semaphore(concurrence)
+
+    async def executer(coroutine: Awaitable):
+        if not metriques.actif:
+            async with semaphore:
+                return await coroutine
+
+        # Mêmes étapes, avec le nombre de coroutines en attente d'une place et en cours
+        metriques.COROUTINES_EN_ATTENTE.inc()
+        async with semaphore:
+            metriques.COROUTINES_EN_ATTENTE.inc(-1)
+            metriques.COROUTINES_EN_COURS.inc()
+            try:
+                return await coroutine
+            finally:
+                metriques.COROUTINES_EN_COURS.inc(-1)
+
+    return await asyncio.gather(*(executer(coroutine) for coroutine in coroutines))
+
+
+class LimiteAdaptative:
+    """Limite du nombre de requêtes HTTP en cours, ajustée pendant l'exécution (AIMD).
+
+    Chaque réponse rapide et sans erreur augmente la limite d'environ une place par « fenêtre »
+    (autant de réponses que la limite) tant que toutes les places sont occupées. Une erreur, un
+    statut 429/5xx, ou une latence lissée bien au-dessus de la latence de base du site la
+    multiplie par `facteur`, au plus une fois par latence écoulée. La limite retenue est
+    journalisée au fil de l'exécution."""
+
+    def __init__(self, initiale: int = LIMITE_INITIALE, minimum: int = LIMITE_MINIMALE,
+                 maximum: int = LIMITE_MAXIMALE, facteur: float = FACTEUR_REDUCTION,
+                 tolerance: float = TOLERANCE_LATENCE):
+        self.limite = float(initiale)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.facteur = facteur
+        self.tolerance = tolerance
+        self.en_cours = 0
+        self.attentes: Deque[asyncio.Future] = deque()
+        self.latence_base: Optional[float] = None
+        self.latence_lissee: Optional[float] = None
+        self.derniere_reduction = 0.0
+        self.reponses = 0
+        self.congestions = 0
+        self.historique: List[Tuple[float, int]] = [(time.monotonic(), initiale)]
+        self.dernier_journal = 0.0
+        self.reductions_a_journaliser = 0
+        self.derniere_raison = ""
+
+    @property
+    def places(self) -> int:
+        return int(self.limite)
+
+    async def acquerir(self):
+        while self.en_cours >= self.places:
+            attente = asyncio.get_running_loop().create_future()
+            self.attentes.append(attente)
+            try:
+                await attente
+            except asyncio.CancelledError:
+                if attente.done() and not attente.cancelled():
+                    self.reveiller()
+                raise
+        self.en_cours += 1
+
+    def reveiller(self):
+        libres = self.places - self.en_cours
+        while libres > 0 and self.attentes:
+            attente = self.attentes.popleft()
+            if not attente.done():
+                attente.set_result(None)
+                libres -= 1
+
+    def rendre(self):
+        """Rend la place d'une requête annulée, sans en tirer de conclusion sur le site."""
+        self.en_cours -= 1
+        self.reveiller()
+
+    def liberer(self, duree: float, statut: Optional[int]):
+        """Rend la place d'une requête terminée en `duree` secondes (statut None : pas de réponse)."""
+        pleine = self.en_cours >= self.places
+        self.en_cours -= 1
+        self.reponses += 1
+
+        if statut is None or statut == 429 or statut >= 500:
+            self.reduire(f"statut {statut}" if statut else "erreur réseau")
+            self.reveiller()
+            return
+
+        # Seules les réponses normales comptent : un refus rapide fausserait la latence de base
+        self.latence_base = duree if self.latence_base is None else \
+            min(duree, self.latence_base * (1 + DERIVE_LATENCE_BASE))
+        self.latence_lissee = duree if self.latence_lissee is None else \
+            (1 - LISSAGE_LATENCE) * self.latence_lissee + LISSAGE_LATENCE * duree
+        if self.latence_lissee > self.tolerance * max(self.latence_base, LATENCE_PLANCHER):
+            self.reduire(f"latence {self.latence_lissee * 1000:.0f} ms")
+        elif pleine:
+            self.changer(min(self.maximum, self.limite + 1 / self.limite))
+        self.reveiller()
+
+    def reduire(self, raison: str):
+        maintenant = time.monotonic()
+        # Les réponses aux requêtes parties avant la dernière réduction ne la répètent pas
+        if maintenant - self.derniere_reduction < (self.latence_lissee or 0):
+            return
+        self.derniere_reduction = maintenant
+        self.congestions += 1
+        self.reductions_a_journaliser += 1
+        self.derniere_raison = raison
+        self.changer(max(self.minimum, self.limite * self.facteur))
+
+    def changer(self, limite: float):
+        ancienne = self.places
+        self.limite = limite
+        if self.places == ancienne:
+            return
+        maintenant = time.monotonic()
+        self.historique.append((maintenant, self.places))
+        metriques.LIMITE_CONCURRENCE.definir(self.places)
+        # Au plus une ligne par intervalle, même quand la limite oscille à chaque fenêtre
+        if maintenant - self.dernier_journal >= INTERVALLE_JOURNAL:
+            self.dernier_journal = maintenant
+            reductions = ""
+            if self.reductions_a_journaliser:
+                reductions = (f", {self.reductions_a_journaliser} réduction(s) depuis le dernier relevé, "
+                              f"dernière : {self.derniere_raison}")
+            self.reductions_a_journaliser = 0
+            logger.info(f"Concurrence : limite {self.places} (latence {(self.latence_lissee or 0) * 1000:.0f} ms, "
+                        f"base {(self.latence_base or 0) * 1000:.0f} ms{reductions})")
+
+    def journaliser(self):
+        limites = [limite for _, limite in self.historique]
+        logger.info(f"Concurrence adaptative : limite finale {self.places} (min {min(limites)}, max {max(limites)}), "
+                    f"{self.congestions} réduction(s) sur {self.reponses} réponse(s)")
+
+
+# Limite adaptative des requêtes HTTP (voir telechargement.requete), désactivée par défaut
+limite_adaptative: Optional[LimiteAdaptative] = None
+
+
+class PlaceRequete:
+    """Contexte asynchrone d'une requête HTTP : attend une place de la limite adaptative (si elle
+    est active), puis la rend avec la durée et le `statut` de la requête."""
+
+    def __init__(self, limite: Optional[LimiteAdaptative]):
+        self.limite = limite
+        self.statut: Optional[int] = None
+        self.debut = 0.0
+
+    async def __aenter__(self) -> "PlaceRequete":
+        if self.limite is not None:
+            await self.limite.acquerir()
+        self.debut = time.perf_counter()
+        return self
+
+    async def __aexit__(self, type_exception, exception, trace):
+        if self.limite is None:
+            return
+        if type_exception is not None and issubclass(type_exception, asyncio.CancelledError):
+            self.limite.rendre()
+        else:
+            self.limite.liberer(time.perf_counter() - self.debut, self.statut)
+
+
+def place_requete() -> PlaceRequete:
+    return PlaceRequete(limite_adaptative)
+
+
+def activer_limite_adaptative(**parametres):
+    """Ajuste automatiquement le nombre de requêtes HTTP en cours pour toute l'exécution."""
+    global limite_adaptative
+    limite_adaptative = LimiteAdaptative(**parametres)
+    metriques.LIMITE_CONCURRENCE.definir(limite_adaptative.places)
+
+
+def limite_adaptative_active() -> bool:
+    return limite_adaptative is not None
+
+
+def concurrence_par_defaut(concurrence: Optional[int], defaut: int) -> Optional[int]:
+    """`concurrence` si elle est donnée, aucune limite fixe si la limite adaptative est active,
+    `defaut` sinon."""
+    if concurrence or limite_adaptative_active():
+        return concurrence
+    return defaut
+
+
+def terminer_limite_adaptative():
+    if limite_adaptative is not None and limite_adaptative.reponses:
+        limite_adaptative.journaliser()
+
+
+class RequetesDeSecours:
+    """Requêtes de secours (« hedging ») : une page qui n'a pas répondu après la latence p95
+    observée est redemandée une seconde fois, et la première réponse arrivée est gardée, l'autre
+    requête étant annulée. Le nombre de requêtes de secours est limité à une part `budget` des
+    requêtes (plus une petite marge), pour ne pas doubler la charge quand tout le site ralentit.
+
+    Le p95 est estimé sur les premières requêtes seulement. Une première requête annulée parce que
+    le secours a répondu avant elle compte pour la durée écoulée jusqu'à son annulation : sans
+    cela, les pages les plus lentes disparaîtraient de l'échantillon et le p95 baisserait au fil
+    des secours. La requête de secours prend sa propre place de la limite adaptative."""
+
+    def __init__(self, budget: float = BUDGET_SECOURS, percentile: float = PERCENTILE_SECOURS):
+        self.budget = budget
+        self.percentile = percentile
+        self.latences: Deque[float] = deque(maxlen=FENETRE_LATENCES_SECOURS)
+        self._delai: Optional[float] = None
+        self._nouvelles_latences = 0
+        self.requetes = 0
+        self.secours = 0
+        self.secours_gagnants = 0
+
+    def delai(self) -> Optional[float]:
+        """Latence p95 des dernières premières requêtes (None tant qu'il y en a trop peu pour l'estimer)."""
+        if len(self.latences) < ECHANTILLONS_MINIMUM_SECOURS:
+            return None
+        if self._delai is None or self._nouvelles_latences >= RECALCUL_DELAI_SECOURS:
+            from chronometre import calculer_percentile
+            self._delai = max(DELAI_MINIMUM_SECOURS, calculer_percentile(sorted(self.latences), self.percentile))
+            self._nouvelles_latences = 0
+        return self._delai
+
+    def budget_disponible(self) -> bool:
+        return self.secours < self.budget * self.requetes + MARGE_SECOURS
+
+    def noter_latence(self, tache: asyncio.Future, debut: float):
+        """Durée de la première requête, réussie ou annulée ; un échec ne renseigne pas sur la latence."""
+        if tache.cancelled() or tache.exception() is None:
+            self.latences.append(time.perf_counter() - debut)
+            self._nouvelles_latences += 1
+
+    @staticmethod
+    async def secourir(lancer: Callable[[], Awaitable]) -> Any:
+        """Requête de secours, sur sa propre place de la limite adaptative (si elle est active)."""
+        async with place_requete() as place:
+            resultat = await lancer()
+            place.statut = resultat[0]
+        return resultat
+
+    async def executer(self, lancer: Callable[[], Awaitable]) -> Any:
+        """Exécute `lancer()` (une requête, qui retourne le statut HTTP en premier), et la relance
+        une fois si elle tarde."""
+        self.requetes += 1
+        debut = time.perf_counter()
+        premiere = asyncio.ensure_future(lancer())
+        premiere.add_done_callback(lambda tache: self.noter_latence(tache, debut))
+        taches = {premiere}
+        try:
+            delai = self.delai()
+            if delai is not None:
+                await asyncio.wait(taches, timeout=delai)
+            if premiere.done() or delai is None or not self.budget_disponible():
+                return await premiere
+
+            self.secours += 1
+            seconde = asyncio.ensure_future(self.secourir(lancer))
+            taches.add(seconde)
+            en_cours = set(taches)
+            while en_cours:
+                terminees, en_cours = await asyncio.wait(en_cours, return_when=asyncio.FIRST_COMPLETED)
+                for tache in terminees:
+                    if tache.exception() is None:
+                        if tache is seconde:
+                            self.secours_gagnants += 1
+                        metriques.REQUETES_SECOURS.inc(gagnante="secours" if tache is seconde else "premiere")
+                        return tache.result()
+            # Les deux requêtes ont échoué : l'erreur de la première est remontée
+            return premiere.result()
+        finally:
+            for tache in taches:
+                if not tache.done():
+                    tache.cancel()
+                elif not tache.cancelled():
+                    # Erreur d'une requête perdante : lue pour qu'asyncio ne la signale pas
+                    tache.exception()
+
+    def journaliser(self):
+        part = self.secours / self.requetes * 100 if self.requetes else 0.0
+        logger.info(f"Requêtes de secours : {self.secours} sur {self.requetes} requêtes ({part:.1f} %), "
+                    f"{self.secours_gagnants} plus rapide(s) que la première, "
+                    f"délai p{self.percentile:g} {(self._delai or 0) * 1000:.0f} ms")
+
+
+# Requêtes de secours (voir telechargement.requete), désactivées par défaut
+requetes_secours: Optional[RequetesDeSecours] = None
+
+
+def activer_requetes_secours(budget: float = BUDGET_SECOURS):
+    """Relance les pages lentes pour toute l'exécution (voir RequetesDeSecours)."""
+    global requetes_secours
+    requetes_secours = RequetesDeSecours(budget)
+
+
+def budget_requetes_secours() -> Optional[float]:
+    """Budget des requêtes de secours si elles sont actives (à transmettre aux autres processus)."""
+    return requetes_secours.budget if requetes_secours is not None else None
+
+
+def terminer_requetes_secours():
+    if requetes_secours is not None and requetes_secours.requetes:
+        requetes_secours.journaliser()
@@ -0,0 +1,108 @@
+import re
+from typing import Callable, List, Optional, Tuple, Union
+
+from loguru import logger
+
+
+# Les pages sont découpées telles quelles, en octets (contenu brut téléchargé) ou en texte
+Document = Union[bytes, str]
+
+MOTIFS_BALISES = {}
+
+
+def compiler(motif: str, octets: bool) -> re.Pattern:
+    return re.compile(motif.encode('ascii') if octets else motif, re.I)
+
+
+def motif_balise(balise: str, octets: bool = False) -> re.Pattern:
+    """Motif trouvant les ouvertures et fermetures d'une balise (mis en cache par balise)."""
+    cle = (balise, octets)
+    if cle not in MOTIFS_BALISES:
+        MOTIFS_BALISES[cle] = compiler(rf'<(/?){balise}\b', octets)
+    return MOTIFS_BALISES[cle]
+
+
+def extraire_element(html: Document, balise: str, motif_ouverture: re.Pattern, debut: int = 0) -> Optional[Tuple[int, int]]:
+    """Retourne les positions (début, fin) du premier élément correspondant au motif à partir de
+    `debut`, en tenant compte des balises de même nom imbriquées."""
+    ouverture = motif_ouverture.search(html, debut)
+    if not ouverture:
+        return None
+
+    octets = isinstance(html, bytes)
+    profondeur = 0
+    for correspondance in motif_balise(balise, octets).finditer(html, ouverture.start()):
+        if correspondance.group(1):
+            profondeur -= 1
+            if profondeur == 0:
+                fin = html.find(b'>' if octets else '>', correspondance.end())
+                return (ouverture.start(), fin + 1) if fin != -1 else None
+        else:
+            profondeur += 1
+    return None
+
+
+def region(balise: str, motif_ouverture: str, avant: str = "", apres: str = "", nombre: int = 1,
+           apres_motif: Optional[str] = None) -> Callable[[Document], Optional[Document]]:
+    """Décrit une région de page : les `nombre` premiers éléments <balise> correspondant au motif
+    (éventuellement situés après `apres_motif`), entourés de `avant` et `apres`."""
+    # Motifs et enveloppe compilés pour le texte (False) et pour les octets (True)
+    ouvertures = {octets: compiler(motif_ouverture, octets) for octets in (False, True)}
+    reperes = {octets: compiler(apres_motif, octets) for octets in (False, True)} if apres_motif else None
+    enveloppes = {False: (avant, apres), True: (avant.encode('ascii'), apres.encode('ascii'))}
+
+    def extraire(html: Document) -> Optional[Document]:
+        octets = isinstance(html, bytes)
+        ouverture = ouvertures[octets]
+        debut = 0
+        if reperes:
+            correspondance = reperes[octets].search(html)
+            if not correspondance:
+                return None
+            debut = correspondance.end()
+
+        morceaux = []
+        for _ in range(nombre):
+            positions = extraire_element(html, balise, ouverture, debut)
+            if positions is None:
+                return None
+            morceaux.append(html[positions[0]:positions[1]])
+            debut = positions[1]
+        prefixe, suffixe = enveloppes[octets]
+        return prefixe + html[:0].join(morceaux) + suffixe
+
+    extraire.__name__ = f"region_{balise}"
+    return extraire
+
+
+REGION_NOM_REUNION = region('div', r'<div\b[^>]*\bnomReunion\b[^>]*>')
+# "span h1" : le premier <span> qui contient un <h1> (sans autre <span> avant lui), comme le sélecteur,
+# et non le premier <h1> de la page
+REGION_TITRE = region('span', r'(?s)<span\b[^>]*>(?:(?!</?span\b).)*?<h1\b')
+REGION_INFO_COURSE = region('span', r'<span\b[^>]*\binfoCourse\b[^>]*>')
+REGION_TABLEAU_PARTANTS = region('table', r'<table\b[^>]*\bid=["\']?tableau_partants\b[^>]*>')
+# Fil d'Ariane de "#yui-main" : le deuxième lien porte le nom de l'hippodrome
+REGION_FIL_ARIANE = region('a', r'<a\b', avant='<div id="yui-main">', apres='</div>', nombre=2,
+                           apres_motif=r'<div\b[^>]*\bid=["\']?yui-main\b[^>]*>')
+
+# Régions de la page des partants réellement utilisées par les extracteurs
+REGIONS_PARTANTS = [REGION_NOM_REUNION, REGION_TITRE, REGION_INFO_COURSE, REGION_TABLEAU_PARTANTS]
+REGIONS_PARTANTS_REUNION = [REGION_FIL_ARIANE, REGION_TITRE, REGION_INFO_COURSE, REGION_TABLEAU_PARTANTS]
+REGIONS_INFO_COURSE = [REGION_INFO_COURSE]
+
+
+def decouper_regions(html: Document, regions: List[Callable[[Document], Optional[Document]]] = REGIONS_PARTANTS) -> Optional[Document]:
+    """Construit un document HTML réduit aux seules régions demandées, avant de construire l'arbre.
+
+    Le document réduit est du même type que la page (octets ou texte). Retourne None si une région
+    est introuvable : l'appelant doit alors analyser la page complète."""
+    morceaux = []
+    for extraire in regions:
+        morceau = extraire(html)
+        if morceau is None:
+            logger.debug(f"{extraire.__name__} introuvable, analyse de la page complète")
+            return None
+        morceaux.append(morceau)
+    if isinstance(html, bytes):
+        return b"<html><body>" + b"\n".join(morceaux) + b"</body></html>"
+    return "<html><body>" + "\n".join(morceaux) + "</body></html>"
@@ -0,0 +1,135 @@
+"""Moteur vectorisé d'enrichissement des partants (pandas/NumPy).
+
+Le moteur habituel de sauvegarder_en_csv parcourt les courses une à une et convertit les gains
+cheval par cheval. Ici, tous les chevaux extraits forment une seule table : les gains min/max, le
+passage aux cotes Genybet (au moins 5 cotes PMU à 0 dans la course) et la colonne Cotes-Pmu sont
+calculés par colonnes entières. Le CSV écrit est identique à celui du moteur habituel.
+
+pandas n'est importé qu'à l'utilisation du moteur.
+"""
+import os
+import csv
+from typing import Dict, List, Optional, Sequence
+
+from loguru import logger
+
+import metriques
+from fichiers import ecriture_atomique
+from hippodromes import normaliser_nom_hippodrome
+from referentiel import COLONNES_EXCEL, journaliser_rapprochements, valeurs_hippodrome
+
+
+MOTEURS = ("python", "vectorise")
+MOTEUR_PAR_DEFAUT = "python"
+
+# Nombre de cotes PMU à 0 dans une course à partir duquel les cotes Genybet sont utilisées
+SEUIL_COTES_PMU_NULLES = 5
+PREFIXE_GENYBET = "(G) "
+
+moteur_actif = MOTEUR_PAR_DEFAUT
+
+
+def choisir_moteur(nom: str):
+    """Choisit le moteur d'enrichissement utilisé par sauvegarder_en_csv pour toute l'exécution."""
+    global moteur_actif
+    if nom not in MOTEURS:
+        raise ValueError(f"Moteur d'enrichissement inconnu : {nom} (attendu : {', '.join(MOTEURS)})")
+    moteur_actif = nom
+
+
+def moteur_vectorise() -> bool:
+    return moteur_actif == "vectorise"
+
+
+def convertir_gain(gain: str) -> Optional[int]:
+    """Gain entier comme dans calculer_gains_min_max (None s'il n'est pas convertible)."""
+    try:
+        return int(gain.replace(' ', '').replace('€', ''))
+    except ValueError:
+        return None
+
+
+def construire_table(toutes_donnees: List[Dict[str, any]], donnees_excel: Dict[str, Dict[str, str]]):
+    """Construit la table enrichie (un cheval par ligne) à partir des courses extraites."""
+    import numpy as np
+    import pandas as pd
+
+    nombre_chevaux = np.fromiter((len(donnees['donnees_chevaux']) for donnees in toutes_donnees),
+                                 dtype=np.int64, count=len(toutes_donnees))
+    # Position de la course de chaque cheval et numéro du cheval dans sa course
+    course = np.repeat(np.arange(len(toutes_donnees)), nombre_chevaux)
+    debuts = np.cumsum(nombre_chevaux) - nombre_chevaux
+    numero_cheval = np.arange(len(course)) - debuts[course] + 1
+
+    chevaux = [cheval for donnees in toutes_donnees for cheval in donnees['donnees_chevaux']]
+    noms = [cheval['nom'] for cheval in chevaux]
+    gains_texte = pd.Series([cheval['gain'] for cheval in chevaux], dtype=object)
+    cotes_pmu = np.array([cheval['cote_pmu'] for cheval in chevaux], dtype=object)
+    cotes_genybet = np.array([cheval['cote_genybet'] for cheval in chevaux], dtype=object)
+
+    # Gains min/max par course : chaque valeur distincte n'est convertie qu'une fois, les gains non
+    # entiers sont ignorés et une course sans gain vaut 0
+    codes, gains_distincts = pd.factorize(gains_texte)
+    valeurs_distinctes = [convertir_gain(gain) for gain in gains_distincts]
+    invalides = [gain for gain, valeur in zip(gains_distincts, valeurs_distinctes) if valeur is None]
+    if invalides:
+        logger.warning(f"Impossible de convertir {int(np.isin(gains_texte, invalides).sum())} gain(s) en entier, "
+                       f"ignoré(s) pour les gains min/max : {invalides[:5]}")
+    gains = pd.Series(np.array(valeurs_distinctes, dtype=float)[codes] if len(codes) else np.empty(0))
+    par_course = gains.groupby(course).agg(['min', 'max']).reindex(range(len(toutes_donnees)))
+    moins_riche = par_course['min'].fillna(0).to_numpy(dtype=np.int64)
+    plus_riche = par_course['max'].fillna(0).to_numpy(dtype=np.int64)
+
+    # Cotes Genybet pour toute la course si elle compte trop de cotes PMU à 0
+    cotes_nulles = np.bincount(course, weights=cotes_pmu == '0', minlength=len(toutes_donnees))
+    utiliser_genybet = (cotes_nulles >= SEUIL_COTES_PMU_NULLES)[course]
+    cotes = np.where(utiliser_genybet, PREFIXE_GENYBET + cotes_genybet, cotes_pmu)
+
+    # Valeurs du fichier de référence, cherchées une fois par hippodrome
+    valeurs_hippodromes = {}
+    for donnees in toutes_donnees:
+        if donnees['hippodrome'] not in valeurs_hippodromes:
+            valeurs_hippodromes[donnees['hippodrome']] = valeurs_hippodrome(
+                donnees_excel, normaliser_nom_hippodrome(donnees['hippodrome']))
+
+    # Colonnes par course (object : un numéro de course absent reste None, pas NaN ni 3.0)
+    courses = pd.DataFrame({
+        'DATE': [donnees['date'] for donnees in toutes_donnees],
+        'Hippodrome': [donnees['hippodrome'] for donnees in toutes_donnees],
+        'COURSE': [donnees['numero_course'] for donnees in toutes_donnees],
+        'PARTANTS': [donnees['partants'] for donnees in toutes_donnees],
+        'I-Prix du jour': [donnees['prix'] for donnees in toutes_donnees],
+    }, dtype=object)
+    excel = pd.DataFrame([valeurs_hippodromes[donnees['hippodrome']] for donnees in toutes_donnees],
+                         columns=COLONNES_EXCEL, dtype=object)
+
+    table = pd.concat([courses, excel], axis=1).take(course).reset_index(drop=True)
+    table['NumChev'] = numero_cheval
+    table['CHEVAL'] = noms
+    table['I-Gains'] = gains_texte
+    table['I-Moins-Riche'] = moins_riche[course]
+    table['I-Plus-Riche'] = plus_riche[course]
+    table['Cotes-Pmu'] = cotes
+    for colonne in ('PLACE', 'RAP-G', 'RAP-P', 'Statut'):
+        table[colonne] = ''
+    return table
+
+
+def sauvegarder_en_csv(toutes_donnees: List[Dict[str, any]], nom_fichier: str,
+                       donnees_excel: Dict[str, Dict[str, str]], noms_champs: Sequence[str]) -> int:
+    """Écrit le CSV enrichi des partants avec le moteur vectorisé et retourne le nombre de lignes."""
+    try:
+        table = construire_table(toutes_donnees, donnees_excel)
+        # Les colonnes sont écrites par le module csv, comme ecrire_csv : même format, même fichier
+        with ecriture_atomique(nom_fichier) as f:
+            ecrivain = csv.writer(f)
+            ecrivain.writerow(noms_champs)
+            ecrivain.writerows(zip(*(table[colonne].tolist() for colonne in noms_champs)))
+        metriques.LIGNES_ECRITES.inc(len(table), fichier=os.path.basename(nom_fichier))
+        logger.info(f"Données enrichies sauvegardées avec succès dans {nom_fichier} "
+                    f"({len(table)} lignes, moteur vectorisé)")
+        journaliser_rapprochements(donnees_excel)
+        return len(table)
+    except Exception as e:
+        logger.error(f"Erreur lors de la sauvegarde des données enrichies en CSV : {e}")
+        return 0
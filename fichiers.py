@@ -0,0 +1,78 @@
+import os
+import csv
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from loguru import logger
+
+import metriques
+
+
+# Tampon d'écriture : les lignes sont envoyées au disque par blocs plutôt qu'une à une
+TAILLE_TAMPON = 1024 * 1024
+ENCODAGE_CSV = 'utf-8-sig'
+
+# umask du processus, lu une fois à l'import : le lire demande de le modifier, ce qu'il ne faut
+# pas faire pendant que d'autres threads créent des fichiers
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def mode_fichier(chemin: str) -> int:
+    """Droits à donner au fichier écrit : ceux du fichier remplacé, ou ceux d'un open() ordinaire
+    (0o666 moins l'umask) s'il n'existe pas encore. mkstemp crée toujours le fichier en 0o600."""
+    try:
+        return os.stat(chemin).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
+
+
+@contextmanager
+def ecriture_atomique(chemin: str, encoding: Optional[str] = ENCODAGE_CSV, newline: Optional[str] = '',
+                      binaire: bool = False):
+    """Ouvre un fichier temporaire à côté de `chemin` et le renomme en `chemin` une fois l'écriture
+    terminée. En cas d'erreur, le fichier temporaire est supprimé et `chemin` reste intact."""
+    dossier = os.path.dirname(os.path.abspath(chemin))
+    descripteur, chemin_temporaire = tempfile.mkstemp(
+        dir=dossier, prefix=f".{os.path.basename(chemin)}.", suffix=".tmp")
+    try:
+        if binaire:
+            f = open(descripteur, 'wb', buffering=TAILLE_TAMPON)
+        else:
+            f = open(descripteur, 'w', encoding=encoding, newline=newline, buffering=TAILLE_TAMPON)
+        with f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(chemin_temporaire, mode_fichier(chemin))
+        os.replace(chemin_temporaire, chemin)
+    except BaseException:
+        try:
+            os.remove(chemin_temporaire)
+        except OSError:
+            logger.warning(f"Impossible de supprimer le fichier temporaire {chemin_temporaire}")
+        raise
+
+
+def ecrire_csv(chemin: str, noms_champs: Sequence[str], lignes: Iterable[Dict], encoding: str = ENCODAGE_CSV) -> int:
+    """Écrit les lignes dans un CSV de façon atomique et retourne le nombre de lignes écrites."""
+    nombre_lignes = 0
+
+    def compter(lignes_a_ecrire: Iterable[Dict]):
+        nonlocal nombre_lignes
+        for ligne in lignes_a_ecrire:
+            nombre_lignes += 1
+            yield ligne
+
+    with ecriture_atomique(chemin, encoding) as f:
+        ecrivain = csv.DictWriter(f, fieldnames=noms_champs)
+        ecrivain.writeheader()
+        ecrivain.writerows(compter(lignes))
+    metriques.LIGNES_ECRITES.inc(nombre_lignes, fichier=os.path.basename(chemin))
+    return nombre_lignes
+
+
+def lire_csv_dictionnaires(chemin: str, encoding: str = ENCODAGE_CSV) -> List[Dict[str, str]]:
+    with open(chemin, 'r', newline='', encoding=encoding, buffering=TAILLE_TAMPON) as f:
+        return list(csv.DictReader(f))
@@ -0,0 +1,343 @@
+"""File de travaux partagée entre plusieurs travailleurs (éventuellement sur plusieurs machines).
+
+Chaque travail est une URL d'un type de page (voir repartition.TRAVAUX). Un travailleur prend un
+bail sur quelques travaux, les traite puis les confirme (résultat stocké dans la file, ou travail
+marqué `vide` si l'extraction ne retourne rien, par exemple une course ni attelée ni montée) ou les
+rejette sur une exception (remis en attente, jusqu'à TENTATIVES_MAX). Les fonctions de travail
+(repartition.TRAVAUX) lèvent donc les erreurs de téléchargement au lieu de rendre un résultat vide. Un bail expiré, par exemple celui d'un travailleur
+arrêté brutalement, est repris par le prochain travailleur. Le CSV est produit à part, une fois la
+file terminée, à partir des résultats stockés dans l'ordre d'ajout des URLs.
+"""
+import os
+import json
+import time
+import socket
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+import aiohttp
+from loguru import logger
+
+import metriques
+from concurrence import rassembler
+from repartition import fonction_travail
+
+
+DUREE_BAIL = 300.0
+TENTATIVES_MAX = 3
+TAILLE_LOT = 10
+# Attente entre deux tentatives quand tous les travaux restants sont sous bail d'autres travailleurs
+ATTENTE_BAUX = 5.0
+
+EN_ATTENTE = "en_attente"
+EN_COURS = "en_cours"
+TERMINE = "termine"
+VIDE = "vide"
+ECHEC = "echec"
+
+ERREUR_BAIL_EXPIRE = "bail expiré"
+
+
+class Travail(NamedTuple):
+    id: int
+    type: str
+    url: str
+    tentatives: int
+
+
+def identifiant_travailleur() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def encoder_resultat(resultat: Any) -> str:
+    """Sérialise un résultat d'extraction en JSON (les ensembles, comme les non-partants, en listes)."""
+    return json.dumps(resultat, default=lambda valeur: sorted(valeur) if isinstance(valeur, set) else str(valeur),
+                      ensure_ascii=False)
+
+
+def decoder_resultat(type_travail: str, texte: Optional[str]) -> Any:
+    if texte is None:
+        return None
+    resultat = json.loads(texte)
+    if type_travail.startswith("arrivees") and resultat:
+        # (resultats_pmu, places, numero_course, hippodrome, non_partants, partant)
+        resultat[4] = set(resultat[4])
+        resultat = tuple(resultat)
+    return resultat
+
+
+def etat_confirme(resultat: Any) -> str:
+    return TERMINE if resultat else VIDE
+
+
+class FileTravaux(ABC):
+    """Interface d'une file de travaux avec baux. Les implémentations doivent rendre `prendre`
+    atomique : deux travailleurs ne reçoivent jamais le même travail sous bail valide, et pouvoir
+    être appelées depuis un autre thread que celui qui a ouvert la file (voir travailler)."""
+
+    @abstractmethod
+    def ajouter(self, type_travail: str, urls: Iterable[str]) -> int:
+        """Ajoute les URLs absentes de la file et retourne le nombre d'URLs ajoutées."""
+        ...
+
+    @abstractmethod
+    def prendre(self, type_travail: str, travailleur: str, nombre: int = TAILLE_LOT,
+                duree_bail: float = DUREE_BAIL) -> List[Travail]:
+        """Prend un bail sur au plus `nombre` travaux en attente ou dont le bail a expiré. Un travail
+        dont le bail a déjà expiré après TENTATIVES_MAX tentatives passe en échec au lieu d'être repris."""
+        ...
+
+    @abstractmethod
+    def confirmer(self, travail: Travail, travailleur: str, resultat: Any):
+        """Stocke le résultat du travail (terminé), ou le marque `vide` si le résultat est vide."""
+        ...
+
+    @abstractmethod
+    def rejeter(self, travail: Travail, travailleur: str, erreur: str):
+        """Remet le travail en attente, ou le passe en échec après TENTATIVES_MAX tentatives."""
+        ...
+
+    @abstractmethod
+    def etat(self, type_travail: Optional[str] = None) -> Dict[str, int]:
+        """Nombre de travaux par état."""
+        ...
+
+    @abstractmethod
+    def resultats(self, type_travail: str) -> List[Any]:
+        """Résultats des travaux terminés, dans l'ordre d'ajout des URLs."""
+        ...
+
+
+class FileTravauxSQLite(FileTravaux):
+    """File stockée dans une base SQLite, partageable par plusieurs processus ou machines via un
+    fichier commun (verrou d'écriture de SQLite)."""
+
+    def __init__(self, chemin: str):
+        self.chemin = chemin
+        # La connexion sert depuis les threads d'asyncio.to_thread, une opération à la fois
+        self.verrou = threading.Lock()
+        self.connexion = sqlite3.connect(chemin, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connexion.execute("PRAGMA journal_mode=WAL")
+        self.connexion.execute("""
+            CREATE TABLE IF NOT EXISTS travaux (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                type TEXT NOT NULL,
+                url TEXT NOT NULL,
+                etat TEXT NOT NULL DEFAULT 'en_attente',
+                tentatives INTEGER NOT NULL DEFAULT 0,
+                travailleur TEXT,
+                bail_expire REAL,
+                resultat TEXT,
+                erreur TEXT,
+                UNIQUE (type, url)
+            )""")
+        self.connexion.execute("CREATE INDEX IF NOT EXISTS travaux_etat ON travaux (type, etat, id)")
+
+    @contextmanager
+    def transaction(self):
+        """Transaction prenant le verrou d'écriture dès le début (BEGIN IMMEDIATE)."""
+        with self.verrou:
+            self.connexion.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connexion
+            except BaseException:
+                self.connexion.execute("ROLLBACK")
+                raise
+            self.connexion.execute("COMMIT")
+
+    def ajouter(self, type_travail: str, urls: Iterable[str]) -> int:
+        with self.transaction() as connexion:
+            avant = connexion.total_changes
+            connexion.executemany("INSERT OR IGNORE INTO travaux (type, url) VALUES (?, ?)",
+                                  ((type_travail, url) for url in urls))
+            return connexion.total_changes - avant
+
+    def prendre(self, type_travail: str, travailleur: str, nombre: int = TAILLE_LOT,
+                duree_bail: float = DUREE_BAIL) -> List[Travail]:
+        maintenant = time.time()
+        with self.transaction() as connexion:
+            lignes = connexion.execute(
+                "SELECT id, type, url, tentatives, etat FROM travaux "
+                "WHERE type = ? AND (etat = ? OR (etat = ? AND bail_expire < ?)) ORDER BY id LIMIT ?",
+                (type_travail, EN_ATTENTE, EN_COURS, maintenant, nombre)).fetchall()
+            epuises = [ligne for ligne in lignes if ligne[4] == EN_COURS and ligne[3] >= TENTATIVES_MAX]
+            lignes = [ligne for ligne in lignes if ligne not in epuises]
+            for ligne in epuises:
+                logger.warning(f"Bail expiré après {ligne[3]} tentatives pour {ligne[2]}, travail en échec")
+            connexion.executemany(
+                "UPDATE travaux SET etat = ?, erreur = ?, bail_expire = NULL WHERE id = ?",
+                ((ECHEC, ERREUR_BAIL_EXPIRE, ligne[0]) for ligne in epuises))
+            for ligne in lignes:
+                if ligne[4] == EN_COURS:
+                    logger.warning(f"Bail expiré repris pour {ligne[2]}")
+            connexion.executemany(
+                "UPDATE travaux SET etat = ?, travailleur = ?, bail_expire = ?, tentatives = tentatives + 1 "
+                "WHERE id = ?",
+                ((EN_COURS, travailleur, maintenant + duree_bail, ligne[0]) for ligne in lignes))
+        return [Travail(ligne[0], ligne[1], ligne[2], ligne[3] + 1) for ligne in lignes]
+
+    def confirmer(self, travail: Travail, travailleur: str, resultat: Any):
+        with self.transaction() as connexion:
+            connexion.execute(
+                "UPDATE travaux SET etat = ?, resultat = ?, bail_expire = NULL, erreur = NULL "
+                "WHERE id = ? AND travailleur = ? AND etat = ?",
+                (etat_confirme(resultat), encoder_resultat(resultat) if resultat else None,
+                 travail.id, travailleur, EN_COURS))
+
+    def rejeter(self, travail: Travail, travailleur: str, erreur: str):
+        etat = ECHEC if travail.tentatives >= TENTATIVES_MAX else EN_ATTENTE
+        with self.transaction() as connexion:
+            connexion.execute(
+                "UPDATE travaux SET etat = ?, erreur = ?, bail_expire = NULL "
+                "WHERE id = ? AND travailleur = ? AND etat = ?",
+                (etat, erreur, travail.id, travailleur, EN_COURS))
+
+    def etat(self, type_travail: Optional[str] = None) -> Dict[str, int]:
+        requete = "SELECT etat, COUNT(*) FROM travaux"
+        parametres = ()
+        if type_travail:
+            requete += " WHERE type = ?"
+            parametres = (type_travail,)
+        with self.verrou:
+            return dict(self.connexion.execute(requete + " GROUP BY etat", parametres).fetchall())
+
+    def resultats(self, type_travail: str) -> List[Any]:
+        with self.verrou:
+            lignes = self.connexion.execute(
+                "SELECT resultat FROM travaux WHERE type = ? AND etat = ? ORDER BY id", (type_travail, TERMINE)).fetchall()
+        return [decoder_resultat(type_travail, ligne[0]) for ligne in lignes]
+
+
+class FileTravauxMemoire(FileTravaux):
+    """File en mémoire, limitée à un processus : remplaçante de la base SQLite pour les essais ou
+    modèle pour brancher un autre stockage (Redis...)."""
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.travaux: List[Dict[str, Any]] = []
+        self.cles = set()
+
+    def ajouter(self, type_travail: str, urls: Iterable[str]) -> int:
+        ajoutes = 0
+        with self.verrou:
+            for url in urls:
+                if (type_travail, url) in self.cles:
+                    continue
+                self.cles.add((type_travail, url))
+                self.travaux.append({"id": len(self.travaux) + 1, "type": type_travail, "url": url,
+                                     "etat": EN_ATTENTE, "tentatives": 0, "travailleur": None,
+                                     "bail_expire": None, "resultat": None, "erreur": None})
+                ajoutes += 1
+        return ajoutes
+
+    def prendre(self, type_travail: str, travailleur: str, nombre: int = TAILLE_LOT,
+                duree_bail: float = DUREE_BAIL) -> List[Travail]:
+        maintenant = time.time()
+        pris = []
+        with self.verrou:
+            for travail in self.travaux:
+                if len(pris) >= nombre:
+                    break
+                if travail["type"] != type_travail:
+                    continue
+                expire = travail["etat"] == EN_COURS and travail["bail_expire"] < maintenant
+                if expire and travail["tentatives"] >= TENTATIVES_MAX:
+                    logger.warning(f"Bail expiré après {travail['tentatives']} tentatives pour {travail['url']}, "
+                                   f"travail en échec")
+                    travail.update(etat=ECHEC, erreur=ERREUR_BAIL_EXPIRE, bail_expire=None)
+                    continue
+                if travail["etat"] == EN_ATTENTE or expire:
+                    if expire:
+                        logger.warning(f"Bail expiré repris pour {travail['url']}")
+                    travail.update(etat=EN_COURS, travailleur=travailleur,
+                                   bail_expire=maintenant + duree_bail, tentatives=travail["tentatives"] + 1)
+                    pris.append(Travail(travail["id"], travail["type"], travail["url"], travail["tentatives"]))
+        return pris
+
+    def _travail_sous_bail(self, travail: Travail, travailleur: str) -> Optional[Dict[str, Any]]:
+        enregistrement = self.travaux[travail.id - 1]
+        if enregistrement["etat"] == EN_COURS and enregistrement["travailleur"] == travailleur:
+            return enregistrement
+        return None
+
+    def confirmer(self, travail: Travail, travailleur: str, resultat: Any):
+        with self.verrou:
+            enregistrement = self._travail_sous_bail(travail, travailleur)
+            if enregistrement:
+                enregistrement.update(etat=etat_confirme(resultat),
+                                      resultat=encoder_resultat(resultat) if resultat else None,
+                                      bail_expire=None, erreur=None)
+
+    def rejeter(self, travail: Travail, travailleur: str, erreur: str):
+        with self.verrou:
+            enregistrement = self._travail_sous_bail(travail, travailleur)
+            if enregistrement:
+                enregistrement.update(etat=ECHEC if travail.tentatives >= TENTATIVES_MAX else EN_ATTENTE,
+                                      erreur=erreur, bail_expire=None)
+
+    def etat(self, type_travail: Optional[str] = None) -> Dict[str, int]:
+        compteur: Dict[str, int] = {}
+        with self.verrou:
+            for travail in self.travaux:
+                if type_travail is None or travail["type"] == type_travail:
+                    compteur[travail["etat"]] = compteur.get(travail["etat"], 0) + 1
+        return compteur
+
+    def resultats(self, type_travail: str) -> List[Any]:
+        with self.verrou:
+            return [decoder_resultat(type_travail, travail["resultat"]) for travail in self.travaux
+                    if travail["type"] == type_travail and travail["etat"] == TERMINE]
+
+
+def ouvrir_file(adresse: str) -> FileTravaux:
+    """'memoire' pour une file en mémoire, sinon le chemin de la base SQLite."""
+    if adresse == "memoire":
+        return FileTravauxMemoire()
+    return FileTravauxSQLite(adresse)
+
+
+async def travailler(file: FileTravaux, type_travail: str, concurrence: Optional[int] = None,
+                     duree_bail: float = DUREE_BAIL) -> int:
+    """Traite les travaux d'un type jusqu'à ce qu'il n'en reste plus en attente ni sous bail.
+    Retourne le nombre de travaux confirmés par ce travailleur.
+
+    Les appels à la file (SQLite : verrou et écriture disque) passent par asyncio.to_thread pour ne
+    pas bloquer les téléchargements en cours."""
+    fonction = fonction_travail(type_travail)
+    travailleur = identifiant_travailleur()
+    taille_lot = concurrence or TAILLE_LOT
+    confirmes = 0
+
+    async def traiter(travail: Travail, session: aiohttp.ClientSession):
+        nonlocal confirmes
+        try:
+            resultat = await fonction(travail.url, session)
+        except Exception as e:
+            logger.error(f"Erreur lors du traitement de l'URL {travail.url}: {e}")
+            await asyncio.to_thread(file.rejeter, travail, travailleur, f"{type(e).__name__} {e}")
+            return
+        await asyncio.to_thread(file.confirmer, travail, travailleur, resultat)
+        confirmes += 1
+
+    async with aiohttp.ClientSession() as session:
+        while True:
+            travaux = await asyncio.to_thread(file.prendre, type_travail, travailleur, taille_lot, duree_bail)
+            if metriques.actif:
+                for etat, nombre in (await asyncio.to_thread(file.etat, type_travail)).items():
+                    metriques.FILE_TRAVAUX.definir(nombre, type=type_travail, etat=etat)
+            if travaux:
+                await rassembler([traiter(travail, session) for travail in travaux], concurrence)
+                continue
+
+            etat = await asyncio.to_thread(file.etat, type_travail)
+            if not etat.get(EN_ATTENTE) and not etat.get(EN_COURS):
+                break
+            logger.info(f"{etat.get(EN_COURS, 0)} travaux sous bail d'autres travailleurs, attente")
+            await asyncio.sleep(ATTENTE_BAUX)
+
+    logger.info(f"Travailleur {travailleur} : {confirmes} travaux confirmés, état de la file {file.etat(type_travail)}")
+    return confirmes
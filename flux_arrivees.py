@@ -0,0 +1,91 @@
+import csv
+from itertools import groupby
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from chronometre import chronometrer
+from fichiers import ENCODAGE_CSV, TAILLE_TAMPON, ecrire_csv
+from tri import TAILLE_LOT_TRI, identite, trier_lignes
+
+
+# (resultats_pmu, places, numero_course, hippodrome, non_partants, partant), comme extraire_donnees_arrivee
+ResultatArrivee = Tuple[Dict[str, Tuple[str, str]], Dict[str, int], Optional[str], Optional[str], Set[str], Optional[str]]
+CleCourse = Tuple[str, str]
+
+
+def indexer_resultats(resultats: Iterable[Optional[ResultatArrivee]],
+                      cle_hippodrome: Callable[[str], str] = identite) -> Dict[CleCourse, List[ResultatArrivee]]:
+    """Indexe les résultats d'arrivée par (hippodrome, course), dans l'ordre des URLs.
+
+    Les résultats incomplets sont écartés, comme dans mettre_a_jour_csv."""
+    index = {}
+    for resultat in resultats:
+        if not resultat:
+            continue
+        numero_course, hippodrome, partant = resultat[2], resultat[3], resultat[5]
+        if not numero_course or not hippodrome or not partant:
+            logger.error("Numéro de course ou hippodrome ou partant manquant dans les données d'arrivée.")
+            continue
+        index.setdefault((cle_hippodrome(hippodrome), numero_course), []).append(resultat)
+    return index
+
+
+def appliquer_resultat(lignes: List[Dict[str, str]], resultat: ResultatArrivee) -> List[Dict[str, str]]:
+    """Applique un résultat d'arrivée aux lignes d'une course : les non-partants sont retirés,
+    les rapports, la place et le nombre de partants sont renseignés."""
+    resultats_pmu, places, _, _, non_partants, partant = resultat
+    lignes_mises_a_jour = []
+    for ligne in lignes:
+        numero_cheval = ligne['NumChev']
+        if numero_cheval in non_partants:
+            continue
+        ligne['RAP-G'], ligne['RAP-P'] = resultats_pmu.get(numero_cheval, ('0', '0'))
+        ligne['PLACE'] = str(places.get(numero_cheval, 12))
+        ligne['PARTANTS'] = partant
+        lignes_mises_a_jour.append(ligne)
+    return lignes_mises_a_jour
+
+
+def generer_lignes(courses: Iterator[Tuple[CleCourse, Iterator[Dict[str, str]]]],
+                   index: Dict[CleCourse, List[ResultatArrivee]]) -> Iterator[Dict[str, str]]:
+    """Parcourt les courses une à une : seules les lignes de la course en cours sont en mémoire."""
+    for cle, lignes_course in courses:
+        lignes = list(lignes_course)
+        for resultat in index.get(cle, []):
+            lignes = appliquer_resultat(lignes, resultat)
+        yield from lignes
+
+
+@chronometrer("flux_csv")
+def ecrire_arrivees_en_flux(fichier_partants: str, fichier_sortie: str,
+                            resultats: Iterable[Optional[ResultatArrivee]],
+                            cle_hippodrome: Callable[[str], str] = identite,
+                            taille_lot: int = TAILLE_LOT_TRI) -> int:
+    """Complète le CSV des partants avec les résultats d'arrivée en le lisant course par course.
+
+    Le CSV écrit par sauvegarder_en_csv regroupe déjà les chevaux de chaque course : les lignes
+    consécutives de même (Hippodrome, COURSE) forment une course. La mémoire utilisée est donc celle
+    d'une course, quelle que soit la taille du fichier ; les lignes sont ensuite triées comme en mode
+    normal, par lots fusionnés sur disque si le fichier dépasse `taille_lot` lignes.
+
+    Retourne le nombre de lignes écrites (0 en cas d'erreur)."""
+    index = indexer_resultats(resultats, cle_hippodrome)
+    try:
+        with open(fichier_partants, 'r', newline='', encoding=ENCODAGE_CSV, buffering=TAILLE_TAMPON) as f:
+            lecteur = csv.DictReader(f)
+            if not lecteur.fieldnames:
+                logger.error(f"Le fichier CSV {fichier_partants} est vide.")
+                return 0
+
+            courses = groupby(lecteur, key=lambda ligne: (cle_hippodrome(ligne['Hippodrome']), ligne['COURSE']))
+            lignes = trier_lignes(generer_lignes(courses, index), taille_lot, cle_hippodrome)
+            nombre_lignes = ecrire_csv(fichier_sortie, lecteur.fieldnames, lignes)
+        logger.info(f"Sauvegarde du fichier CSV {fichier_sortie} réussie ({nombre_lignes} lignes).")
+        return nombre_lignes
+    except FileNotFoundError:
+        logger.error(f"Le fichier CSV {fichier_partants} n'a pas été trouvé.")
+        return 0
+    except Exception as e:
+        logger.error(f"Erreur lors du traitement en flux du fichier CSV {fichier_partants}: {e}")
+        return 0
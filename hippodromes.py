@@ -0,0 +1,39 @@
+import re
+from functools import lru_cache
+
+from unidecode import unidecode
+
+
+# Réunions dont le nom affiché sur geny.com ne correspond pas à l'hippodrome de FichierH
+# (clés sous forme normalisée, valeurs sous forme affichée).
+ALIAS_HIPPODROMES = {
+    "DIEPPE GENYBET": "Dieppe",
+    "GENYBET": "Dieppe",
+}
+
+# "jeudi : Strasbourg (R2)" -> "Strasbourg"
+MOTIF_NOM_REUNION = re.compile(r':\s*(.+?)\s*\(')
+MOTIF_CARACTERES_NON_AUTORISES = re.compile(r'[^A-Za-zÀ-ÿ0-9\s-]')
+
+TAILLE_CACHE_NORMALISATION = 4096
+
+
+@lru_cache(maxsize=TAILLE_CACHE_NORMALISATION)
+def normaliser_sans_alias(nom_hippodrome: str) -> str:
+    nom_normalise = unidecode(nom_hippodrome.upper().strip())
+    nom_normalise = nom_normalise.replace("-", " ")
+    return " ".join(nom_normalise.split())
+
+
+@lru_cache(maxsize=TAILLE_CACHE_NORMALISATION)
+def normaliser_nom_hippodrome(nom_hippodrome: str) -> str:
+    """Normalise le nom de l'hippodrome pour faciliter la correspondance (résultat mis en cache)."""
+    nom_normalise = normaliser_sans_alias(nom_hippodrome)
+    if nom_normalise in ALIAS_HIPPODROMES:
+        return normaliser_sans_alias(ALIAS_HIPPODROMES[nom_normalise])
+    return nom_normalise
+
+
+def appliquer_alias(nom_hippodrome: str) -> str:
+    """Retourne le nom affiché de l'hippodrome après application de la table d'alias."""
+    return ALIAS_HIPPODROMES.get(normaliser_sans_alias(nom_hippodrome), nom_hippodrome)
@@ -0,0 +1,92 @@
+"""Historique des courses de chaque cheval, construit à partir des CSV de partants ou d'arrivées.
+
+Les dates de course de tous les chevaux sont rangées dans un seul tableau trié par (cheval, date) :
+les dates précédant un jour donné se trouvent par recherche dichotomique (np.searchsorted), pour
+des milliers de chevaux à la fois.
+"""
+from typing import Iterable, List
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from fichiers import ENCODAGE_CSV
+
+
+FORMAT_DATE = '%d/%m/%Y'
+NOMBRE_DATES_PRECEDENTES = 4
+
+# Clé d'une course : code du cheval * 2**20 + jours depuis 1970 (à ±2**19 jours près, le cheval se
+# retrouve en arrondissant la clé divisée par 2**20)
+DECALAGE_CHEVAL = 2 ** 20
+
+
+def normaliser_nom_cheval(noms: pd.Series) -> pd.Series:
+    return noms.astype(str).str.strip().str.upper()
+
+
+def en_jours(dates: pd.Series) -> np.ndarray:
+    return dates.to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+
+class IndexHistorique:
+    """Dates de course triées de chaque cheval (sans doublon)."""
+
+    def __init__(self, chevaux: pd.Series, dates: pd.Series):
+        valides = (chevaux.notna() & dates.notna()).to_numpy()
+        codes, noms = pd.factorize(normaliser_nom_cheval(chevaux[valides]), sort=True)
+        cles = np.unique(codes.astype(np.int64) * DECALAGE_CHEVAL + en_jours(dates[valides]))
+
+        self.noms = pd.Index(noms)
+        self.codes = np.floor_divide(cles + DECALAGE_CHEVAL // 2, DECALAGE_CHEVAL)
+        self.jours = cles - self.codes * DECALAGE_CHEVAL
+        self.cles = cles
+
+    def __len__(self) -> int:
+        return len(self.cles)
+
+    def dates_precedentes(self, chevaux: pd.Series, dates_du_jour: pd.Series,
+                          nombre: int = NOMBRE_DATES_PRECEDENTES) -> List[pd.Series]:
+        """Pour chaque (cheval, jour), retourne les `nombre` dernières dates de course strictement
+        antérieures au jour, de la plus récente à la plus ancienne (NaT s'il n'y en a pas)."""
+        codes = self.noms.get_indexer(normaliser_nom_cheval(chevaux)).astype(np.int64)
+        connus = (codes >= 0) & dates_du_jour.notna().to_numpy()
+        jours = en_jours(dates_du_jour.fillna(pd.Timestamp(0)))
+
+        # Première course du cheval à partir du jour : les précédentes sont juste avant
+        position = np.searchsorted(self.cles, codes * DECALAGE_CHEVAL + jours, side='left')
+        colonnes = []
+        for rang in range(1, nombre + 1):
+            indice = np.clip(position - rang, 0, None)
+            trouve = connus & (position - rang >= 0)
+            if len(self.cles):
+                indice = np.minimum(indice, len(self.cles) - 1)
+                trouve &= self.codes[indice] == codes
+                dates = pd.Series(self.jours[indice].astype('datetime64[D]'), index=chevaux.index)
+            else:
+                dates = pd.Series(pd.NaT, index=chevaux.index)
+            colonnes.append(dates.astype('datetime64[ns]').where(trouve))
+        return colonnes
+
+
+def lire_courses(fichiers_csv: Iterable[str]) -> pd.DataFrame:
+    """Lit les colonnes DATE et CHEVAL des CSV de partants ou d'arrivées."""
+    tables = []
+    for fichier in fichiers_csv:
+        try:
+            tables.append(pd.read_csv(fichier, usecols=['DATE', 'CHEVAL'], dtype=str, encoding=ENCODAGE_CSV))
+        except FileNotFoundError:
+            logger.error(f"Le fichier CSV {fichier} n'a pas été trouvé.")
+        except ValueError as e:
+            logger.error(f"Colonnes DATE ou CHEVAL absentes du fichier CSV {fichier}: {e}")
+    if not tables:
+        return pd.DataFrame({'DATE': pd.Series(dtype=str), 'CHEVAL': pd.Series(dtype=str)})
+    return pd.concat(tables, ignore_index=True)
+
+
+def construire_index(fichiers_csv: Iterable[str]) -> IndexHistorique:
+    courses = lire_courses(fichiers_csv)
+    dates = pd.to_datetime(courses['DATE'], format=FORMAT_DATE, errors='coerce')
+    index = IndexHistorique(courses['CHEVAL'], dates)
+    logger.info(f"Historique : {len(index)} course(s) de {len(index.noms)} cheval/chevaux")
+    return index
@@ -0,0 +1,168 @@
+"""Historique des cotes : relève les pages de partants à intervalle régulier et n'ajoute au CSV que
+les cotes qui ont changé depuis le relevé précédent.
+
+Les pages sont redemandées avec leurs validateurs HTTP (une réponse 304 ne coûte ni transfert ni
+analyse), puis le tableau des partants est découpé dans les octets de la page et haché (blake2b) :
+une page dont le tableau n'a pas changé n'est pas analysée du tout.
+"""
+import os
+import csv
+import asyncio
+import hashlib
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+from loguru import logger
+from selectolax.parser import HTMLParser
+
+from chronometre import mesurer, terminer_rapport
+from concurrence import rassembler
+from decoupage import REGION_TABLEAU_PARTANTS, REGIONS_PARTANTS
+from fichiers import ENCODAGE_CSV
+import metriques
+from telechargement import CacheConditionnel, construire_arbre, requete
+import partants
+
+
+FICHIER_COTES = "historique_cotes.csv"
+INTERVALLE = 300.0
+
+CHAMPS_COTES = ['HORODATAGE', 'DATE', 'Hippodrome', 'COURSE', 'NumChev', 'CHEVAL',
+                'Cotes-Pmu', 'Cotes-Genybet', 'URL']
+
+Cotes = Tuple[str, str]
+
+
+def empreinte(contenu: bytes) -> bytes:
+    """Empreinte du tableau des partants (de la page entière s'il est introuvable)."""
+    with mesurer("empreinte"):
+        region = REGION_TABLEAU_PARTANTS(contenu)
+        return hashlib.blake2b(region if region is not None else contenu, digest_size=16).digest()
+
+
+def numeros_chevaux(arbre: HTMLParser) -> Dict[str, str]:
+    """Numéro de chaque cheval (première colonne du tableau des partants), par nom."""
+    numeros = {}
+    for ligne in arbre.css('table#tableau_partants tbody tr'):
+        nom = ligne.css_first('span.leftWidth100 a.lienFiche')
+        numero = ligne.css_first('td')
+        if nom and numero:
+            numeros[nom.text().strip()] = numero.text().strip()
+    return numeros
+
+
+class SuiviCotes:
+    """Empreinte du dernier tableau et dernières cotes connues de chaque page, par nom de cheval :
+    un cheval retiré ou un tableau réordonné ne décale pas les cotes des autres."""
+
+    def __init__(self):
+        self.empreintes: Dict[str, bytes] = {}
+        self.validateurs: Dict[str, Dict[str, str]] = {}
+        self.cotes: Dict[str, Dict[str, Cotes]] = {}
+        self.pages_inchangees = 0
+        self.pages_analysees = 0
+
+    def charger(self, fichier_cotes: str):
+        """Reprend les dernières cotes d'un historique existant : après un redémarrage, seules les
+        cotes qui ont changé depuis sont ajoutées."""
+        if not os.path.exists(fichier_cotes):
+            return
+        with open(fichier_cotes, 'r', newline='', encoding=ENCODAGE_CSV) as f:
+            for ligne in csv.DictReader(f):
+                self.cotes.setdefault(ligne['URL'], {})[ligne['CHEVAL']] = (ligne['Cotes-Pmu'], ligne['Cotes-Genybet'])
+        logger.info(f"Dernières cotes de {len(self.cotes)} page(s) reprises de {fichier_cotes}")
+
+    def analyser(self, url: str, contenu: bytes, horodatage: str) -> List[Dict[str, str]]:
+        """Retourne les lignes des chevaux dont les cotes ont changé (aucune si le tableau est identique)."""
+        nouvelle_empreinte = empreinte(contenu)
+        if self.empreintes.get(url) == nouvelle_empreinte:
+            self.pages_inchangees += 1
+            return []
+        self.empreintes[url] = nouvelle_empreinte
+        self.pages_analysees += 1
+
+        arbre = construire_arbre(contenu, url, REGIONS_PARTANTS)
+        hippodrome = partants.extraire_hippodrome(arbre)
+        numero_course = partants.extraire_numero_course(arbre)
+        date = partants.extraire_date_de_url(url)
+        cotes_page = self.cotes.setdefault(url, {})
+        numeros = numeros_chevaux(arbre)
+
+        lignes = []
+        for cheval in partants.extraire_chevaux_et_gains(arbre):
+            cotes = (cheval['cote_pmu'], cheval['cote_genybet'])
+            if cotes_page.get(cheval['nom']) == cotes:
+                continue
+            cotes_page[cheval['nom']] = cotes
+            lignes.append({
+                'HORODATAGE': horodatage,
+                'DATE': date,
+                'Hippodrome': hippodrome,
+                'COURSE': numero_course,
+                'NumChev': numeros.get(cheval['nom'], ''),
+                'CHEVAL': cheval['nom'],
+                'Cotes-Pmu': cotes[0],
+                'Cotes-Genybet': cotes[1],
+                'URL': url,
+            })
+        return lignes
+
+
+def ajouter_lignes(fichier_cotes: str, lignes: List[Dict[str, str]]):
+    """Ajoute les lignes en fin d'historique (l'en-tête n'est écrit qu'à la création du fichier)."""
+    nouveau = not os.path.exists(fichier_cotes) or os.path.getsize(fichier_cotes) == 0
+    with open(fichier_cotes, 'a', newline='', encoding=ENCODAGE_CSV if nouveau else 'utf-8') as f:
+        ecrivain = csv.DictWriter(f, fieldnames=CHAMPS_COTES)
+        if nouveau:
+            ecrivain.writeheader()
+        ecrivain.writerows(lignes)
+    metriques.LIGNES_ECRITES.inc(len(lignes), fichier=os.path.basename(fichier_cotes))
+
+
+async def relever(urls: List[str], suivi: SuiviCotes, session: aiohttp.ClientSession,
+                  concurrence: Optional[int] = None) -> List[Dict[str, str]]:
+    horodatage = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+
+    async def relever_page(url: str) -> List[Dict[str, str]]:
+        try:
+            entetes = CacheConditionnel.entetes(suivi.validateurs.get(url, {}))
+            statut, contenu, validateurs = await requete(url, session, entetes)
+        except Exception as e:
+            logger.error(f"Erreur HTTP survenue pour l'URL {url}: {e}")
+            return []
+        if statut == 304:
+            suivi.pages_inchangees += 1
+            return []
+        suivi.validateurs[url] = validateurs
+        return suivi.analyser(url, contenu, horodatage)
+
+    resultats = await rassembler([relever_page(url) for url in urls], concurrence)
+    return [ligne for lignes in resultats for ligne in lignes]
+
+
+async def main(urls: List[str], fichier_sortie: str = FICHIER_COTES, intervalle: float = INTERVALLE,
+               releves: Optional[int] = None, concurrence: Optional[int] = None):
+    """Relève les pages toutes les `intervalle` secondes, `releves` fois (indéfiniment par défaut)."""
+    partants.configurer_logger()
+
+    suivi = SuiviCotes()
+    suivi.charger(fichier_sortie)
+
+    numero_releve = 0
+    async with aiohttp.ClientSession() as session:
+        while releves is None or numero_releve < releves:
+            debut = time.monotonic()
+            lignes = await relever(urls, suivi, session, concurrence)
+            if lignes:
+                await asyncio.to_thread(ajouter_lignes, fichier_sortie, lignes)
+            numero_releve += 1
+            logger.info(f"Relevé {numero_releve} : {len(lignes)} cote(s) modifiée(s), "
+                        f"{suivi.pages_inchangees} page(s) inchangée(s) et {suivi.pages_analysees} analysée(s) au total")
+
+            if releves is not None and numero_releve >= releves:
+                break
+            await asyncio.sleep(max(0.0, intervalle - (time.monotonic() - debut)))
+
+    terminer_rapport()
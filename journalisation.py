@@ -0,0 +1,96 @@
+"""Configuration du logger commune à tous les scripts.
+
+Les messages sont écrits par un thread dédié (enqueue=True) : une écriture dans le fichier de log ne
+bloque jamais la boucle asyncio. Les avertissements et erreurs sont comptés par endroit du code qui
+les émet (module, fonction, ligne) : seuls les premiers de chaque endroit sont affichés à l'écran,
+les suivants sont seulement comptés et résumés à la fin de l'exécution. Une page au format inattendu
+ne noie donc plus la console sous une erreur par cheval. Le fichier de log, lui, reçoit tous les
+messages : c'est la seule trace durable des pages en échec.
+"""
+import sys
+from typing import Dict, Tuple
+
+from loguru import logger
+
+import metriques
+
+
+FICHIER_LOG = "log_partants.log"
+# Nombre de messages affichés pour un même endroit du code avant de les masquer
+MESSAGES_PAR_ENDROIT = 5
+NIVEAU_LIMITE = 30  # WARNING : les messages INFO ne sont ni comptés ni masqués
+LONGUEUR_EXEMPLE = 150
+FORMAT_CONSOLE = ("<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+                  "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>")
+
+Endroit = Tuple[str, str, int]
+
+
+class CompteurMessages:
+    """Nombre d'avertissements et d'erreurs de l'exécution, par endroit du code."""
+
+    def __init__(self, limite: int = MESSAGES_PAR_ENDROIT):
+        self.limite = limite
+        self.comptes: Dict[Endroit, int] = {}
+        self.exemples: Dict[Endroit, Tuple[str, str]] = {}
+
+    def marquer(self, record):
+        """Patcher loguru, appelé une fois par message avant les sinks : marque les messages à masquer
+        à l'écran."""
+        if record["level"].no < NIVEAU_LIMITE:
+            return
+        endroit = (record["name"], record["function"], record["line"])
+        metriques.MESSAGES.inc(niveau=record["level"].name, fonction=record["function"])
+        compte = self.comptes.get(endroit, 0) + 1
+        self.comptes[endroit] = compte
+        if compte == 1:
+            self.exemples[endroit] = (record["level"].name, record["message"][:LONGUEUR_EXEMPLE])
+        elif compte == self.limite:
+            record["extra"]["dernier_affiche"] = True
+        elif compte > self.limite:
+            record["extra"]["masque"] = True
+
+    def reinitialiser(self):
+        self.comptes.clear()
+        self.exemples.clear()
+
+
+compteur_messages = CompteurMessages()
+
+
+def non_masque(record) -> bool:
+    return not record["extra"].get("masque")
+
+
+def format_console(record) -> str:
+    suite = " (messages suivants masqués à l'écran, voir le fichier de log)" if record["extra"].get("dernier_affiche") else ""
+    return FORMAT_CONSOLE + suite + "\n{exception}"
+
+
+def configurer_logger(fichier_log: str = FICHIER_LOG):
+    """Configure le logger : fichier (WARNING, tous les messages) et sortie d'erreur (INFO, messages
+    répétés masqués), écrits en arrière-plan. Les compteurs de messages ne sont remis à zéro que par
+    terminer_journal : une commande qui enchaîne plusieurs scripts les résume tous à la fin."""
+    logger.configure(
+        handlers=[
+            {"sink": fichier_log, "level": "WARNING", "rotation": "500 KB", "retention": "3 days",
+             "enqueue": True},
+            {"sink": sys.stderr, "level": "INFO", "enqueue": True, "filter": non_masque,
+             "format": format_console},
+        ],
+        patcher=compteur_messages.marquer,
+    )
+
+
+def terminer_journal():
+    """Résume les avertissements et erreurs de l'exécution, puis attend l'écriture de tous les messages."""
+    comptes = compteur_messages.comptes
+    if comptes:
+        masques = sum(max(0, compte - compteur_messages.limite) for compte in comptes.values())
+        logger.info(f"Avertissements et erreurs : {sum(comptes.values())} message(s) venant de "
+                    f"{len(comptes)} endroit(s) du code, dont {masques} masqué(s) à l'écran")
+        for endroit, compte in sorted(comptes.items(), key=lambda element: -element[1]):
+            niveau, exemple = compteur_messages.exemples[endroit]
+            logger.info(f"  {compte:>6} × {niveau:<7} {endroit[0]}:{endroit[1]}:{endroit[2]} - {exemple}")
+    compteur_messages.reinitialiser()
+    logger.complete()
@@ -0,0 +1,197 @@
+"""Métriques au format texte Prometheus, servies en HTTP pendant une exécution.
+
+Désactivées par défaut : tant que demarrer_serveur n'a pas été appelé, chaque point de mesure se
+limite à un test de `actif`. Une fois activées, une mesure coûte un verrou et une mise à jour de
+dictionnaire ; le serveur (aiohttp.web) tourne dans un thread à part, avec sa propre boucle, et ne
+ralentit donc ni la boucle des téléchargements ni les scripts synchrones.
+
+    python cli.py cotes urls_du_jour.txt --metriques 9100
+    curl http://127.0.0.1:9100/metrics
+"""
+import time
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+from loguru import logger
+
+
+PREFIXE = "geny_"
+HOTE_PAR_DEFAUT = "127.0.0.1"
+CHEMIN_METRIQUES = "/metrics"
+DELAI_DEMARRAGE = 5.0
+
+# Limites des seaux des histogrammes de durée, en secondes
+SEAUX_DUREE = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Etiquettes = Tuple[Tuple[str, str], ...]
+
+actif = False
+verrou = threading.Lock()
+REGISTRE: List["Metrique"] = []
+
+
+def cle_etiquettes(etiquettes: Dict[str, object]) -> Etiquettes:
+    return tuple(sorted((nom, str(valeur)) for nom, valeur in etiquettes.items()))
+
+
+def formater_etiquettes(cle: Etiquettes, supplementaires: Etiquettes = ()) -> str:
+    paires = cle + supplementaires
+    if not paires:
+        return ""
+    echapper = lambda valeur: valeur.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join(f'{nom}="{echapper(valeur)}"' for nom, valeur in paires) + "}"
+
+
+def formater_nombre(valeur: float) -> str:
+    return str(int(valeur)) if float(valeur).is_integer() else repr(float(valeur))
+
+
+class Metrique(ABC):
+    """Métrique enregistrée dans REGISTRE ; chaque type donne ses lignes au format texte Prometheus."""
+
+    type_prometheus = "untyped"
+
+    def __init__(self, nom: str, aide: str):
+        self.nom = PREFIXE + nom
+        self.aide = aide
+        self.valeurs: Dict[Etiquettes, object] = {}
+        REGISTRE.append(self)
+
+    @abstractmethod
+    def lignes(self) -> List[str]:
+        """Lignes de valeurs de la métrique (sans les lignes HELP et TYPE)."""
+        ...
+
+    def exposer(self) -> List[str]:
+        return [f"# HELP {self.nom} {self.aide}", f"# TYPE {self.nom} {self.type_prometheus}"] + self.lignes()
+
+
+class Compteur(Metrique):
+    type_prometheus = "counter"
+
+    def inc(self, valeur: float = 1, **etiquettes):
+        if not actif:
+            return
+        cle = cle_etiquettes(etiquettes)
+        with verrou:
+            self.valeurs[cle] = self.valeurs.get(cle, 0) + valeur
+
+    def lignes(self) -> List[str]:
+        return [f"{self.nom}{formater_etiquettes(cle)} {formater_nombre(valeur)}"
+                for cle, valeur in sorted(self.valeurs.items())]
+
+
+class Jauge(Compteur):
+    type_prometheus = "gauge"
+
+    def definir(self, valeur: float, **etiquettes):
+        if not actif:
+            return
+        with verrou:
+            self.valeurs[cle_etiquettes(etiquettes)] = valeur
+
+
+class Histogramme(Metrique):
+    type_prometheus = "histogram"
+
+    def __init__(self, nom: str, aide: str, seaux: Sequence[float] = SEAUX_DUREE):
+        super().__init__(nom, aide)
+        self.seaux = tuple(seaux)
+
+    def observer(self, valeur: float, **etiquettes):
+        if not actif:
+            return
+        cle = cle_etiquettes(etiquettes)
+        with verrou:
+            comptes = self.valeurs.get(cle)
+            if comptes is None:
+                # Un compte par seau, puis +Inf, puis la somme des valeurs
+                comptes = self.valeurs[cle] = [0] * (len(self.seaux) + 1) + [0.0]
+            comptes[bisect_left(self.seaux, valeur)] += 1
+            comptes[-1] += valeur
+
+    def lignes(self) -> List[str]:
+        lignes = []
+        for cle, comptes in sorted(self.valeurs.items()):
+            cumul = 0
+            for limite, compte in zip(self.seaux + (float("inf"),), comptes):
+                cumul += compte
+                le = "+Inf" if limite == float("inf") else formater_nombre(limite)
+                lignes.append(f"{self.nom}_bucket{formater_etiquettes(cle, (('le', le),))} {cumul}")
+            lignes.append(f"{self.nom}_sum{formater_etiquettes(cle)} {formater_nombre(comptes[-1])}")
+            lignes.append(f"{self.nom}_count{formater_etiquettes(cle)} {cumul}")
+        return lignes
+
+
+DUREE_ETAPES = Histogramme("etape_duree_secondes", "Durée des étapes chronométrées (fetch, HTMLParser, extraire_*...)")
+PAGES_TELECHARGEES = Compteur("pages_telechargees_total", "Pages téléchargées (ou lues dans une archive)")
+OCTETS_TELECHARGES = Compteur("octets_telecharges_total", "Octets des pages téléchargées")
+PAGES_NON_MODIFIEES = Compteur("pages_non_modifiees_total", "Réponses 304 : pages ni retransférées ni analysées")
+DERNIERE_PAGE = Jauge("derniere_page_timestamp_secondes", "Horodatage Unix de la dernière page reçue")
+REPONSES_HTTP = Compteur("reponses_http_total", "Réponses HTTP par code de statut")
+ERREURS_HTTP = Compteur("erreurs_http_total", "Requêtes sans réponse HTTP, par type d'exception")
+PAGES_ANALYSEES = Compteur("pages_analysees_total", "Pages analysées par HTMLParser")
+ECHECS_EXTRACTION = Compteur("echecs_extraction_total",
+                             "Extractions en échec (nœud absent, texte inattendu ou exception), par script et par extracteur")
+MESSAGES = Compteur("messages_total", "Avertissements et erreurs journalisés, par niveau et par fonction")
+LIGNES_ECRITES = Compteur("lignes_ecrites_total", "Lignes écrites dans les fichiers CSV, par fichier")
+COROUTINES_EN_ATTENTE = Jauge("coroutines_en_attente", "Coroutines en attente d'une place (limite --concurrence)")
+COROUTINES_EN_COURS = Jauge("coroutines_en_cours", "Coroutines en cours dans les limites de --concurrence")
+REQUETES_SECOURS = Compteur("requetes_secours_total", "Requêtes lentes doublées (--secours), par requête gagnante")
+LIMITE_CONCURRENCE = Jauge("limite_concurrence", "Limite adaptative du nombre de requêtes HTTP en cours (--concurrence auto)")
+FILE_TRAVAUX = Jauge("file_travaux", "Travaux de la file partagée par type et par état")
+PROXY_REQUETES = Compteur("proxy_requetes_total", "Requêtes passées par chaque proxy, par résultat")
+PROXIES_DISPONIBLES = Jauge("proxies_disponibles", "Proxies de la réserve non exclus")
+DEBUT = Jauge("debut_timestamp_secondes", "Horodatage Unix du démarrage de l'exécution")
+
+
+def exposer() -> str:
+    """Toutes les métriques au format texte Prometheus."""
+    with verrou:
+        lignes = [ligne for metrique in REGISTRE for ligne in metrique.exposer()]
+    return "\n".join(lignes) + "\n"
+
+
+async def servir(hote: str, port: int, pret: threading.Event):
+    from aiohttp import web
+
+    async def metriques(request: web.Request) -> web.Response:
+        return web.Response(text=exposer(), content_type="text/plain", charset="utf-8")
+
+    application = web.Application()
+    application.router.add_get(CHEMIN_METRIQUES, metriques)
+    runner = web.AppRunner(application, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, hote, port).start()
+    pret.set()
+    # Le thread est un démon : le serveur s'arrête avec le programme
+    await asyncio.Event().wait()
+
+
+def demarrer_serveur(port: int, hote: str = HOTE_PAR_DEFAUT) -> bool:
+    """Active les métriques et les sert sur http://hote:port/metrics dans un thread dédié.
+    Retourne False si le serveur n'a pas pu démarrer (port déjà utilisé...)."""
+    global actif
+    pret = threading.Event()
+    erreurs: List[BaseException] = []
+
+    def executer():
+        try:
+            asyncio.run(servir(hote, port, pret))
+        except Exception as e:
+            erreurs.append(e)
+            pret.set()
+
+    threading.Thread(target=executer, name="serveur-metriques", daemon=True).start()
+    if not pret.wait(DELAI_DEMARRAGE) or erreurs:
+        logger.error(f"Impossible de démarrer le serveur de métriques sur {hote}:{port}: "
+                     f"{erreurs[0] if erreurs else 'délai dépassé'}")
+        return False
+
+    actif = True
+    DEBUT.definir(time.time())
+    logger.info(f"Métriques disponibles sur http://{hote}:{port}{CHEMIN_METRIQUES}")
+    return True
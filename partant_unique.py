@@ -1,14 +1,20 @@
 import re
-import sys
-import csv
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 from urllib.parse import urljoin
 
-import pandas as pd
-from unidecode import unidecode
-
 from loguru import logger
+from chronometre import chronometrer, terminer_rapport
+from journalisation import configurer_logger
+from profilage import lancer_point_entree
+from concurrence import rassembler
+from fichiers import ecrire_csv
+import enrichissement
+import metriques
+from decoupage import REGIONS_INFO_COURSE, REGIONS_PARTANTS_REUNION
+from referentiel import charger_referentiel, journaliser_rapprochements, valeurs_hippodrome
+from telechargement import telecharger, telecharger_et_extraire, construire_arbre
+from hippodromes import normaliser_nom_hippodrome
 from selectolax.parser import HTMLParser
 import asyncio
 import aiohttp
@@ -16,39 +22,32 @@ import aiohttp
 
 BASE_URL = "https://www.geny.com/"
 
+FICHIER_PARTANTS = "donnees_courses_partants.csv"
+FICHIER_EXCEL = "FichierH.xls"
+
 URLS_UNIQUES_PARTANTS = [
     "https://www.geny.com/partants-pmu/2024-09-24-vincennes-pmu-prix-hekate_c1521138"
 ]
 
 
-def configurer_logger():
-    """Configure le logger avec les paramètres appropriés."""
-    logger.remove()
-    fichier_log = "log_partants.log"
-    logger.add(fichier_log, rotation="500 KB",
-               retention="3 days", level="WARNING")
-    logger.add(sys.stderr, level="INFO")
-
-
 async def recuperer_les_urls(url: str) -> List[str]:
     try:
         async with aiohttp.ClientSession() as session:
-            async with session.get(url) as response:
-                texte_html = await response.text(encoding='utf-8')
-                arbre = HTMLParser(texte_html)
-                urls_node = arbre.css('a[accesskey]')
-                urls = [url]
-                urls += [urljoin(BASE_URL, url.attributes.get('href'))
-                         for url in urls_node if 'href' in url.attributes]
+            contenu = await telecharger(url, session)
+            arbre = construire_arbre(contenu, url)
+            urls_node = arbre.css('a[accesskey]')
+            urls = [url]
+            urls += [urljoin(BASE_URL, url.attributes.get('href'))
+                     for url in urls_node if 'href' in url.attributes]
 
-                return urls
+            return urls
 
     except Exception as e:
         logger.error(f"Erreur HTTP survenue pour l'URL {url}: {e}")
         return []
 
 
-async def traiter_liste_urls(liste_urls: List[str]) -> List[str]:
+async def traiter_liste_urls(liste_urls: List[str], concurrence: Optional[int] = None) -> List[str]:
     resultats = []
 
     async def recuperer_url(url: str):
@@ -56,47 +55,45 @@ async def traiter_liste_urls(liste_urls: List[str]) -> List[str]:
         resultats.extend(urls_extraites)
 
     taches = [recuperer_url(url) for url in liste_urls]
-    await asyncio.gather(*taches)
+    await rassembler(taches, concurrence)
 
     return resultats
 
 
-async def contient_attele_ou_monte(url: str, session: aiohttp.ClientSession) -> bool:
-    try:
-        async with session.get(url) as response:
-            text_html = await response.text(encoding='utf-8')
+def est_attele_ou_monte(url: str, contenu: bytes) -> bool:
+    arbre = construire_arbre(contenu, url, REGIONS_INFO_COURSE)
+    info_course = arbre.css_first('span.infoCourse')
 
-        arbre = HTMLParser(text_html)
-        info_course = arbre.css_first('span.infoCourse')
+    if info_course:
+        result = info_course.text(deep=True, separator='\n').strip()
+        pattern = r'\b(Mont[ée]|Attel[ée])\b'
+        match = re.search(pattern, result, re.MULTILINE)
 
-        if info_course:
-            result = info_course.text(deep=True, separator='\n').strip()
-            pattern = r'\b(Mont[ée]|Attel[ée])\b'
-            match = re.search(pattern, result, re.MULTILINE)
+        if match:
+            return True
 
-            if match:
-                return True
+        return False
 
-            return False
+    else:
+        print(
+            f"Span avec la classe 'infoCourse' non trouvé dans l'url: {url}")
+        return False
 
-        else:
-            print(
-                f"Span avec la classe 'infoCourse' non trouvé dans l'url: {url}")
-            return False
 
+async def tester_attele_ou_monte(url: str, session: aiohttp.ClientSession) -> bool:
+    return await telecharger_et_extraire(url, session, "attele_ou_monte",
+                                         lambda contenu: est_attele_ou_monte(url, contenu))
+
+
+async def contient_attele_ou_monte(url: str, session: aiohttp.ClientSession) -> bool:
+    try:
+        return await tester_attele_ou_monte(url, session)
     except Exception as e:
         logger.error(f"Erreur lors de la requete HTTP pour l'URL {url}: {e}")
         return False
 
 
-def normaliser_nom_hippodrome(nom_hippodrome: str) -> str:
-    """Normalise le nom de l'hippodrome pour faciliter la correspondance."""
-    nom_normalise = unidecode(nom_hippodrome.upper().strip())
-    nom_normalise = nom_normalise.replace("-", " ")
-    nom_normalise = " ".join(nom_normalise.split())
-    return nom_normalise
-
-
+@chronometrer()
 def extraire_date_de_url(url: str) -> str:
     """Extrait et formate la date à partir de l'URL donnée."""
     correspondance_date = re.search(r'/(\d{4}-\d{2}-\d{2})-', url)
@@ -104,10 +101,12 @@ def extraire_date_de_url(url: str) -> str:
         chaine_date = correspondance_date.group(1)
         objet_date = datetime.strptime(chaine_date, '%Y-%m-%d')
         return objet_date.strftime('%d/%m/%Y')
+    metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_date_de_url")
     logger.warning(f"Date non trouvée dans l'URL: {url}")
     return ""
 
 
+@chronometrer()
 def extraire_hippodrome(arbre: HTMLParser) -> Optional[str]:
     try:
         container_hippodrome = arbre.css('#yui-main a')
@@ -118,13 +117,16 @@ def extraire_hippodrome(arbre: HTMLParser) -> Optional[str]:
         return normaliser_nom_hippodrome(hippodrome)
 
     except IndexError as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_hippodrome")
         logger.error(f' Le container hippodrome ne contient pas de valeur')
         return None
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_hippodrome")
         logger.error(f"Erreur lors de l'extraction de l'hippodrome : {e}")
         return None
 
 
+@chronometrer()
 def extraire_numero_course(arbre: HTMLParser) -> Optional[int]:
     """Extrait le numéro de course du HTML."""
     try:
@@ -132,26 +134,31 @@ def extraire_numero_course(arbre: HTMLParser) -> Optional[int]:
         if noeud_numero_course:
             numero_course_text = noeud_numero_course.text().strip()
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
             logger.error("Aucun noeud correpondant au Numero de course")
             return None
 
         return numero_course_text[0]
 
     except IndexError as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
         logger.error("Erreur d'accès au numero de course dans le texte")
         return None
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
         logger.error(f"Erreur lors de l'extraction du numéro de course : {e}")
         return None
 
 
+@chronometrer()
 def extraire_prix_et_partants(arbre: HTMLParser) -> Tuple[Optional[int], Optional[int]]:
     """Extrait le prix et le nombre de partants du HTML."""
     try:
         noeud_info_course = arbre.css_first("span.infoCourse")
         if noeud_info_course:
-            texte_info_course = noeud_info_course.text().replace("ï¿½", "")
+            texte_info_course = noeud_info_course.text()
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_prix_et_partants")
             logger.error(
                 "Aucun element avec l'attribut 'span.infoCourse' trouvé lors de l'extraction du 'prix' et 'partants'")
             return None, None
@@ -162,28 +169,31 @@ def extraire_prix_et_partants(arbre: HTMLParser) -> Tuple[Optional[int], Optiona
             r'-\s*(\d+)\s*Partants', texte_info_course)
 
         if correspondance_prix and correspondance_partants:
-            prix_str = correspondance_prix.group(1).replace(" ", "")
-            prix_str_nettoye = re.sub(r'[^\x20-\x7E]', '', prix_str)
-            prix = int(prix_str_nettoye)/1000
+            # "19 500" : le séparateur de milliers est une espace insécable
+            prix = int("".join(correspondance_prix.group(1).split()))/1000
             if prix.is_integer():
                 prix = int(prix)
             partants = correspondance_partants.group(1).replace(' ', '')
             return prix, partants
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_prix_et_partants")
             logger.error(
                 "Le prix ou le partant n'a pas été trouvé dans le texte lors de l'extraction")
             return None, None
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_prix_et_partants")
         logger.error(
             f"Erreur lors de l'extraction du prix et des partants : {e}")
         return None, None
 
 
+@chronometrer()
 def extraire_chevaux_et_gains(arbre: HTMLParser) -> List[Dict[str, str]]:
     donnees_chevaux = []
     try:
         tableau = arbre.css_first('table#tableau_partants')
         if not tableau:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_chevaux_et_gains")
             logger.error("Tableau des partants non trouvé")
             return donnees_chevaux
 
@@ -198,6 +208,7 @@ def extraire_chevaux_et_gains(arbre: HTMLParser) -> List[Dict[str, str]]:
             1 if cotes_pmu_index is not None else None
 
         if gains_index is None or cotes_pmu_index is None or cotes_genybet_index is None:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_chevaux_et_gains")
             logger.error(
                 "Colonne 'Gains', 'Cotes' ou 'Genybet' non trouvée dans le tableau")
             return donnees_chevaux
@@ -243,48 +254,56 @@ def extraire_chevaux_et_gains(arbre: HTMLParser) -> List[Dict[str, str]]:
                             "cote_genybet": cote_genybet_texte
                         })
             except AttributeError as e:
+                metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_chevaux_et_gains")
                 logger.error(
                     f"Erreur lors de l'extraction des données du cheval : {e}")
 
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_chevaux_et_gains")
         logger.error(f"Erreur générale lors de l'analyse : {e}")
 
     return donnees_chevaux
 
 
-def charger_donnees_excel(chemin_fichier: str) -> pd.DataFrame:
-    """Charge les données du fichier Excel (.xls ou .xlsx) et les prépare pour la correspondance."""
+@chronometrer("chargement_excel")
+def charger_donnees_excel(chemin_fichier: str) -> Dict[str, Dict[str, str]]:
+    """Charge les données du fichier Excel (.xls ou .xlsx), indexées par nom d'hippodrome pour la correspondance."""
     try:
-        engine = 'xlrd' if chemin_fichier.endswith('.xls') else None
-        df = pd.read_excel(chemin_fichier, engine=engine)
-        df['Hippodrome'] = df['Hippodrome'].apply(normaliser_nom_hippodrome)
-        return df
+        return charger_referentiel(chemin_fichier, normaliser_nom_hippodrome)
     except Exception as e:
         logger.error(f"Erreur lors du chargement du fichier Excel : {e}")
-        return pd.DataFrame()
+        return {}
+
+
+def analyser_page(url: str, contenu: bytes) -> Dict[str, any]:
+    """Extrait les données d'une page de partants déjà téléchargée."""
+    arbre = construire_arbre(contenu, url, REGIONS_PARTANTS_REUNION)
+
+    date = extraire_date_de_url(url)
+    hippodrome = extraire_hippodrome(arbre)
+    numero_course = extraire_numero_course(arbre)
+    prix, partants = extraire_prix_et_partants(arbre)
+    donnees_chevaux = extraire_chevaux_et_gains(arbre)
+
+    return {
+        "date": date,
+        "hippodrome": hippodrome,
+        "numero_course": numero_course,
+        "prix": prix,
+        "partants": partants,
+        "donnees_chevaux": donnees_chevaux
+    }
+
+
+async def telecharger_donnees(url: str, session: aiohttp.ClientSession) -> Dict[str, any]:
+    """Comme extraire_donnees, mais une erreur de téléchargement est levée."""
+    return await telecharger_et_extraire(url, session, "partants_reunion", lambda contenu: analyser_page(url, contenu))
 
 
 async def extraire_donnees(url: str, session: aiohttp.ClientSession) -> Dict[str, any]:
-    """Extrait les données de l'URL donnée de manière asynchrone."""
+    """Extrait les données de l'URL donnée de manière asynchrone (sans réanalyse si la page n'a pas changé)."""
     try:
-        async with session.get(url) as response:
-            texte_html = await response.text(encoding='utf-8')
-        arbre = HTMLParser(texte_html)
-
-        date = extraire_date_de_url(url)
-        hippodrome = extraire_hippodrome(arbre)
-        numero_course = extraire_numero_course(arbre)
-        prix, partants = extraire_prix_et_partants(arbre)
-        donnees_chevaux = extraire_chevaux_et_gains(arbre)
-
-        return {
-            "date": date,
-            "hippodrome": hippodrome,
-            "numero_course": numero_course,
-            "prix": prix,
-            "partants": partants,
-            "donnees_chevaux": donnees_chevaux
-        }
+        return await telecharger_donnees(url, session)
     except Exception as e:
         logger.error(f"Erreur HTTP survenue pour l'URL {url}: {e}")
         return {}
@@ -307,34 +326,26 @@ def calculer_gains_min_max(donnees_chevaux: List[Dict[str, str]]) -> Tuple[int,
     return 0, 0
 
 
-def sauvegarder_en_csv(toutes_donnees: List[Dict[str, any]], nom_fichier: str, donnees_excel: pd.DataFrame):
+@chronometrer("ecriture_csv")
+def sauvegarder_en_csv(toutes_donnees: List[Dict[str, any]], nom_fichier: str, donnees_excel: Dict[str, Dict[str, str]]):
     noms_champs = ['DATE', 'Hippodrome', 'COURSE', 'NumChev', 'CHEVAL',
                    'PLACE', 'RAP-G', 'RAP-P', 'PARTANTS', 'I-Gains', 'I-Prix du jour',
                    'I-Moins-Riche', 'I-Plus-Riche', 'Cotes-Pmu', 'Statut',
                    'L1', 'L2', 'D-P', 'D-C', 'D-N', 'D-L', 'D-B', 'D-C2', 'A']
 
-    try:
-        with open(nom_fichier, 'w', newline='', encoding='utf-8-sig') as fichier_csv:
-            ecrivain = csv.DictWriter(fichier_csv, fieldnames=noms_champs)
-            ecrivain.writeheader()
+    if enrichissement.moteur_vectorise():
+        enrichissement.sauvegarder_en_csv(toutes_donnees, nom_fichier, donnees_excel, noms_champs)
+        return
 
+    try:
+        def generer_lignes():
             for donnees in toutes_donnees:
                 moins_riche, plus_riche = calculer_gains_min_max(
                     donnees['donnees_chevaux'])
 
                 hippodrome_norm = normaliser_nom_hippodrome(
                     donnees['hippodrome'])
-                donnees_hippodrome = donnees_excel[donnees_excel['Hippodrome']
-                                                   == hippodrome_norm]
-
-                valeurs_excel = {col: '0' for col in [
-                    'L1', 'L2', 'D-P', 'D-C', 'D-N', 'D-L', 'D-B', 'D-C2', 'A']}
-
-                if not donnees_hippodrome.empty:
-                    for col in valeurs_excel.keys():
-                        valeur = donnees_hippodrome.iloc[0].get(col, '0')
-                        valeurs_excel[col] = '0' if pd.isna(
-                            valeur) else str(valeur)
+                valeurs_excel = valeurs_hippodrome(donnees_excel, hippodrome_norm)
 
                 cotes_pmu_zero = sum(
                     1 for cheval in donnees['donnees_chevaux'] if cheval['cote_pmu'] == '0')
@@ -365,49 +376,66 @@ def sauvegarder_en_csv(toutes_donnees: List[Dict[str, any]], nom_fichier: str, d
                         'Statut': '',
                         **valeurs_excel
                     }
-                    ecrivain.writerow(ligne)
+                    yield ligne
+
+        # Fichier temporaire renommé une fois complet : une interruption ne laisse jamais de CSV tronqué
+        ecrire_csv(nom_fichier, noms_champs, generer_lignes())
         logger.info(
             f"Données enrichies sauvegardées avec succès dans {nom_fichier}")
+        journaliser_rapprochements(donnees_excel)
     except Exception as e:
         logger.error(
             f"Erreur lors de la sauvegarde des données enrichies en CSV : {e}")
 
 
-async def traiter_urls(urls: List[str]) -> List[Dict[str, any]]:
-    """Traite une liste d'URLs de manière asynchrone."""
+async def extraire_course_attelee_ou_montee(url: str, session: aiohttp.ClientSession) -> Dict[str, any]:
+    """Extrait les données de la course si elle est attelée ou montée (dictionnaire vide sinon).
+    Une erreur de téléchargement est levée, pour que la file de travaux retente la course."""
+    if not await tester_attele_ou_monte(url, session):
+        return {}
+    return await telecharger_donnees(url, session)
+
+
+async def traiter_urls(urls: List[str], concurrence: Optional[int] = None) -> List[Dict[str, any]]:
+    """Traite une liste d'URLs de manière asynchrone (au plus `concurrence` pages en parallèle)."""
     async with aiohttp.ClientSession() as session:
-        taches = []
-        for url in urls:
-            est_attele_ou_monte = await contient_attele_ou_monte(url, session)
-            if est_attele_ou_monte:
-                tache = asyncio.create_task(extraire_donnees(url, session))
-                taches.append(tache)
+        verifications = await rassembler(
+            [contient_attele_ou_monte(url, session) for url in urls], concurrence)
+        taches = [extraire_donnees(url, session)
+                  for url, est_attele_ou_monte in zip(urls, verifications) if est_attele_ou_monte]
 
-        resultats = await asyncio.gather(*taches)
+        resultats = await rassembler(taches, concurrence)
 
     return [resultat for resultat in resultats if resultat]
 
 
-async def main():
+async def main(urls: Optional[List[str]] = None, fichier_sortie: str = FICHIER_PARTANTS,
+               fichier_excel: str = FICHIER_EXCEL, concurrence: Optional[int] = None):
     """Fonction principale pour exécuter l'extracteur et enrichir les données."""
     configurer_logger()
 
-    if not URLS_UNIQUES_PARTANTS:
+    if urls is None:
+        urls = URLS_UNIQUES_PARTANTS
+
+    if not urls:
         logger.info(
             "Veuillez Entrer au moins une URL dans la liste 'URLS_UNIQUES_PARTANTS' ")
         return
 
-    urls = await traiter_liste_urls(URLS_UNIQUES_PARTANTS)
+    # FichierH est chargé dans un thread pendant le téléchargement des pages
+    chargement_excel = asyncio.create_task(asyncio.to_thread(charger_donnees_excel, fichier_excel))
+    urls = await traiter_liste_urls(urls, concurrence)
 
-    toutes_donnees = await traiter_urls(urls)
+    toutes_donnees = await traiter_urls(urls, concurrence)
 
+    donnees_excel = await chargement_excel
     if toutes_donnees:
-        donnees_excel = charger_donnees_excel("FichierH.xls")
-        sauvegarder_en_csv(
-            toutes_donnees, "donnees_courses_partants.csv", donnees_excel)
+        await asyncio.to_thread(sauvegarder_en_csv, toutes_donnees, fichier_sortie, donnees_excel)
     else:
         logger.error("Aucune donnée extraite, fichier CSV non créé")
 
+    terminer_rapport()
+
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    lancer_point_entree(main, FICHIER_PARTANTS)
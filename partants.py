@@ -1,26 +1,51 @@
 import re
-import sys
-import csv
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 
-import pandas as pd
-from unidecode import unidecode
-
 from loguru import logger
+from chronometre import chronometrer, terminer_rapport
+from journalisation import configurer_logger
+from profilage import lancer_point_entree
+from concurrence import rassembler
+from fichiers import ecrire_csv
+import enrichissement
+import metriques
+from decoupage import REGIONS_PARTANTS
+from referentiel import charger_referentiel, journaliser_rapprochements, valeurs_hippodrome
+from telechargement import telecharger_et_extraire, construire_arbre
+from hippodromes import (MOTIF_NOM_REUNION, MOTIF_CARACTERES_NON_AUTORISES,
+                         appliquer_alias, normaliser_nom_hippodrome)
 from selectolax.parser import HTMLParser
 import asyncio
 import aiohttp
 
 
-def configurer_logger():
-    """Configure le logger avec les paramètres appropriés."""
-    fichier_log = "log_partants.log"
-    logger.add(fichier_log, rotation="500 KB",
-               retention="3 days", level="WARNING")
-    logger.add(sys.stderr, level="INFO")
-
-
+FICHIER_PARTANTS = "donnees_courses_partants.csv"
+FICHIER_EXCEL = "FichierH.xls"
+
+# Mettez toutes vos urls avec le prefixe "https://www.geny.com/partants-pmu/" avant d'executer le programme
+URLS_PARTANTS = [
+    "https://www.geny.com/partants-pmu/2024-09-11-marseille-borely-pmu-prix-de-chatelneuf_c1518523",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-beziers_c1517317",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-lusigny_c1517311",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-la-roche-posay_c1517316",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-du-mont-saint-michel_c1517312",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-montier-en-der_c1517315",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-joseph-aveline_c1517314",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-bagnols-sur-ceze_c1517319",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-emile-wendling_c1517318",
+    "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-d-eaubonne_c1517313",
+    "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-de-la-source-chomel_c1517307",
+    "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-d-yzeure_c1517305",
+    "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-de-nevers_c1517309",
+    "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-de-billy_c1517304",
+    "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-raymond-despres_c1517308",
+    "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-traveller_c1517306",
+    "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-de-la-federation-du-centre-est_c1517310"
+]
+
+
+@chronometrer()
 def extraire_date_de_url(url: str) -> str:
     """Extrait et formate la date à partir de l'URL donnée."""
     correspondance_date = re.search(r'/(\d{4}-\d{2}-\d{2})-', url)
@@ -28,10 +53,12 @@ def extraire_date_de_url(url: str) -> str:
         chaine_date = correspondance_date.group(1)
         objet_date = datetime.strptime(chaine_date, '%Y-%m-%d')
         return objet_date.strftime('%d/%m/%Y')
+    metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_date_de_url")
     logger.warning(f"Date non trouvée dans l'URL: {url}")
     return ""     
 
 
+@chronometrer()
 def extraire_hippodrome(arbre: HTMLParser) -> Optional[str]:
     """Extrait le nom de l'hippodrome du HTML en préservant les accents."""
     try:
@@ -43,7 +70,7 @@ def extraire_hippodrome(arbre: HTMLParser) -> Optional[str]:
         if not texte_hippodrome:
             raise ValueError("Le texte de l'hippodrome est vide")
 
-        match = re.search(r':\s*(.+?)\s*\(', texte_hippodrome)
+        match = MOTIF_NOM_REUNION.search(texte_hippodrome)
         if match:
             hippodrome = match.group(1).strip()
         else:
@@ -53,22 +80,21 @@ def extraire_hippodrome(arbre: HTMLParser) -> Optional[str]:
             else:
                 hippodrome = texte_hippodrome
 
-        hippodrome_nettoye = re.sub(r'[^A-Za-zÀ-ÿ0-9\s-]', '', hippodrome)
+        hippodrome_nettoye = MOTIF_CARACTERES_NON_AUTORISES.sub('', hippodrome)
         hippodrome_nettoye = ' '.join(hippodrome_nettoye.split())
 
         if not hippodrome_nettoye:
             raise ValueError("Le nom de l'hippodrome est vide après nettoyage")
-        
-        if hippodrome_nettoye.lower() in "dieppe genybet":
-            hippodrome_nettoye = "Dieppe"
 
-        return hippodrome_nettoye
+        return appliquer_alias(hippodrome_nettoye)
 
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_hippodrome")
         logger.error(f"Erreur lors de l'extraction de l'hippodrome : {e}")
         return None
 
 
+@chronometrer()
 def extraire_numero_course(arbre: HTMLParser) -> Optional[int]:
     """Extrait le numéro de course du HTML."""
     try:
@@ -76,26 +102,31 @@ def extraire_numero_course(arbre: HTMLParser) -> Optional[int]:
         if noeud_numero_course:
             numero_course_text = noeud_numero_course.text().strip()
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
             logger.error("Aucun noeud correpondant au Numero de course")
             return None
         
         return numero_course_text[0]
     
     except IndexError as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
         logger.error("Erreur d'accès au numero de course dans le texte")
         return None
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_numero_course")
         logger.error(f"Erreur lors de l'extraction du numéro de course : {e}")
         return None
 
 
+@chronometrer()
 def extraire_prix_et_partants(arbre: HTMLParser) -> Tuple[Optional[int], Optional[int]]:
     """Extrait le prix et le nombre de partants du HTML."""
     try:
         noeud_info_course = arbre.css_first("span.infoCourse")
         if noeud_info_course:
-            texte_info_course = noeud_info_course.text().replace("ï¿½", "")
+            texte_info_course = noeud_info_course.text()
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_prix_et_partants")
             logger.error("Aucun element avec l'attribut 'span.infoCourse' trouvé lors de l'extraction du 'prix' et 'partants'")
             return None, None
 
@@ -103,27 +134,30 @@ def extraire_prix_et_partants(arbre: HTMLParser) -> Tuple[Optional[int], Optiona
         correspondance_partants = re.search(r'-\s*(\d+)\s*Partants', texte_info_course)
 
         if correspondance_prix and correspondance_partants:
-            prix_str = correspondance_prix.group(1).replace(" ", "")
-            prix_str_nettoye = re.sub(r'[^\x20-\x7E]', '', prix_str)
-            prix = int(prix_str_nettoye)/1000
+            # "19 500" : le séparateur de milliers est une espace insécable
+            prix = int("".join(correspondance_prix.group(1).split()))/1000
             if prix.is_integer():
                 prix = int(prix)
             partants = correspondance_partants.group(1).replace(' ', '')
             return prix, partants
         else:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_prix_et_partants")
             logger.error("Le prix ou le partant n'a pas été trouvé dans le texte lors de l'extraction")
             return None, None
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_prix_et_partants")
         logger.error(
             f"Erreur lors de l'extraction du prix et des partants : {e}")
         return None, None
 
 
+@chronometrer()
 def extraire_chevaux_et_gains(arbre: HTMLParser) -> List[Dict[str, str]]:
     donnees_chevaux = []
     try:
         tableau = arbre.css_first('table#tableau_partants')
         if not tableau:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_chevaux_et_gains")
             logger.error("Tableau des partants non trouvé")
             return donnees_chevaux
 
@@ -136,6 +170,7 @@ def extraire_chevaux_et_gains(arbre: HTMLParser) -> List[Dict[str, str]]:
 
       
         if gains_index is None or cotes_pmu_index is None or cotes_genybet_index is None:
+            metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_chevaux_et_gains")
             logger.error(
                 "Colonne 'Gains', 'Cotes' ou 'Genybet' non trouvée dans le tableau")
             return donnees_chevaux
@@ -176,48 +211,57 @@ def extraire_chevaux_et_gains(arbre: HTMLParser) -> List[Dict[str, str]]:
                             "cote_genybet": cote_genybet_texte
                         })
             except AttributeError as e:
+                metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_chevaux_et_gains")
                 logger.error(
                     f"Erreur lors de l'extraction des données du cheval : {e}")
 
     except Exception as e:
+        metriques.ECHECS_EXTRACTION.inc(script=__name__, extracteur="extraire_chevaux_et_gains")
         logger.error(f"Erreur générale lors de l'analyse : {e}")
 
     return donnees_chevaux
 
 
-def charger_donnees_excel(chemin_fichier: str) -> pd.DataFrame:
-    """Charge les données du fichier Excel (.xls ou .xlsx) et les prépare pour la correspondance."""
+@chronometrer("chargement_excel")
+def charger_donnees_excel(chemin_fichier: str) -> Dict[str, Dict[str, str]]:
+    """Charge les données du fichier Excel (.xls ou .xlsx), indexées par nom d'hippodrome pour la correspondance."""
     try:
-        engine = 'xlrd' if chemin_fichier.endswith('.xls') else None
-        df = pd.read_excel(chemin_fichier, engine=engine)
-        df['Hippodrome'] = df['Hippodrome'].apply(lambda x: unidecode(str(x)).upper())
-        return df
+        return charger_referentiel(chemin_fichier, normaliser_nom_hippodrome)
     except Exception as e:
         logger.error(f"Erreur lors du chargement du fichier Excel : {e}")
-        return pd.DataFrame()
+        return {}
+
+
+def analyser_page(url: str, contenu: bytes) -> Dict[str, any]:
+    """Extrait les données d'une page de partants déjà téléchargée."""
+    arbre = construire_arbre(contenu, url, REGIONS_PARTANTS)
+
+    date = extraire_date_de_url(url)
+    hippodrome = extraire_hippodrome(arbre)
+    numero_course = extraire_numero_course(arbre)
+    prix, partants = extraire_prix_et_partants(arbre)
+    donnees_chevaux = extraire_chevaux_et_gains(arbre)
+
+    return {
+        "date": date,
+        "hippodrome": hippodrome,
+        "numero_course": numero_course,
+        "prix": prix,
+        "partants": partants,
+        "donnees_chevaux": donnees_chevaux
+    }
+
+
+async def telecharger_donnees(url: str, session: aiohttp.ClientSession) -> Dict[str, any]:
+    """Comme extraire_donnees, mais une erreur de téléchargement est levée (pour la file de travaux,
+    qui retente le travail)."""
+    return await telecharger_et_extraire(url, session, "partants", lambda contenu: analyser_page(url, contenu))
 
 
 async def extraire_donnees(url: str, session: aiohttp.ClientSession) -> Dict[str, any]:
-    """Extrait les données de l'URL donnée de manière asynchrone."""
+    """Extrait les données de l'URL donnée de manière asynchrone (sans réanalyse si la page n'a pas changé)."""
     try:
-        async with session.get(url) as response:
-            texte_html = await response.text(encoding='utf-8')
-        arbre = HTMLParser(texte_html)
-
-        date = extraire_date_de_url(url)
-        hippodrome = extraire_hippodrome(arbre)
-        numero_course = extraire_numero_course(arbre)
-        prix, partants = extraire_prix_et_partants(arbre)
-        donnees_chevaux = extraire_chevaux_et_gains(arbre)
-
-        return {
-            "date": date,
-            "hippodrome": hippodrome,
-            "numero_course": numero_course,
-            "prix": prix,
-            "partants": partants,
-            "donnees_chevaux": donnees_chevaux
-        }
+        return await telecharger_donnees(url, session)
     except Exception as e:
         logger.error(f"Erreur HTTP survenue pour l'URL {url}: {e}")
         return {}
@@ -239,33 +283,25 @@ def calculer_gains_min_max(donnees_chevaux: List[Dict[str, str]]) -> Tuple[int,
     return 0, 0
 
 
-def sauvegarder_en_csv(toutes_donnees: List[Dict[str, any]], nom_fichier: str, donnees_excel: pd.DataFrame):
+@chronometrer("ecriture_csv")
+def sauvegarder_en_csv(toutes_donnees: List[Dict[str, any]], nom_fichier: str, donnees_excel: Dict[str, Dict[str, str]]):
     noms_champs = ['DATE', 'Hippodrome', 'COURSE', 'NumChev', 'CHEVAL',
                    'PLACE', 'RAP-G', 'RAP-P', 'PARTANTS', 'I-Gains', 'I-Prix du jour',
                    'I-Moins-Riche', 'I-Plus-Riche', 'Cotes-Pmu', 'Statut',
                    'L1', 'L2', 'D-P', 'D-C', 'D-N', 'D-L', 'D-B', 'D-C2', 'A']
 
-    try:
-        with open(nom_fichier, 'w', newline='', encoding='utf-8-sig') as fichier_csv:
-            ecrivain = csv.DictWriter(fichier_csv, fieldnames=noms_champs)
-            ecrivain.writeheader()
+    if enrichissement.moteur_vectorise():
+        enrichissement.sauvegarder_en_csv(toutes_donnees, nom_fichier, donnees_excel, noms_champs)
+        return
 
+    try:
+        def generer_lignes():
             for donnees in toutes_donnees:
                 moins_riche, plus_riche = calculer_gains_min_max(
                     donnees['donnees_chevaux'])
 
-                hippodrome_norm = unidecode(donnees['hippodrome']).upper()
-                donnees_hippodrome = donnees_excel[donnees_excel['Hippodrome']
-                                                   == hippodrome_norm]
-
-                valeurs_excel = {col: '0' for col in [
-                    'L1', 'L2', 'D-P', 'D-C', 'D-N', 'D-L', 'D-B', 'D-C2', 'A']}
-
-                if not donnees_hippodrome.empty:
-                    for col in valeurs_excel.keys():
-                        valeur = donnees_hippodrome.iloc[0].get(col, '0')
-                        valeurs_excel[col] = '0' if pd.isna(
-                            valeur) else str(valeur)
+                hippodrome_norm = normaliser_nom_hippodrome(donnees['hippodrome'])
+                valeurs_excel = valeurs_hippodrome(donnees_excel, hippodrome_norm)
 
                 cotes_pmu_zero = sum(1 for cheval in donnees['donnees_chevaux'] if cheval['cote_pmu'] == '0')
 
@@ -295,55 +331,47 @@ def sauvegarder_en_csv(toutes_donnees: List[Dict[str, any]], nom_fichier: str, d
                         'Statut': '',
                         **valeurs_excel
                     }
-                    ecrivain.writerow(ligne)
+                    yield ligne
+
+        # Fichier temporaire renommé une fois complet : une interruption ne laisse jamais de CSV tronqué
+        ecrire_csv(nom_fichier, noms_champs, generer_lignes())
         logger.info(
             f"Données enrichies sauvegardées avec succès dans {nom_fichier}")
+        journaliser_rapprochements(donnees_excel)
     except Exception as e:
         logger.error(
             f"Erreur lors de la sauvegarde des données enrichies en CSV : {e}")
 
 
-async def traiter_urls(urls: List[str]) -> List[Dict[str, any]]:
-    """Traite une liste d'URLs de manière asynchrone."""
+async def traiter_urls(urls: List[str], concurrence: Optional[int] = None) -> List[Dict[str, any]]:
+    """Traite une liste d'URLs de manière asynchrone (au plus `concurrence` pages en parallèle)."""
     async with aiohttp.ClientSession() as session:
         taches = [extraire_donnees(url, session) for url in urls]
-        resultats = await asyncio.gather(*taches)
+        resultats = await rassembler(taches, concurrence)
     # Filtre les résultats vides
     return [resultat for resultat in resultats if resultat]
 
 
-async def main():
+async def main(urls: Optional[List[str]] = None, fichier_sortie: str = FICHIER_PARTANTS,
+               fichier_excel: str = FICHIER_EXCEL, concurrence: Optional[int] = None):
     """Fonction principale pour exécuter l'extracteur et enrichir les données."""
     configurer_logger()
 
-    urls = [
-        "https://www.geny.com/partants-pmu/2024-09-11-marseille-borely-pmu-prix-de-chatelneuf_c1518523",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-beziers_c1517317",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-lusigny_c1517311",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-la-roche-posay_c1517316",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-du-mont-saint-michel_c1517312",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-montier-en-der_c1517315",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-joseph-aveline_c1517314",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-de-bagnols-sur-ceze_c1517319",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-emile-wendling_c1517318",
-        "https://www.geny.com/partants-pmu/2024-09-07-vincennes-pmu-prix-d-eaubonne_c1517313",
-        "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-de-la-source-chomel_c1517307",
-        "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-d-yzeure_c1517305",
-        "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-de-nevers_c1517309",
-        "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-de-billy_c1517304",
-        "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-raymond-despres_c1517308",
-        "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-traveller_c1517306",
-        "https://www.geny.com/partants-pmu/2024-09-07-vichy-pmu-prix-de-la-federation-du-centre-est_c1517310"
-    ]
-    
-    toutes_donnees = await traiter_urls(urls)
+    if urls is None:
+        urls = URLS_PARTANTS
+
+    # FichierH est chargé dans un thread pendant le téléchargement des pages
+    chargement_excel = asyncio.create_task(asyncio.to_thread(charger_donnees_excel, fichier_excel))
+    toutes_donnees = await traiter_urls(urls, concurrence)
 
+    donnees_excel = await chargement_excel
     if toutes_donnees:
-        donnees_excel = charger_donnees_excel("FichierH.xls")
-        sauvegarder_en_csv(
-            toutes_donnees, "donnees_courses_partants.csv", donnees_excel)
+        await asyncio.to_thread(sauvegarder_en_csv, toutes_donnees, fichier_sortie, donnees_excel)
     else:
         logger.error("Aucune donnée extraite, fichier CSV non créé")
 
+    terminer_rapport()
+
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    lancer_point_entree(main, FICHIER_PARTANTS)
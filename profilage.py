@@ -0,0 +1,83 @@
+import io
+import time
+import pstats
+import asyncio
+import argparse
+import cProfile
+from pathlib import Path
+from typing import Callable, Optional
+
+
+PROFILEURS = ("cprofile", "pyinstrument")
+NOMBRE_FONCTIONS_AFFICHEES = 20
+
+
+def executer_cible(fonction_principale: Callable):
+    """Exécute main(), dans une boucle asyncio si c'est une coroutine."""
+    if asyncio.iscoroutinefunction(fonction_principale):
+        return asyncio.run(fonction_principale())
+    return fonction_principale()
+
+
+def profiler_avec_cprofile(fonction_principale: Callable, fichier_rapport: Path):
+    """Profile avec cProfile (asyncio.run est profilé en entier, coroutines comprises)."""
+    profileur = cProfile.Profile()
+    profileur.enable()
+    try:
+        return executer_cible(fonction_principale)
+    finally:
+        profileur.disable()
+        profileur.dump_stats(str(fichier_rapport))
+
+        sortie = io.StringIO()
+        statistiques = pstats.Stats(profileur, stream=sortie)
+        statistiques.sort_stats(pstats.SortKey.TIME).print_stats(NOMBRE_FONCTIONS_AFFICHEES)
+        print(sortie.getvalue())
+        print(f"Profil cProfile sauvegardé dans {fichier_rapport}")
+
+
+def profiler_avec_pyinstrument(fonction_principale: Callable, fichier_rapport: Path):
+    """Profile avec pyinstrument en mode asynchrone (temps passé en await attribué aux coroutines)."""
+    from pyinstrument import Profiler
+
+    profileur = Profiler(async_mode='enabled')
+    profileur.start()
+    try:
+        return executer_cible(fonction_principale)
+    finally:
+        profileur.stop()
+        fichier_rapport.write_text(profileur.output_html(), encoding='utf-8')
+        print(profileur.output_text(unicode=True, color=False, show_all=False))
+        print(f"Profil pyinstrument sauvegardé dans {fichier_rapport}")
+
+
+def executer_avec_profilage(fonction_principale: Callable, fichier_sortie: str, profileur: Optional[str] = None):
+    """Exécute main() avec le profileur demandé et dépose le rapport à côté du fichier de sortie."""
+    if profileur is None:
+        return executer_cible(fonction_principale)
+
+    fichier_sortie = Path(fichier_sortie)
+    debut = time.perf_counter()
+    try:
+        if profileur == "pyinstrument":
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError:
+                print("pyinstrument n'est pas installé (pip install pyinstrument), utilisation de cProfile")
+            else:
+                return profiler_avec_pyinstrument(
+                    fonction_principale, fichier_sortie.with_name(fichier_sortie.stem + '_profil.html'))
+        return profiler_avec_cprofile(fonction_principale, fichier_sortie.with_suffix('.prof'))
+    finally:
+        print(f"Durée totale profilée : {time.perf_counter() - debut:.2f} s")
+
+
+def lancer_point_entree(fonction_principale: Callable, fichier_sortie: str, arguments=None):
+    """Point d'entrée commun des scripts : gère l'option --profile puis exécute main()."""
+    parseur = argparse.ArgumentParser()
+    parseur.add_argument(
+        "--profile", nargs="?", const="cprofile", choices=PROFILEURS, default=None,
+        help="Profile l'exécution (cprofile par défaut, ou pyinstrument) et sauvegarde le rapport "
+             "à côté du fichier de sortie")
+    options = parseur.parse_args(arguments)
+    return executer_avec_profilage(fonction_principale, fichier_sortie, options.profile)
@@ -0,0 +1,268 @@
+"""Réserve de proxies SOCKS/HTTP pour répartir les téléchargements sur plusieurs adresses IP.
+
+Chaque proxy a sa propre session aiohttp (ProxyConnector d'aiohttp_socks : socks5://, socks4://,
+http://) et sa propre limite de requêtes simultanées. Une requête part par le proxy suivant
+(tourniquet) ou par le moins chargé. Un proxy qui échoue plusieurs fois de suite, ou dont la latence
+moyenne dépasse le maximum, est exclu puis sondé régulièrement ; il revient dans la réserve dès
+qu'une sonde réussit.
+
+    python cli.py backfill urls_saison.txt --proxies proxies.txt --concurrence-proxy 4
+"""
+import time
+import asyncio
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+from loguru import logger
+
+import metriques
+
+
+SELECTIONS = ("tourniquet", "moins-charge")
+CONCURRENCE_PAR_PROXY = 4
+ECHECS_AVANT_EXCLUSION = 3
+LATENCE_MAXIMALE = 10.0  # secondes, en moyenne lissée
+LISSAGE_LATENCE = 0.2
+DUREE_EXCLUSION = 60.0
+INTERVALLE_SONDAGE = 15.0
+DELAI_SONDE = 10.0
+DELAI_REQUETE = 60.0
+# Temps maximal d'attente d'un proxy quand ils sont tous exclus
+ATTENTE_PROXY_DISPONIBLE = 120.0
+TENTATIVES = 2
+# Statuts qui montrent que l'adresse du proxy est limitée ou bloquée par le site
+STATUTS_LIMITES = (403, 429)
+
+Reponse = Tuple[int, bytes, Optional[str], Dict[str, str]]
+
+
+class AucunProxyDisponible(RuntimeError):
+    pass
+
+
+def lire_proxies(sources: List[str]) -> List[str]:
+    """Lit les proxies donnés directement (socks5://hote:port...) ou depuis des fichiers (un par ligne)."""
+    proxies = []
+    for source in sources:
+        if "://" in source:
+            proxies.append(source)
+            continue
+        with open(source, 'r', encoding='utf-8') as f:
+            proxies += [ligne.strip() for ligne in f
+                        if ligne.strip() and not ligne.strip().startswith('#')]
+    return proxies
+
+
+def nom_proxy(url: str) -> str:
+    """Adresse du proxy sans identifiants, pour le log et les métriques."""
+    morceaux = urlsplit(url)
+    return f"{morceaux.scheme}://{morceaux.hostname}:{morceaux.port}"
+
+
+class Proxy:
+    def __init__(self, url: str, concurrence: int):
+        self.url = url
+        self.nom = nom_proxy(url)
+        self.limite = concurrence
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.en_cours = 0
+        self.requetes = 0
+        self.echecs = 0
+        self.echecs_consecutifs = 0
+        self.latence: Optional[float] = None
+        self.exclu_jusqua: Optional[float] = None
+
+    @property
+    def disponible(self) -> bool:
+        return self.exclu_jusqua is None
+
+    def obtenir_session(self) -> aiohttp.ClientSession:
+        if self.session is None:
+            from aiohttp_socks import ProxyConnector
+            self.session = aiohttp.ClientSession(connector=ProxyConnector.from_url(self.url),
+                                                 timeout=aiohttp.ClientTimeout(total=DELAI_REQUETE))
+        return self.session
+
+    def noter_latence(self, duree: float):
+        self.latence = duree if self.latence is None else (1 - LISSAGE_LATENCE) * self.latence + LISSAGE_LATENCE * duree
+
+    def charge(self) -> Tuple[float, float]:
+        return self.en_cours / self.limite, self.latence or 0.0
+
+    def etat(self) -> str:
+        latence = f"{self.latence * 1000:.0f} ms" if self.latence is not None else "-"
+        statut = "disponible" if self.disponible else "exclu"
+        return f"{self.nom} : {statut}, {self.requetes} requête(s), {self.echecs} échec(s), latence {latence}"
+
+    async def fermer(self):
+        if self.session is not None:
+            await self.session.close()
+        self.session = None
+
+
+class ReserveProxies:
+    """Proxies utilisés à tour de rôle pour les téléchargements, avec exclusion des proxies défaillants."""
+
+    def __init__(self, urls: List[str], selection: str = "tourniquet",
+                 concurrence_par_proxy: int = CONCURRENCE_PAR_PROXY, url_sonde: Optional[str] = None):
+        if not urls:
+            raise ValueError("Aucun proxy fourni")
+        if selection not in SELECTIONS:
+            raise ValueError(f"Sélection de proxy inconnue : {selection} (attendu : {', '.join(SELECTIONS)})")
+        self.proxies = [Proxy(url, concurrence_par_proxy) for url in urls]
+        self.selection = selection
+        self.url_sonde = url_sonde
+        self._tours = count()
+        self._demarrage: Optional[asyncio.Task] = None
+        self._surveillance: Optional[asyncio.Task] = None
+        self._retour: Optional[asyncio.Event] = None
+
+    def disponibles(self) -> List[Proxy]:
+        return [proxy for proxy in self.proxies if proxy.disponible]
+
+    def choisir(self, exclus: Tuple[Proxy, ...] = ()) -> Optional[Proxy]:
+        candidats = [proxy for proxy in self.disponibles() if proxy not in exclus] or self.disponibles()
+        if not candidats:
+            return None
+        if self.selection == "moins-charge":
+            return min(candidats, key=Proxy.charge)
+        return candidats[next(self._tours) % len(candidats)]
+
+    async def demarrer(self, url: str):
+        """Sonde tous les proxies (les morts sont exclus d'emblée) et lance la surveillance. Les
+        requêtes lancées pendant ce premier sondage l'attendent."""
+        if self._demarrage is None:
+            self._demarrage = asyncio.create_task(self.sonder_tous(url))
+        await self._demarrage
+
+    async def sonder_tous(self, url: str):
+        if self.url_sonde is None:
+            morceaux = urlsplit(url)
+            self.url_sonde = f"{morceaux.scheme}://{morceaux.netloc}/"
+        # Sémaphores et sessions sont liés à la boucle asyncio de l'exécution en cours
+        for proxy in self.proxies:
+            proxy.semaphore = asyncio.Semaphore(proxy.limite)
+        self._retour = asyncio.Event()
+        self._surveillance = asyncio.create_task(self.surveiller())
+        await asyncio.gather(*(self.sonder(proxy) for proxy in self.proxies))
+        logger.info(f"{len(self.disponibles())}/{len(self.proxies)} proxy(s) disponible(s), "
+                    f"sélection {self.selection}")
+        self.publier()
+
+    async def sonder(self, proxy: Proxy) -> bool:
+        debut = time.perf_counter()
+        try:
+            async with proxy.obtenir_session().get(self.url_sonde, timeout=aiohttp.ClientTimeout(total=DELAI_SONDE)) as response:
+                await response.read()
+                if response.status >= 500 or response.status in STATUTS_LIMITES:
+                    raise aiohttp.ClientResponseError(response.request_info, (), status=response.status)
+        except Exception as e:
+            self.exclure(proxy, f"sonde en échec ({type(e).__name__} {e})")
+            return False
+        proxy.latence = time.perf_counter() - debut
+        if proxy.latence > LATENCE_MAXIMALE:
+            self.exclure(proxy, f"sonde trop lente ({proxy.latence:.1f} s)")
+            return False
+        if not proxy.disponible:
+            logger.info(f"Proxy {proxy.nom} de nouveau disponible")
+        proxy.exclu_jusqua = None
+        proxy.echecs_consecutifs = 0
+        self._retour.set()
+        return True
+
+    def exclure(self, proxy: Proxy, raison: str):
+        if proxy.disponible:
+            logger.warning(f"Proxy {proxy.nom} exclu : {raison}")
+        proxy.exclu_jusqua = time.monotonic() + DUREE_EXCLUSION
+        self.publier()
+
+    async def surveiller(self):
+        """Sonde les proxies exclus dont la durée d'exclusion est écoulée."""
+        while True:
+            await asyncio.sleep(INTERVALLE_SONDAGE)
+            maintenant = time.monotonic()
+            a_sonder = [proxy for proxy in self.proxies
+                        if not proxy.disponible and proxy.exclu_jusqua <= maintenant]
+            if a_sonder:
+                await asyncio.gather(*(self.sonder(proxy) for proxy in a_sonder))
+                self.publier()
+
+    async def attendre_proxy(self, exclus: Tuple[Proxy, ...]) -> Proxy:
+        proxy = self.choisir(exclus)
+        if proxy is not None:
+            return proxy
+        self._retour.clear()
+        try:
+            await asyncio.wait_for(self._retour.wait(), ATTENTE_PROXY_DISPONIBLE)
+        except asyncio.TimeoutError:
+            raise AucunProxyDisponible(f"Aucun des {len(self.proxies)} proxies n'est disponible")
+        return await self.attendre_proxy(exclus)
+
+    async def requete(self, url: str, entetes: Optional[Dict[str, str]] = None) -> Reponse:
+        """Télécharge `url` par un proxy disponible : statut, contenu, charset et en-têtes de validation.
+        Une erreur de connexion est retentée une fois par un autre proxy."""
+        await self.demarrer(url)
+        essayes: Tuple[Proxy, ...] = ()
+        while True:
+            proxy = await self.attendre_proxy(essayes)
+            essayes += (proxy,)
+            try:
+                return await self.requete_par(proxy, url, entetes)
+            except Exception:
+                if len(essayes) >= min(TENTATIVES, len(self.proxies)):
+                    raise
+
+    async def requete_par(self, proxy: Proxy, url: str, entetes: Optional[Dict[str, str]]) -> Reponse:
+        # Les requêtes en attente d'une place comptent dans la charge du proxy
+        proxy.en_cours += 1
+        try:
+            async with proxy.semaphore:
+                proxy.requetes += 1
+                debut = time.perf_counter()
+                async with proxy.obtenir_session().get(url, headers=entetes) as response:
+                    contenu = await response.read()
+                    validateurs = {nom: response.headers[nom] for nom in ('ETag', 'Last-Modified')
+                                   if nom in response.headers}
+                    reponse = response.status, contenu, response.charset, validateurs
+        except Exception as e:
+            self.noter_echec(proxy, f"{type(e).__name__} {e}")
+            raise
+        finally:
+            proxy.en_cours -= 1
+
+        proxy.noter_latence(time.perf_counter() - debut)
+        if reponse[0] in STATUTS_LIMITES:
+            self.noter_echec(proxy, f"statut HTTP {reponse[0]}")
+        elif proxy.latence > LATENCE_MAXIMALE:
+            proxy.echecs += 1
+            metriques.PROXY_REQUETES.inc(proxy=proxy.nom, resultat="lent")
+            self.exclure(proxy, f"latence moyenne de {proxy.latence:.1f} s")
+        else:
+            proxy.echecs_consecutifs = 0
+            metriques.PROXY_REQUETES.inc(proxy=proxy.nom, resultat="succes")
+        return reponse
+
+    def noter_echec(self, proxy: Proxy, raison: str):
+        proxy.echecs += 1
+        proxy.echecs_consecutifs += 1
+        metriques.PROXY_REQUETES.inc(proxy=proxy.nom, resultat="echec")
+        if proxy.echecs_consecutifs >= ECHECS_AVANT_EXCLUSION and proxy.disponible:
+            self.exclure(proxy, f"{proxy.echecs_consecutifs} échecs consécutifs, dernier : {raison}")
+
+    def publier(self):
+        metriques.PROXIES_DISPONIBLES.definir(len(self.disponibles()))
+
+    async def fermer(self):
+        """Arrête la surveillance, ferme les sessions et journalise l'état de chaque proxy."""
+        self._demarrage = None
+        if self._surveillance is not None:
+            self._surveillance.cancel()
+            self._surveillance = None
+            logger.info("État des proxies :")
+            for proxy in self.proxies:
+                logger.info(f"  {proxy.etat()}")
+        for proxy in self.proxies:
+            await proxy.fermer()
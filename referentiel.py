@@ -0,0 +1,175 @@
+import os
+import csv
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from fichiers import ecriture_atomique
+
+
+COLONNES_EXCEL = ['L1', 'L2', 'D-P', 'D-C', 'D-N', 'D-L', 'D-B', 'D-C2', 'A']
+
+# Similarité (coefficient de Dice sur les trigrammes) à partir de laquelle un hippodrome absent de
+# FichierH est rapproché du nom le plus proche ; 1 désactive les rapprochements
+SEUIL_SIMILARITE = 0.7
+
+
+def chemin_cache(chemin_fichier: str) -> str:
+    """Chemin du cache CSV du fichier Excel de référence (à côté du fichier Excel)."""
+    return chemin_fichier + '.cache.csv'
+
+
+def lire_excel(chemin_fichier: str) -> Dict[str, Dict[str, str]]:
+    """Lit le fichier Excel avec pandas (importé seulement ici) et convertit les valeurs
+    en texte comme lors de l'écriture du CSV ('0' pour les cellules vides)."""
+    import pandas as pd
+
+    engine = 'xlrd' if chemin_fichier.endswith('.xls') else None
+    df = pd.read_excel(chemin_fichier, engine=engine)
+
+    lignes = {}
+    for _, ligne in df.iterrows():
+        hippodrome = str(ligne['Hippodrome'])
+        if hippodrome in lignes:
+            continue
+        valeurs = {}
+        for col in COLONNES_EXCEL:
+            valeur = ligne.get(col, '0')
+            valeurs[col] = '0' if pd.isna(valeur) else str(valeur)
+        lignes[hippodrome] = valeurs
+    return lignes
+
+
+def lire_cache(chemin: str) -> Dict[str, Dict[str, str]]:
+    with open(chemin, 'r', newline='', encoding='utf-8') as f:
+        return {ligne['Hippodrome']: {col: ligne[col] for col in COLONNES_EXCEL}
+                for ligne in csv.DictReader(f)}
+
+
+def ecrire_cache(chemin: str, lignes: Dict[str, Dict[str, str]]):
+    try:
+        with ecriture_atomique(chemin, encoding='utf-8') as f:
+            ecrivain = csv.DictWriter(f, fieldnames=['Hippodrome'] + COLONNES_EXCEL)
+            ecrivain.writeheader()
+            ecrivain.writerows({'Hippodrome': hippodrome, **valeurs} for hippodrome, valeurs in lignes.items())
+    except OSError as e:
+        logger.warning(f"Impossible d'écrire le cache du fichier de référence {chemin}: {e}")
+
+
+def charger_referentiel(chemin_fichier: str, normaliser: Callable[[str], str]) -> Dict[str, Dict[str, str]]:
+    """Charge le fichier Excel de référence des hippodromes, indexé par nom normalisé.
+
+    Le contenu est mis en cache dans un CSV à côté du fichier Excel : tant que l'Excel n'est pas
+    modifié, les exécutions suivantes relisent ce cache sans importer pandas. En cas de doublon,
+    la première ligne d'un hippodrome est conservée."""
+    cache = chemin_cache(chemin_fichier)
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(chemin_fichier):
+        lignes = lire_cache(cache)
+    else:
+        lignes = lire_excel(chemin_fichier)
+        ecrire_cache(cache, lignes)
+
+    referentiel = {}
+    for hippodrome, valeurs in lignes.items():
+        referentiel.setdefault(normaliser(hippodrome), valeurs)
+    return ReferentielHippodromes(referentiel)
+
+
+def choisir_seuil_similarite(seuil: float):
+    global SEUIL_SIMILARITE
+    SEUIL_SIMILARITE = seuil
+
+
+def trigrammes(nom: str) -> Set[str]:
+    """Trigrammes d'un nom normalisé, bordé d'espaces pour que début et fin de mot comptent."""
+    nom = f"  {nom} "
+    return {nom[i:i + 3] for i in range(len(nom) - 2)}
+
+
+class IndexTrigrammes:
+    """Index inversé trigramme -> noms : seuls les noms qui partagent au moins un trigramme avec le
+    nom cherché sont comparés."""
+
+    def __init__(self, noms: Iterable[str]):
+        self.noms: List[str] = []
+        self.tailles: List[int] = []
+        self.postings: Dict[str, List[int]] = {}
+        for position, nom in enumerate(noms):
+            trigrammes_nom = trigrammes(nom)
+            self.noms.append(nom)
+            self.tailles.append(len(trigrammes_nom))
+            for trigramme in trigrammes_nom:
+                self.postings.setdefault(trigramme, []).append(position)
+
+    def plus_proche(self, nom: str) -> Optional[Tuple[str, float]]:
+        """Nom le plus similaire et sa similarité (à égalité, le premier du fichier de référence)."""
+        trigrammes_nom = trigrammes(nom)
+        communs = Counter()
+        for trigramme in trigrammes_nom:
+            communs.update(self.postings.get(trigramme, ()))
+        if not communs:
+            return None
+        position, similarite = max(
+            ((position, 2 * nombre / (len(trigrammes_nom) + self.tailles[position]))
+             for position, nombre in communs.items()),
+            key=lambda candidat: (candidat[1], -candidat[0]))
+        return self.noms[position], similarite
+
+
+class ReferentielHippodromes(dict):
+    """Valeurs de FichierH par nom d'hippodrome normalisé, avec un index de trigrammes construit au
+    chargement pour rapprocher les noms qui ne correspondent pas exactement. Chaque nom n'est
+    cherché qu'une fois : les rapprochements et les hippodromes introuvables sont mémorisés et
+    signalés une seule fois dans le log."""
+
+    def __init__(self, lignes: Dict[str, Dict[str, str]]):
+        super().__init__(lignes)
+        self.index = IndexTrigrammes(self.keys())
+        self.rapprochements: Dict[str, Optional[Tuple[str, float]]] = {}
+
+    def rechercher(self, nom_normalise: str) -> Optional[Dict[str, str]]:
+        valeurs = self.get(nom_normalise)
+        if valeurs is not None:
+            return valeurs
+        if nom_normalise not in self.rapprochements:
+            self.rapprochements[nom_normalise] = self.rapprocher(nom_normalise)
+        rapprochement = self.rapprochements[nom_normalise]
+        return self[rapprochement[0]] if rapprochement else None
+
+    def rapprocher(self, nom_normalise: str) -> Optional[Tuple[str, float]]:
+        candidat = self.index.plus_proche(nom_normalise) if SEUIL_SIMILARITE < 1 else None
+        if candidat and candidat[1] >= SEUIL_SIMILARITE:
+            logger.warning(f"Hippodrome {nom_normalise} absent du fichier de référence, rapproché de "
+                           f"{candidat[0]} (similarité {candidat[1]:.2f})")
+            return candidat
+        proche = f" (le plus proche : {candidat[0]}, similarité {candidat[1]:.2f})" if candidat else ""
+        logger.warning(f"Hippodrome {nom_normalise} absent du fichier de référence, "
+                       f"colonnes {COLONNES_EXCEL[0]} à {COLONNES_EXCEL[-1]} à 0{proche}")
+        return None
+
+    def rapport(self) -> List[str]:
+        """Rapprochements de l'exécution, puis hippodromes restés introuvables."""
+        lignes = [f"{nom} -> {rapprochement[0]} ({rapprochement[1]:.2f})"
+                  for nom, rapprochement in sorted(self.rapprochements.items()) if rapprochement]
+        return lignes + [f"{nom} -> introuvable" for nom, rapprochement in sorted(self.rapprochements.items())
+                         if not rapprochement]
+
+
+def valeurs_hippodrome(referentiel: Dict[str, Dict[str, str]], nom_normalise: str) -> Dict[str, str]:
+    """Valeurs de FichierH pour un hippodrome (nom normalisé), rapproché si besoin ; '0' partout
+    s'il reste introuvable."""
+    if isinstance(referentiel, ReferentielHippodromes):
+        valeurs = referentiel.rechercher(nom_normalise)
+    else:
+        valeurs = referentiel.get(nom_normalise)
+    return valeurs if valeurs is not None else {col: '0' for col in COLONNES_EXCEL}
+
+
+def journaliser_rapprochements(referentiel: Dict[str, Dict[str, str]]):
+    """Résume dans le log les hippodromes rapprochés ou introuvables pendant l'enrichissement."""
+    if not isinstance(referentiel, ReferentielHippodromes) or not referentiel.rapprochements:
+        return
+    logger.info(f"Hippodromes absents du fichier de référence : {len(referentiel.rapprochements)}")
+    for ligne in referentiel.rapport():
+        logger.info(f"  {ligne}")
@@ -0,0 +1,201 @@
+"""Répartition d'un crawl sur plusieurs processus.
+
+Les URLs sont réparties par jour ou par course entre N processus. Chaque processus a sa propre
+session aiohttp et exécute les fonctions d'extraction habituelles ; les résultats remontent par une
+file multiprocessing vers le processus principal, seul à écrire le CSV, dans l'ordre des URLs.
+"""
+import re
+import queue
+import asyncio
+import importlib
+import multiprocessing
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+from loguru import logger
+
+from chronometre import rapport, terminer_rapport
+from concurrence import (rassembler, activer_limite_adaptative, limite_adaptative_active,
+                         CONCURRENCE_ARRIVEES, concurrence_par_defaut,
+                         terminer_limite_adaptative, activer_requetes_secours, budget_requetes_secours,
+                         terminer_requetes_secours)
+from telechargement import activer_requetes_conditionnelles, cache_conditionnel
+
+
+# Fonction de travail (module, coroutine (url, session) -> résultat) pour chaque type de page. Ces
+# fonctions lèvent les erreurs de téléchargement au lieu de retourner un résultat vide : la file de
+# travaux les retente, la répartition par processus les journalise
+TRAVAUX = {
+    "partants": ("partants", "telecharger_donnees"),
+    "partants_reunion": ("partant_unique", "extraire_course_attelee_ou_montee"),
+    "arrivees": ("arrivees", "telecharger_resultat"),
+    "arrivees_reunion": ("arrivee_unique", "telecharger_resultat"),
+}
+
+REPARTITIONS = ("jour", "course")
+
+MOTIF_JOUR = re.compile(r'(\d{4}-\d{2}-\d{2})')
+MOTIF_COURSE = re.compile(r'(?:_c|id_course=)(\d+)')
+
+# Délai d'attente sur la file avant de vérifier que les processus sont toujours en vie
+DELAI_ATTENTE_FILE = 1.0
+
+UrlIndexee = Tuple[int, str]
+
+
+def cle_repartition(url: str, repartition: str) -> str:
+    """Jour (AAAA-MM-JJ) ou identifiant de course de l'URL ; l'URL elle-même à défaut."""
+    motif = MOTIF_JOUR if repartition == "jour" else MOTIF_COURSE
+    correspondance = motif.search(url)
+    return correspondance.group(1) if correspondance else url
+
+
+def repartir(urls: List[str], nombre_lots: int, repartition: str = "jour") -> List[List[UrlIndexee]]:
+    """Répartit les URLs (avec leur position) en `nombre_lots` lots sans séparer un même jour ou
+    une même course. Les groupes sont placés du plus gros au plus petit dans le lot le moins chargé,
+    ce qui donne toujours la même répartition pour la même liste d'URLs."""
+    groupes: Dict[str, List[UrlIndexee]] = {}
+    for index, url in enumerate(urls):
+        groupes.setdefault(cle_repartition(url, repartition), []).append((index, url))
+
+    lots: List[List[UrlIndexee]] = [[] for _ in range(max(1, nombre_lots))]
+    for groupe in sorted(groupes.values(), key=lambda g: (-len(g), g[0][0])):
+        min(lots, key=len).extend(groupe)
+    return [lot for lot in lots if lot]
+
+
+def fonction_travail(type_travail: str):
+    """Coroutine (url, session) -> résultat correspondant au type de page."""
+    nom_module, nom_fonction = TRAVAUX[type_travail]
+    return getattr(importlib.import_module(nom_module), nom_fonction)
+
+
+async def traiter_lot(type_travail: str, lot: List[UrlIndexee], concurrence: Optional[int], file):
+    fonction = fonction_travail(type_travail)
+
+    async with aiohttp.ClientSession() as session:
+        async def traiter(index: int, url: str):
+            try:
+                resultat = await fonction(url, session)
+            except Exception as e:
+                logger.error(f"Erreur lors du traitement de l'URL {url}: {e}")
+                resultat = None
+            file.put((index, resultat))
+
+        await rassembler([traiter(index, url) for index, url in lot], concurrence)
+
+
+def travailleur(type_travail: str, lot: List[UrlIndexee], concurrence: Optional[int], file,
+                adaptative: bool = False, budget_secours: Optional[float] = None,
+                conditionnel: Optional[str] = None):
+    """Point d'entrée d'un processus : traite son lot puis envoie ses mesures et ses nouvelles
+    entrées du cache conditionnel (index None). Avec `adaptative`, le processus ajuste sa propre
+    limite de requêtes (voir concurrence.LimiteAdaptative) ; avec `budget_secours`, il relance ses
+    pages lentes (voir concurrence.RequetesDeSecours) ; avec `conditionnel`, il lit le cache HTTP
+    (voir telechargement.CacheConditionnel), que seul le processus principal enregistre."""
+    if adaptative:
+        activer_limite_adaptative()
+    if budget_secours is not None:
+        activer_requetes_secours(budget_secours)
+    entrees_lues = {}
+    if conditionnel is not None:
+        activer_requetes_conditionnelles(conditionnel or None)
+        entrees_lues = dict(cache_conditionnel.entrees)
+    try:
+        asyncio.run(traiter_lot(type_travail, lot, concurrence, file))
+    finally:
+        terminer_limite_adaptative()
+        terminer_requetes_secours()
+        nouvelles_entrees = {cle: entree for cle, entree in cache_conditionnel.entrees.items()
+                             if entrees_lues.get(cle) is not entree}
+        file.put((None, (rapport.donnees_brutes(), nouvelles_entrees)))
+
+
+def executer_en_parallele(type_travail: str, urls: List[str], processus: int,
+                          concurrence: Optional[int] = None, repartition: str = "jour") -> List[Any]:
+    """Traite les URLs sur `processus` processus et retourne les résultats dans l'ordre des URLs
+    (None pour une URL dont le processus s'est arrêté avant de répondre)."""
+    lots = repartir(urls, processus, repartition)
+    logger.info(f"{len(urls)} URLs réparties par {repartition} sur {len(lots)} processus : "
+                f"{[len(lot) for lot in lots]}")
+
+    contexte = multiprocessing.get_context("spawn")
+    file = contexte.Queue()
+    options_requetes = (limite_adaptative_active(), budget_requetes_secours(),
+                        (cache_conditionnel.fichier or "") if cache_conditionnel.actif else None)
+    travailleurs = [contexte.Process(target=travailleur, args=(type_travail, lot, concurrence, file) + options_requetes)
+                    for lot in lots]
+    for processus_travailleur in travailleurs:
+        processus_travailleur.start()
+
+    resultats: List[Any] = [None] * len(urls)
+    termines = 0
+    while termines < len(travailleurs):
+        try:
+            index, resultat = file.get(timeout=DELAI_ATTENTE_FILE)
+        except queue.Empty:
+            if not any(p.is_alive() for p in travailleurs):
+                logger.error("Des processus se sont arrêtés sans terminer leur lot")
+                break
+            continue
+        if index is None:
+            donnees_rapport, entrees_cache = resultat
+            rapport.fusionner(donnees_rapport)
+            cache_conditionnel.entrees.update(entrees_cache)
+            termines += 1
+        else:
+            resultats[index] = resultat
+
+    for processus_travailleur in travailleurs:
+        processus_travailleur.join()
+    return resultats
+
+
+def ecrire_partants(resultats: List[Any], fichier_sortie: str, fichier_excel: str, reunion: bool = False):
+    """Écrit les résultats de partants (dans l'ordre donné) avec le writer habituel du script."""
+    module = importlib.import_module("partant_unique" if reunion else "partants")
+    toutes_donnees = [resultat for resultat in resultats if resultat]
+
+    if toutes_donnees:
+        module.sauvegarder_en_csv(toutes_donnees, fichier_sortie, module.charger_donnees_excel(fichier_excel))
+    else:
+        logger.error("Aucune donnée extraite, fichier CSV non créé")
+
+
+def ecrire_arrivees(resultats: List[Any], fichier_partants: str, fichier_sortie: str, reunion: bool = False):
+    """Complète le CSV des partants avec les résultats d'arrivée (dans l'ordre donné), en flux."""
+    from flux_arrivees import identite, ecrire_arrivees_en_flux
+    from hippodromes import normaliser_nom_hippodrome
+
+    ecrire_arrivees_en_flux(fichier_partants, fichier_sortie, resultats,
+                            normaliser_nom_hippodrome if reunion else identite)
+
+
+def partants_en_parallele(urls: List[str], fichier_sortie: str, fichier_excel: str, processus: int,
+                          concurrence: Optional[int] = None, reunion: bool = False, repartition: str = "jour"):
+    module = importlib.import_module("partant_unique" if reunion else "partants")
+    module.configurer_logger()
+
+    if reunion:
+        urls = asyncio.run(module.traiter_liste_urls(urls, concurrence))
+
+    resultats = executer_en_parallele(
+        "partants_reunion" if reunion else "partants", urls, processus, concurrence, repartition)
+    ecrire_partants(resultats, fichier_sortie, fichier_excel, reunion)
+
+    terminer_rapport()
+
+
+def arrivees_en_parallele(urls: List[str], fichier_partants: str, fichier_sortie: str, processus: int,
+                          concurrence: Optional[int] = None, reunion: bool = False, repartition: str = "jour"):
+    module = importlib.import_module("arrivee_unique" if reunion else "arrivees")
+    module.configurer_logger()
+
+    if reunion:
+        urls = asyncio.run(module.traiter_liste_urls(urls, concurrence))
+
+    resultats = executer_en_parallele("arrivees_reunion" if reunion else "arrivees", urls, processus,
+                                      concurrence_par_defaut(concurrence, CONCURRENCE_ARRIVEES), repartition)
+    ecrire_arrivees(resultats, fichier_partants, fichier_sortie, reunion)
+
+    terminer_rapport()
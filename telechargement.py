@@ -0,0 +1,296 @@
+import os
+import codecs
+import pickle
+import inspect
+from typing import Any, Dict, List, Optional, Callable, Tuple, Union
+from urllib.parse import urlsplit
+
+import aiohttp
+from loguru import logger
+from selectolax.parser import HTMLParser
+
+from chronometre import mesurer, rapport
+import concurrence
+from decoupage import decouper_regions
+from fichiers import ecriture_atomique
+import metriques
+
+
+ENCODAGE_PAR_DEFAUT = 'utf-8'
+ENCODAGE_DE_REPLI = 'cp1252'
+
+# Encodage retenu pour chaque hôte, décidé une seule fois par exécution
+ENCODAGES_PAR_HOTE: Dict[str, str] = {}
+
+# Archive de pages (voir archive.py) : les pages téléchargées y sont ajoutées, ou, en rejeu, lues
+# dans l'archive au lieu d'être téléchargées
+archive_pages = None
+rejeu_archive = False
+
+# Statut d'une erreur passagère (limitation, erreur du serveur) : la page n'est pas analysée
+STATUT_TROP_DE_REQUETES = 429
+STATUT_ERREUR_SERVEUR = 500
+
+
+class ErreurHTTP(Exception):
+    pass
+
+
+# Réserve de proxies (voir proxies.py) : si elle est définie, les pages sont téléchargées par ses
+# proxies plutôt que par la session passée à requete
+reserve_proxies = None
+
+
+def normaliser_encodage(encodage: Optional[str]) -> Optional[str]:
+    try:
+        return codecs.lookup(encodage).name if encodage else None
+    except LookupError:
+        return None
+
+
+def determiner_encodage(contenu: bytes, charset: Optional[str]) -> Optional[str]:
+    """Décide l'encodage d'une page : le charset HTTP s'il décode la page, sinon UTF-8 s'il la décode
+    strictement, sinon Windows-1252. Retourne None si la page est en ASCII pur (rien ne permet de trancher)."""
+    encodage = normaliser_encodage(charset)
+    if encodage:
+        try:
+            contenu.decode(encodage)
+            return encodage
+        except UnicodeDecodeError:
+            logger.warning(f"Le charset annoncé {charset} ne décode pas la page, détection de l'encodage")
+
+    if contenu.isascii():
+        return None
+    try:
+        contenu.decode(ENCODAGE_PAR_DEFAUT)
+        return ENCODAGE_PAR_DEFAUT
+    except UnicodeDecodeError:
+        return ENCODAGE_DE_REPLI
+
+
+def hote(url: str) -> str:
+    return urlsplit(url).hostname or ""
+
+
+def encodage_hote(url: str) -> str:
+    return ENCODAGES_PAR_HOTE.get(hote(url), ENCODAGE_PAR_DEFAUT)
+
+
+def memoriser_encodage(url: str, contenu: bytes, charset: Optional[str]):
+    nom_hote = hote(url)
+    if nom_hote in ENCODAGES_PAR_HOTE:
+        return
+    encodage = determiner_encodage(contenu, charset)
+    if encodage:
+        ENCODAGES_PAR_HOTE[nom_hote] = encodage
+        logger.info(f"Encodage retenu pour {nom_hote} : {encodage}")
+
+
+async def requete(url: str, session: aiohttp.ClientSession,
+                  entetes: Optional[Dict[str, str]] = None) -> Tuple[int, bytes, Dict[str, str]]:
+    """Télécharge une page : statut, contenu brut (non décodé) et en-têtes de validation.
+
+    L'encodage de l'hôte est décidé sur la première page qui permet de trancher. Avec la limite
+    adaptative (concurrence.activer_limite_adaptative), la requête attend une place avant de partir ;
+    avec les requêtes de secours (concurrence.activer_requetes_secours), une page lente est
+    redemandée et la première réponse reçue est gardée."""
+    if rejeu_archive:
+        return lire_depuis_archive(url)
+
+    def lancer():
+        if reserve_proxies is not None:
+            return reserve_proxies.requete(url, entetes)
+        return requete_directe(url, session, entetes)
+
+    async with concurrence.place_requete() as place:
+        with mesurer("fetch"):
+            try:
+                if concurrence.requetes_secours is not None:
+                    statut, contenu, charset, validateurs = await concurrence.requetes_secours.executer(lancer)
+                else:
+                    statut, contenu, charset, validateurs = await lancer()
+            except Exception as e:
+                metriques.ERREURS_HTTP.inc(type=type(e).__name__)
+                raise
+        place.statut = statut
+    metriques.REPONSES_HTTP.inc(statut=statut)
+    if statut == 304:
+        rapport.ajouter_page_non_modifiee()
+    else:
+        rapport.ajouter_page(len(contenu))
+        memoriser_encodage(url, contenu, charset)
+        if archive_pages is not None and statut == 200:
+            with mesurer("archivage"):
+                archive_pages.ajouter(url, contenu, charset)
+    return statut, contenu, validateurs
+
+
+async def requete_directe(url: str, session: aiohttp.ClientSession,
+                          entetes: Optional[Dict[str, str]]) -> Tuple[int, bytes, Optional[str], Dict[str, str]]:
+    async with session.get(url, headers=entetes) as response:
+        contenu = await response.read()
+        validateurs = {nom: response.headers[nom] for nom in ('ETag', 'Last-Modified') if nom in response.headers}
+        return response.status, contenu, response.charset, validateurs
+
+
+def activer_proxies(urls_proxies: List[str], selection: str = "tourniquet",
+                    concurrence_par_proxy: Optional[int] = None):
+    """Fait passer tous les téléchargements par une réserve de proxies (voir proxies.py) au lieu
+    de la session de l'appelant."""
+    global reserve_proxies
+    from proxies import ReserveProxies, CONCURRENCE_PAR_PROXY
+
+    reserve_proxies = ReserveProxies(urls_proxies, selection, concurrence_par_proxy or CONCURRENCE_PAR_PROXY)
+
+
+async def fermer_proxies():
+    """Ferme les sessions des proxies ; à appeler dans la boucle asyncio qui les a utilisées."""
+    if reserve_proxies is not None:
+        await reserve_proxies.fermer()
+
+
+def lire_depuis_archive(url: str) -> Tuple[int, bytes, Dict[str, str]]:
+    with mesurer("lecture_archive"):
+        page = archive_pages.lire(url)
+    if page is None:
+        raise LookupError(f"Page absente de l'archive {archive_pages.chemin}")
+    contenu, charset = page
+    rapport.ajouter_page(len(contenu))
+    memoriser_encodage(url, contenu, charset)
+    return 200, contenu, {}
+
+
+def activer_archive(chemin: str, rejouer: bool = False):
+    """Ajoute les pages téléchargées à l'archive `chemin`, ou, avec `rejouer`, lit toutes les
+    pages dans l'archive sans aucun accès réseau."""
+    global archive_pages, rejeu_archive
+    from archive import ArchivePages
+
+    archive_pages = ArchivePages(chemin)
+    rejeu_archive = rejouer
+
+
+def fermer_archive():
+    global archive_pages, rejeu_archive
+    if archive_pages is not None:
+        archive_pages.fermer()
+    archive_pages = None
+    rejeu_archive = False
+
+
+def verifier_statut(url: str, statut: int):
+    """Lève ErreurHTTP pour une erreur passagère (429, 5xx), que l'appelant peut retenter."""
+    if statut == STATUT_TROP_DE_REQUETES or statut >= STATUT_ERREUR_SERVEUR:
+        raise ErreurHTTP(f"Statut HTTP {statut} pour {url}")
+
+
+async def telecharger(url: str, session: aiohttp.ClientSession) -> bytes:
+    """Télécharge une page et retourne son contenu brut, sans le décoder."""
+    _, contenu, _ = await requete(url, session)
+    return contenu
+
+
+class CacheConditionnel:
+    """Validateurs HTTP (ETag, Last-Modified) et dernier enregistrement extrait de chaque page.
+
+    Désactivé par défaut. Une fois activé, une page déjà extraite est redemandée avec
+    If-None-Match / If-Modified-Since : sur une réponse 304, l'enregistrement précédent est
+    réutilisé sans analyser la page. Le cache peut être conservé d'une exécution à l'autre dans un
+    fichier local (pickle : à ne pas partager avec des tiers)."""
+
+    def __init__(self):
+        self.actif = False
+        self.fichier: Optional[str] = None
+        self.entrees: Dict[Tuple[str, str], Tuple[Dict[str, str], Any]] = {}
+
+    def activer(self, fichier: Optional[str] = None):
+        self.actif = True
+        self.fichier = fichier
+        if fichier and os.path.exists(fichier):
+            try:
+                with open(fichier, 'rb') as f:
+                    self.entrees = pickle.load(f)
+                logger.info(f"{len(self.entrees)} page(s) reprises du cache HTTP {fichier}")
+            except Exception as e:
+                logger.warning(f"Cache HTTP {fichier} illisible, il sera recréé : {e}")
+                self.entrees = {}
+
+    def sauvegarder(self):
+        if not (self.actif and self.fichier):
+            return
+        try:
+            with ecriture_atomique(self.fichier, encoding=None, binaire=True) as f:
+                pickle.dump(self.entrees, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            logger.error(f"Erreur lors de la sauvegarde du cache HTTP {self.fichier}: {e}")
+
+    @staticmethod
+    def entetes(validateurs: Dict[str, str]) -> Dict[str, str]:
+        entetes = {}
+        if 'ETag' in validateurs:
+            entetes['If-None-Match'] = validateurs['ETag']
+        if 'Last-Modified' in validateurs:
+            entetes['If-Modified-Since'] = validateurs['Last-Modified']
+        return entetes
+
+
+cache_conditionnel = CacheConditionnel()
+
+
+def activer_requetes_conditionnelles(fichier_cache: Optional[str] = None):
+    """Active les requêtes conditionnelles pour toute l'exécution (voir CacheConditionnel)."""
+    cache_conditionnel.activer(fichier_cache)
+
+
+async def telecharger_et_extraire(url: str, session: aiohttp.ClientSession, nature: str,
+                                  extraire: Callable[[bytes], Any]) -> Any:
+    """Télécharge la page et retourne `extraire(contenu)` (fonction synchrone ou coroutine).
+
+    Avec les requêtes conditionnelles activées, l'enregistrement est mémorisé par (nature, url) :
+    si le serveur répond 304, il est retourné tel quel, sans analyse. Un enregistrement vide n'est
+    pas mémorisé. Une erreur passagère (429, 5xx) lève ErreurHTTP au lieu d'analyser la page d'erreur."""
+    if not cache_conditionnel.actif:
+        statut, contenu, _ = await requete(url, session)
+        verifier_statut(url, statut)
+        resultat = extraire(contenu)
+        return await resultat if inspect.isawaitable(resultat) else resultat
+
+    cle = (nature, url)
+    entree = cache_conditionnel.entrees.get(cle)
+    entetes = CacheConditionnel.entetes(entree[0]) if entree else None
+    statut, contenu, validateurs = await requete(url, session, entetes)
+    if statut == 304 and entree:
+        return entree[1]
+    verifier_statut(url, statut)
+
+    resultat = extraire(contenu)
+    if inspect.isawaitable(resultat):
+        resultat = await resultat
+    if resultat and validateurs:
+        cache_conditionnel.entrees[cle] = (validateurs, resultat)
+    return resultat
+
+
+def construire_arbre(contenu: Union[bytes, str], url: str,
+                     regions: Optional[List[Callable]] = None) -> HTMLParser:
+    """Construit l'arbre HTML d'une page, en se limitant aux `regions` si elles sont données.
+
+    Pour un hôte en UTF-8, les octets sont passés tels quels à HTMLParser (aucune copie en str,
+    aucune détection d'encodage) ; sinon la page est décodée une fois avec l'encodage de l'hôte."""
+    document = contenu
+    if isinstance(document, bytes):
+        encodage = encodage_hote(url)
+        if encodage != ENCODAGE_PAR_DEFAUT:
+            document = document.decode(encodage, errors='replace')
+
+    if regions:
+        with mesurer("decoupage"):
+            document_reduit = decouper_regions(document, regions)
+        if document_reduit is not None:
+            document = document_reduit
+
+    metriques.PAGES_ANALYSEES.inc()
+    with mesurer("HTMLParser"):
+        if isinstance(document, bytes):
+            return HTMLParser(document, detect_encoding=False)
+        return HTMLParser(document)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Les scripts du dépôt sont des modules à plat, importés depuis la racine
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
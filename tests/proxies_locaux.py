@@ -0,0 +1,140 @@
+"""Proxies locaux (HTTP CONNECT et SOCKS5) et site local, pour tester proxies.py sans réseau.
+
+Chaque proxy écoute sur un port libre de 127.0.0.1 et peut être mis en panne (`changer(actif=False)` :
+connexions fermées aussitôt) ou répondre lui-même un statut HTTP (`changer(statut_force=429)`) à la
+place du site, comme un proxy dont l'adresse est limitée. `changer` coupe les tunnels ouverts, que
+les sessions aiohttp garderaient sinon d'une requête à l'autre.
+"""
+import asyncio
+import struct
+from typing import List, Optional, Set
+
+from aiohttp import web
+
+
+CORPS_PAGE = b"<html><body>page</body></html>"
+
+
+async def relayer(lecteur: asyncio.StreamReader, ecrivain: asyncio.StreamWriter):
+    try:
+        while donnees := await lecteur.read(65536):
+            ecrivain.write(donnees)
+            await ecrivain.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        ecrivain.close()
+
+
+class ProxyLocal:
+    def __init__(self, protocole: str = "http"):
+        self.protocole = protocole
+        self.actif = True
+        self.statut_force: Optional[int] = None
+        self.connexions = 0
+        self.tunnels: Set[asyncio.StreamWriter] = set()
+        self.serveur: Optional[asyncio.AbstractServer] = None
+
+    def changer(self, actif: bool = True, statut_force: Optional[int] = None):
+        self.actif = actif
+        self.statut_force = statut_force
+        for ecrivain in self.tunnels:
+            ecrivain.close()
+        self.tunnels.clear()
+
+    @property
+    def port(self) -> int:
+        return self.serveur.sockets[0].getsockname()[1]
+
+    @property
+    def url(self) -> str:
+        return f"{'socks5' if self.protocole == 'socks5' else 'http'}://127.0.0.1:{self.port}"
+
+    async def demarrer(self) -> "ProxyLocal":
+        self.serveur = await asyncio.start_server(self.gerer, "127.0.0.1", 0)
+        return self
+
+    async def arreter(self):
+        self.serveur.close()
+        await self.serveur.wait_closed()
+
+    async def gerer(self, lecteur: asyncio.StreamReader, ecrivain: asyncio.StreamWriter):
+        if not self.actif:
+            ecrivain.close()
+            return
+        self.connexions += 1
+        self.tunnels.add(ecrivain)
+        try:
+            if self.protocole == "socks5":
+                hote, port = await self.negocier_socks5(lecteur, ecrivain)
+            else:
+                hote, port = await self.negocier_connect(lecteur, ecrivain)
+            if self.statut_force is not None:
+                await self.repondre_statut(lecteur, ecrivain)
+                return
+            lecteur_site, ecrivain_site = await asyncio.open_connection(hote, port)
+            await asyncio.gather(relayer(lecteur, ecrivain_site), relayer(lecteur_site, ecrivain))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            ecrivain.close()
+        finally:
+            self.tunnels.discard(ecrivain)
+
+    @staticmethod
+    async def negocier_connect(lecteur, ecrivain):
+        ligne = await lecteur.readline()
+        while (await lecteur.readline()) not in (b"\r\n", b""):
+            pass
+        hote, port = ligne.split()[1].decode().rsplit(":", 1)
+        ecrivain.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        await ecrivain.drain()
+        return hote, int(port)
+
+    @staticmethod
+    async def negocier_socks5(lecteur, ecrivain):
+        nombre_methodes = (await lecteur.readexactly(2))[1]
+        await lecteur.readexactly(nombre_methodes)
+        ecrivain.write(b"\x05\x00")
+        _, _, _, type_adresse = await lecteur.readexactly(4)
+        if type_adresse == 1:
+            hote = ".".join(map(str, await lecteur.readexactly(4)))
+        else:
+            hote = (await lecteur.readexactly((await lecteur.readexactly(1))[0])).decode()
+        port = struct.unpack(">H", await lecteur.readexactly(2))[0]
+        ecrivain.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+        await ecrivain.drain()
+        return hote, port
+
+    async def repondre_statut(self, lecteur, ecrivain):
+        """Lit la requête HTTP passée dans le tunnel et y répond `statut_force`, sans contacter le site."""
+        while (await lecteur.readline()) not in (b"\r\n", b""):
+            pass
+        ecrivain.write(f"HTTP/1.1 {self.statut_force} Limite\r\nContent-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        await ecrivain.drain()
+        ecrivain.close()
+
+
+class SiteLocal:
+    """Site servant la même page pour toutes les URLs ; compte les requêtes reçues."""
+
+    def __init__(self):
+        self.requetes: List[str] = []
+        self.runner: Optional[web.AppRunner] = None
+
+    async def servir(self, requete: web.Request) -> web.Response:
+        self.requetes.append(requete.path)
+        return web.Response(body=CORPS_PAGE, content_type="text/html")
+
+    async def demarrer(self) -> "SiteLocal":
+        application = web.Application()
+        application.router.add_get("/{chemin:.*}", self.servir)
+        self.runner = web.AppRunner(application, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, "127.0.0.1", 0).start()
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.runner.addresses[0][1]}"
+
+    async def arreter(self):
+        await self.runner.cleanup()
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from archive import ArchivePages, nom_fichier_page
+
+
+PARTANTS = "https://www.letrot.com/stats/fiche-course/2023-01-05/7500/1/partants/tableau"
+PARTANTS_GENY = "https://www.genybet.fr/courses/partants-pronostics/2023-01-05-vincennes-prix-x_c1234567"
+ARRIVEE = "https://www.genybet.fr/arrivee-et-rapports-pmu?id_course=1234567"
+AUTRE_ARRIVEE = "https://www.genybet.fr/arrivee-et-rapports-pmu?id_course=7654321"
+
+
+@pytest.fixture
+def chemin(tmp_path):
+    return str(tmp_path / "pages.arc")
+
+
+def test_ajouter_lire_et_rouvrir(chemin):
+    archive = ArchivePages(chemin)
+    archive.ajouter(PARTANTS_GENY, b"<html>partants</html>", "utf-8")
+    archive.ajouter(ARRIVEE, "<html>arrivée</html>".encode("cp1252"), "cp1252")
+    archive.ajouter(PARTANTS_GENY, b"<html>partants v2</html>", "utf-8")
+    assert archive.lire(PARTANTS_GENY) == (b"<html>partants v2</html>", "utf-8")
+    assert archive.lire(PARTANTS) is None
+    archive.fermer()
+
+    archive = ArchivePages(chemin)
+    assert len(archive) == 2
+    assert archive.lire(ARRIVEE) == ("<html>arrivée</html>".encode("cp1252"), "cp1252")
+    assert archive.lire(PARTANTS_GENY)[0] == b"<html>partants v2</html>"
+    assert archive.urls_course("1234567") == [PARTANTS_GENY, ARRIVEE]
+    archive.fermer()
+
+
+def test_ligne_index_interrompue(chemin):
+    archive = ArchivePages(chemin)
+    archive.ajouter(PARTANTS_GENY, b"partants")
+    archive.fermer()
+    with open(chemin + ".index", "a", encoding="utf-8") as f:
+        f.write(f"{ARRIVEE}\t1234567\t999")
+
+    archive = ArchivePages(chemin)
+    assert len(archive) == 1
+    archive.ajouter(ARRIVEE, b"arrivee")
+    archive.fermer()
+    assert ArchivePages(chemin).lire(ARRIVEE) == (b"arrivee", None)
+
+
+def test_pages_par_course(chemin):
+    archive = ArchivePages(chemin)
+    for url in (PARTANTS_GENY, AUTRE_ARRIVEE, ARRIVEE, PARTANTS):
+        archive.ajouter(url, url.encode())
+    assert [url for url, _ in archive.pages(["1234567"])] == [PARTANTS_GENY, ARRIVEE]
+    assert [contenu for _, contenu in archive.pages()] == [url.encode() for url in
+                                                           (PARTANTS_GENY, AUTRE_ARRIVEE, ARRIVEE, PARTANTS)]
+    archive.fermer()
+
+
+def test_noms_de_fichier():
+    assert nom_fichier_page(ARRIVEE) == "arrivee-et-rapports-pmu_c1234567"
+    assert nom_fichier_page(PARTANTS_GENY) == "courses_partants-pronostics_2023-01-05-vincennes-prix-x_c1234567"
+    # Sans identifiant de course, les paramètres distinguent les pages par une empreinte
+    assert nom_fichier_page("https://site.fr/page?jour=1") != nom_fichier_page("https://site.fr/page?jour=2")
+    assert nom_fichier_page("https://site.fr/page") == "page"
+
+
+def test_extraire_sans_ecraser(chemin, tmp_path):
+    archive = ArchivePages(chemin)
+    urls = [ARRIVEE, AUTRE_ARRIVEE, PARTANTS, PARTANTS + "/", "https://site.fr/page?jour=1",
+            "https://site.fr/page?jour=2"]
+    for url in urls:
+        archive.ajouter(url, url.encode())
+    dossier = tmp_path / "pages"
+    assert archive.extraire(str(dossier)) == len(urls)
+    contenus = {f.read_bytes() for f in dossier.iterdir()}
+    assert contenus == {url.encode() for url in urls}
+
+    assert archive.extraire(str(tmp_path / "course"), ["7654321"]) == 1
+    assert os.listdir(tmp_path / "course") == ["arrivee-et-rapports-pmu_c7654321.html"]
+    archive.fermer()
@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+from chronometre import DistributionDurees, RapportExecution, calculer_percentile
+
+
+def test_percentiles_a_un_pour_cent_pres():
+    generateur = random.Random(3)
+    durees = [generateur.lognormvariate(-5, 1.5) for _ in range(20000)] + [0.0, 1e-9]
+    distribution = DistributionDurees()
+    for duree in durees:
+        distribution.ajouter(duree)
+
+    triees = sorted(durees)
+    assert distribution.appels == len(durees)
+    assert distribution.total == pytest.approx(sum(durees))
+    assert distribution.maximum == triees[-1]
+    for percentile in (50, 90, 95, 99, 100):
+        assert distribution.percentile(percentile) == pytest.approx(calculer_percentile(triees, percentile), rel=0.011)
+    # Mémoire bornée : un seau par tranche de 2 %, pas une valeur par appel
+    assert len(distribution.seaux) < 1000
+
+
+def test_fusion_identique_a_un_seul_rapport():
+    durees = [0.001 * (1 + i % 37) for i in range(3000)]
+    unique, premier, second = RapportExecution(), RapportExecution(), RapportExecution()
+    for numero, duree in enumerate(durees):
+        unique.enregistrer("fetch", duree)
+        (premier if numero % 2 else second).enregistrer("fetch", duree)
+    premier.fusionner(second.donnees_brutes())
+    assert premier.resume()["etapes"] == unique.resume()["etapes"]
+
+
+def test_distribution_vide():
+    assert DistributionDurees().percentile(95) == 0.0
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+import arrivee_unique
+import arrivees
+import concurrence
+from concurrence import CONCURRENCE_ARRIVEES, concurrence_par_defaut
+
+
+@pytest.fixture
+def sans_limite_adaptative(monkeypatch):
+    monkeypatch.setattr(concurrence, "limite_adaptative", None)
+
+
+def test_concurrence_par_defaut(sans_limite_adaptative, monkeypatch):
+    assert concurrence_par_defaut(3, CONCURRENCE_ARRIVEES) == 3
+    assert concurrence_par_defaut(None, CONCURRENCE_ARRIVEES) == CONCURRENCE_ARRIVEES
+    # Avec --concurrence auto, la limite adaptative suffit
+    monkeypatch.setattr(concurrence, "limite_adaptative", concurrence.LimiteAdaptative())
+    assert concurrence_par_defaut(None, CONCURRENCE_ARRIVEES) is None
+
+
+@pytest.mark.parametrize("module", [arrivees, arrivee_unique])
+def test_arrivees_limitees_par_defaut(module, sans_limite_adaptative, monkeypatch):
+    en_cours = maximum = 0
+
+    async def recuperer_resultat(url, session):
+        nonlocal en_cours, maximum
+        en_cours += 1
+        maximum = max(maximum, en_cours)
+        await asyncio.sleep(0.01)
+        en_cours -= 1
+        return url
+
+    monkeypatch.setattr(module, "recuperer_resultat", recuperer_resultat)
+    urls = [f"https://www.example.com/arrivee_c{numero}" for numero in range(50)]
+    assert asyncio.run(module.recuperer_resultats(urls)) == urls
+    assert maximum == CONCURRENCE_ARRIVEES
+    maximum = 0
+    asyncio.run(module.recuperer_resultats(urls, 25))
+    assert maximum == 25
+
+
+def secours_amorces(delai: float = 0.05) -> concurrence.RequetesDeSecours:
+    secours = concurrence.RequetesDeSecours(budget=1.0)
+    secours.latences.extend([delai] * concurrence.ECHANTILLONS_MINIMUM_SECOURS)
+    return secours
+
+
+def test_premiere_annulee_garde_sa_latence(sans_limite_adaptative):
+    secours = secours_amorces()
+    appels = []
+
+    async def lancer():
+        appels.append(len(appels))
+        await asyncio.sleep(1.0 if len(appels) == 1 else 0.0)
+        return 200, f"reponse {len(appels)}"
+
+    async def scenario():
+        resultat = await secours.executer(lancer)
+        await asyncio.sleep(0)
+        return resultat
+
+    assert asyncio.run(scenario()) == (200, "reponse 2")
+    assert (secours.secours, secours.secours_gagnants) == (1, 1)
+    # Seule la première requête est notée, pour sa durée jusqu'à l'annulation (au moins le délai)
+    assert len(secours.latences) == concurrence.ECHANTILLONS_MINIMUM_SECOURS + 1
+    assert 0.05 <= secours.latences[-1] < 1.0
+
+
+def test_secours_prend_sa_propre_place(sans_limite_adaptative, monkeypatch):
+    limite = concurrence.LimiteAdaptative(initiale=2)
+    monkeypatch.setattr(concurrence, "limite_adaptative", limite)
+    secours = secours_amorces()
+    places_occupees = []
+
+    async def lancer():
+        places_occupees.append(limite.en_cours)
+        await asyncio.sleep(1.0 if len(places_occupees) == 1 else 0.0)
+        return 200, "page"
+
+    async def scenario():
+        async with concurrence.place_requete() as place:
+            place.statut, _ = await secours.executer(lancer)
+
+    asyncio.run(scenario())
+    assert places_occupees == [1, 2]
+    assert limite.en_cours == 0
+
+
+def test_secours_attend_une_place_libre(sans_limite_adaptative, monkeypatch):
+    limite = concurrence.LimiteAdaptative(initiale=1, maximum=1)
+    monkeypatch.setattr(concurrence, "limite_adaptative", limite)
+    secours = secours_amorces()
+    appels = 0
+
+    async def lancer():
+        nonlocal appels
+        appels += 1
+        await asyncio.sleep(0.2)
+        return 200, "page"
+
+    async def scenario():
+        async with concurrence.place_requete() as place:
+            place.statut, _ = await secours.executer(lancer)
+
+    asyncio.run(scenario())
+    # Toutes les places sont prises par la première requête : le secours n'est jamais parti
+    assert (secours.secours, appels) == (1, 1)
+    assert limite.en_cours == 0 and not limite.attentes
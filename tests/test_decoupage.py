@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+import partants
+import partant_unique
+from decoupage import REGION_TITRE, REGIONS_PARTANTS, REGIONS_PARTANTS_REUNION, decouper_regions
+from telechargement import construire_arbre
+from conftest import RACINE
+
+
+URL = "https://www.geny.com/partants-pmu/2024-08-29-strasbourg-pmu-prix-de-vesoul_c1521138"
+
+with open(os.path.join(RACINE, "index.html"), "rb") as f:
+    PAGE = f.read()
+
+# Un <h1> hors de tout <span> placé avant le titre de la course
+PAGE_AUTRE_H1 = PAGE.replace(b"<body", b"<h1>Bandeau</h1><body", 1)
+
+
+def analyse_complete(module, contenu: bytes):
+    arbre = construire_arbre(contenu, URL)
+    prix, nombre_partants = module.extraire_prix_et_partants(arbre)
+    return {
+        "date": module.extraire_date_de_url(URL),
+        "hippodrome": module.extraire_hippodrome(arbre),
+        "numero_course": module.extraire_numero_course(arbre),
+        "prix": prix,
+        "partants": nombre_partants,
+        "donnees_chevaux": module.extraire_chevaux_et_gains(arbre),
+    }
+
+
+@pytest.mark.parametrize("module", [partants, partant_unique])
+@pytest.mark.parametrize("contenu", [PAGE, PAGE_AUTRE_H1], ids=["page", "autre_h1"])
+def test_regions_equivalentes_a_la_page_complete(module, contenu):
+    resultat = module.analyser_page(URL, contenu)
+    assert resultat["donnees_chevaux"]
+    assert resultat == analyse_complete(module, contenu)
+
+
+@pytest.mark.parametrize("regions", [REGIONS_PARTANTS, REGIONS_PARTANTS_REUNION])
+def test_decoupage_octets_et_texte(regions):
+    reduit_octets = decouper_regions(PAGE, regions)
+    reduit_texte = decouper_regions(PAGE.decode("latin-1"), regions)
+    assert reduit_octets is not None
+    assert reduit_octets.decode("latin-1") == reduit_texte
+
+
+def test_titre_dans_son_span():
+    titre = REGION_TITRE(PAGE_AUTRE_H1)
+    assert titre.startswith(b"<span") and b"Bandeau" not in titre
+    assert b"Prix de Vesoul" in titre
+
+
+def test_region_introuvable():
+    assert decouper_regions(b"<html><body><p>vide</p></body></html>") is None
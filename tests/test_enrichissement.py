@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import enrichissement
+import partants
+import partant_unique
+from conftest import RACINE
+from hippodromes import normaliser_nom_hippodrome
+from referentiel import COLONNES_EXCEL, ReferentielHippodromes
+
+
+URL = "https://www.geny.com/partants-pmu/2024-08-29-strasbourg-pmu-prix-de-vesoul_c1521138"
+
+
+def cheval(nom: str, gain: str, cote_pmu: str, cote_genybet: str = "7.5"):
+    return {"nom": nom, "gain": gain, "cote_pmu": cote_pmu, "cote_genybet": cote_genybet}
+
+
+def course(hippodrome: str, numero: str, chevaux, prix: int = 20000):
+    return {"date": "29/08/2024", "hippodrome": hippodrome, "numero_course": numero, "prix": prix,
+            "partants": len(chevaux), "donnees_chevaux": chevaux}
+
+
+def saison():
+    with open(os.path.join(RACINE, "index.html"), "rb") as f:
+        page = partants.analyser_page(URL, f.read())
+    return [
+        page,
+        # 5 cotes PMU à 0 : les cotes Genybet sont utilisées
+        course("Vincennes", "2", [cheval(f"C{i}", "12 500 €", "0", f"{i}.5") for i in range(6)]),
+        # Gains non convertibles ou vides, hippodrome rapproché puis hippodrome inconnu
+        course("Vincenes", "3", [cheval("A", "n/c", "4"), cheval("B", "0", "12"), cheval("C", "3 000", "2.1")]),
+        course("Hippodrome Imaginaire", "4", [cheval("D", "100", "5")]),
+        course("Strasbourg", "5", []),
+    ]
+
+
+def referentiels():
+    valeurs = {
+        normaliser_nom_hippodrome(nom): {colonne: f"{nom[:3]}{i}" for i, colonne in enumerate(COLONNES_EXCEL)}
+        for nom in ("Strasbourg", "Vincennes")
+    }
+    return [valeurs, ReferentielHippodromes(valeurs)]
+
+
+@pytest.mark.parametrize("module", [partants, partant_unique])
+@pytest.mark.parametrize("numero_referentiel", [0, 1], ids=["dict", "trigrammes"])
+def test_moteurs_identiques(tmp_path, module, numero_referentiel):
+    donnees = saison()
+    fichiers = {}
+    try:
+        for moteur in enrichissement.MOTEURS:
+            enrichissement.choisir_moteur(moteur)
+            fichiers[moteur] = tmp_path / f"{moteur}.csv"
+            module.sauvegarder_en_csv(donnees, str(fichiers[moteur]), referentiels()[numero_referentiel])
+    finally:
+        enrichissement.choisir_moteur(enrichissement.MOTEUR_PAR_DEFAUT)
+
+    contenu = fichiers["python"].read_bytes()
+    assert contenu.count(b"\n") > 10
+    assert b"(G) " in contenu
+    assert fichiers["vectorise"].read_bytes() == contenu
+
+
+def test_moteur_inconnu():
+    with pytest.raises(ValueError):
+        enrichissement.choisir_moteur("rapide")
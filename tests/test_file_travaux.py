@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import file_travaux
+from file_travaux import (ECHEC, EN_ATTENTE, EN_COURS, TENTATIVES_MAX, TERMINE, VIDE,
+                          FileTravauxMemoire, FileTravauxSQLite)
+
+
+URLS = [f"https://www.example.com/course_c{numero}" for numero in range(1, 4)]
+
+
+@pytest.fixture(params=["memoire", "sqlite"])
+def file(request, tmp_path):
+    if request.param == "memoire":
+        return FileTravauxMemoire()
+    return FileTravauxSQLite(str(tmp_path / "travaux.db"))
+
+
+def test_ajouter_sans_doublon(file):
+    assert file.ajouter("partants", URLS) == 3
+    assert file.ajouter("partants", URLS[:1] + ["https://www.example.com/course_c4"]) == 1
+    # Même URL, autre type de travail : travail distinct
+    assert file.ajouter("arrivees", URLS[:1]) == 1
+    assert file.etat("partants") == {EN_ATTENTE: 4}
+
+
+def test_bail_exclusif(file):
+    file.ajouter("partants", URLS)
+    pris = file.prendre("partants", "a", nombre=2)
+    assert [travail.url for travail in pris] == URLS[:2]
+    assert all(travail.tentatives == 1 for travail in pris)
+    assert [travail.url for travail in file.prendre("partants", "b")] == URLS[2:]
+    assert file.prendre("partants", "c") == []
+    assert file.etat("partants") == {EN_COURS: 3}
+
+
+def test_confirmer_resultats_et_vide(file):
+    file.ajouter("arrivees", URLS)
+    travaux = file.prendre("arrivees", "a")
+    arrivee = ([["1", "2"]], ["1er"], "R1C1", "VINCENNES", {"3", "7"}, ["Cheval"])
+    # Confirmés dans le désordre : les résultats restent dans l'ordre d'ajout
+    file.confirmer(travaux[2], "a", arrivee)
+    file.confirmer(travaux[1], "a", None)
+    file.confirmer(travaux[0], "a", arrivee)
+    assert file.etat("arrivees") == {TERMINE: 2, VIDE: 1}
+    assert file.resultats("arrivees") == [arrivee, arrivee]
+    assert isinstance(file.resultats("arrivees")[0][4], set)
+
+
+def test_rejeter_jusqu_a_echec(file):
+    file.ajouter("partants", URLS[:1])
+    for tentative in range(1, TENTATIVES_MAX + 1):
+        travail, = file.prendre("partants", "a")
+        assert travail.tentatives == tentative
+        file.rejeter(travail, "a", "ErreurHTTP 503")
+    assert file.etat("partants") == {ECHEC: 1}
+    assert file.prendre("partants", "a") == []
+
+
+def test_bail_expire_repris_et_ancien_travailleur_ignore(file):
+    file.ajouter("partants", URLS[:1])
+    ancien, = file.prendre("partants", "a", duree_bail=-1)
+    repris, = file.prendre("partants", "b")
+    assert repris.tentatives == 2
+    # Le travailleur arrêté revient après expiration de son bail : sa confirmation est ignorée
+    file.confirmer(ancien, "a", [["ignore"]])
+    assert file.etat("partants") == {EN_COURS: 1}
+    file.confirmer(repris, "b", [["ligne"]])
+    assert file.resultats("partants") == [[["ligne"]]]
+
+
+def test_bail_toujours_expire_passe_en_echec(file):
+    file.ajouter("partants", URLS[:1])
+    for _ in range(TENTATIVES_MAX):
+        assert file.prendre("partants", "a", duree_bail=-1)
+    assert file.prendre("partants", "a") == []
+    assert file.etat("partants") == {ECHEC: 1}
+
+
+def test_travailler_retente_les_erreurs(file, monkeypatch):
+    appels = {}
+
+    async def fonction(url, session):
+        appels[url] = appels.get(url, 0) + 1
+        if url == URLS[0] and appels[url] == 1:
+            raise ConnectionError("coupure")
+        if url == URLS[1]:
+            raise ConnectionError("toujours en panne")
+        return [[url]]
+
+    monkeypatch.setattr(file_travaux, "fonction_travail", lambda type_travail: fonction)
+    file.ajouter("partants", URLS)
+    confirmes = asyncio.run(file_travaux.travailler(file, "partants", concurrence=2))
+
+    assert confirmes == 2
+    assert appels == {URLS[0]: 2, URLS[1]: TENTATIVES_MAX, URLS[2]: 1}
+    assert file.etat("partants") == {TERMINE: 2, ECHEC: 1}
+    assert file.resultats("partants") == [[[URLS[0]]], [[URLS[2]]]]
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from historique import IndexHistorique, construire_index
+
+
+def dates_precedentes_naives(chevaux, dates, chevaux_du_jour, jours, nombre):
+    """Référence : parcours de tout l'historique pour chaque (cheval, jour)."""
+    lignes = []
+    for cheval, jour in zip(chevaux_du_jour, jours):
+        courues = sorted({d for c, d in zip(chevaux, dates)
+                          if pd.notna(c) and pd.notna(d) and pd.notna(cheval) and pd.notna(jour)
+                          and str(c).strip().upper() == str(cheval).strip().upper() and d < jour},
+                         reverse=True)
+        lignes.append(courues[:nombre] + [pd.NaT] * (nombre - len(courues[:nombre])))
+    return lignes
+
+
+def test_identique_au_parcours_naif():
+    generateur = np.random.default_rng(7)
+    noms = ["BOLD EAGLE", "Face Time Bourbon", " idao de tillard ", "Davidson du Pont", None]
+    chevaux = pd.Series(generateur.choice(noms, 300))
+    dates = pd.Series(pd.to_datetime("2020-01-01") + pd.to_timedelta(generateur.integers(0, 1500, 300), "D"))
+    dates[::17] = pd.NaT
+
+    chevaux_du_jour = pd.Series(list(generateur.choice(noms + ["INCONNU"], 200)), index=range(100, 300))
+    jours = pd.Series(pd.to_datetime("2020-01-01") + pd.to_timedelta(generateur.integers(-30, 1600, 200), "D"),
+                      index=chevaux_du_jour.index)
+    jours.iloc[::23] = pd.NaT
+
+    colonnes = IndexHistorique(chevaux, dates).dates_precedentes(chevaux_du_jour, jours, nombre=4)
+    attendu = dates_precedentes_naives(chevaux, dates, chevaux_du_jour, jours, 4)
+    obtenu = [list(ligne) for ligne in zip(*colonnes)]
+    assert all((colonne.index == chevaux_du_jour.index).all() for colonne in colonnes)
+    assert [[None if pd.isna(d) else d for d in ligne] for ligne in obtenu] == \
+           [[None if pd.isna(d) else d for d in ligne] for ligne in attendu]
+
+
+def test_historique_vide():
+    index = IndexHistorique(pd.Series([], dtype=str), pd.Series([], dtype="datetime64[ns]"))
+    colonnes = index.dates_precedentes(pd.Series(["BOLD EAGLE"]), pd.Series(pd.to_datetime(["2023-01-05"])))
+    assert all(colonne.isna().all() for colonne in colonnes)
+
+
+def test_construire_index_depuis_csv(tmp_path):
+    fichier = tmp_path / "arrivees.csv"
+    pd.DataFrame({"DATE": ["05/01/2023", "12/01/2023", "12/01/2023", "pas une date"],
+                  "CHEVAL": ["Bold Eagle", "BOLD EAGLE", "Bold Eagle", "Bold Eagle"],
+                  "PLACE": ["1", "2", "2", "3"]}).to_csv(fichier, index=False, encoding="utf-8")
+    index = construire_index([str(fichier), str(tmp_path / "absent.csv")])
+    # Doublons du même jour et date illisible écartés
+    assert len(index) == 2
+    premiere, seconde = index.dates_precedentes(pd.Series(["bold eagle"]),
+                                                pd.Series(pd.to_datetime(["2023-02-01"])), nombre=2)
+    assert (premiere[0], seconde[0]) == (pd.Timestamp("2023-01-12"), pd.Timestamp("2023-01-05"))
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from Deuxieme_tache import mapping
+
+
+def ecrire_excel(chemin, donnees):
+    chemin.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(donnees).to_excel(chemin, index=False)
+    return chemin
+
+
+@pytest.fixture
+def reference(tmp_path):
+    # Même valeur dans deux colonnes I-Place : la première colonne l'emporte, comme dans find_match
+    return ecrire_excel(tmp_path / "REF-LISTE.xlsx", {
+        "I-Place-1": ["A", "B", "C"], "Place-1": [1, 2, 3], "NbrPartants-1": [10, 12, 14],
+        "I-Place-2": ["D", "A", None], "Place-2": [4, 5, 6], "NbrPartants-2": [16, 8, 9],
+    })
+
+
+def depart(numero):
+    valeurs = ["A", "B", "C", "D", "X", None]
+    return {f"I-Place-{i}": [valeurs[(numero + i + ligne) % len(valeurs)] for ligne in range(5)]
+            for i in range(1, 5)}
+
+
+def test_index_identique_a_find_match(reference):
+    reference_df = pd.read_excel(reference)
+    index = mapping.build_reference_index(reference_df)
+    for valeur in ["A", "B", "C", "D", "X"]:
+        assert index.get(valeur, (np.nan, np.nan)) == pytest.approx(mapping.find_match(valeur, reference_df),
+                                                                     nan_ok=True)
+
+
+def test_lot_identique_au_mode_simple(tmp_path, reference):
+    departs = [ecrire_excel(tmp_path / "jours" / f"2023-01-0{numero}" / "FICHE2.xlsx", depart(numero))
+               for numero in range(1, 4)]
+    for fichier in departs:
+        mapping.main(str(fichier), str(reference), str(fichier.parent / "resultat.xlsx"))
+
+    mapping.main_batch([str(tmp_path / "jours")], str(reference), workers=2)
+
+    for fichier in departs:
+        attendu = pd.read_excel(fichier.parent / "resultat.xlsx")
+        obtenu = pd.read_excel(mapping.output_path(fichier))
+        pd.testing.assert_frame_equal(obtenu, attendu)
+        assert attendu["Place-1"].notna().any()
+
+
+def test_fichiers_ignores(tmp_path, reference):
+    jours = tmp_path / "jours"
+    fiche = ecrire_excel(jours / "2023-01-05" / "FICHE2.xlsx", depart(1))
+    autre = ecrire_excel(jours / "2023-01-06" / "FICHE2.xls", depart(2))
+    for nom in ["resultat.xlsx", "FICHE2_resultat.xlsx", "REF-LISTE.xls", "REF-LISTE.xlsx"]:
+        ecrire_excel(jours / "2023-01-05" / nom, depart(3))
+    (jours / "notes.txt").write_text("pas un fichier Excel")
+
+    assert mapping.list_depart_files([str(jours)], str(reference)) == [fiche, autre]
+    assert mapping.list_depart_files([str(jours / "*" / "*.xls*")], str(reference)) == [fiche, autre]
+    # Un fichier donné deux fois n'est mappé qu'une fois
+    assert mapping.list_depart_files([str(fiche), str(jours)], str(reference)) == [fiche, autre]
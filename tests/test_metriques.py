@@ -0,0 +1,51 @@
+import os
+import asyncio
+
+import pytest
+
+import arrivees
+import metriques
+import partants
+from conftest import RACINE
+
+
+@pytest.fixture
+def metriques_actives(monkeypatch):
+    monkeypatch.setattr(metriques, "actif", True)
+    monkeypatch.setattr(metriques.ECHECS_EXTRACTION, "valeurs", {})
+
+
+def echecs():
+    return {dict(cle)["extracteur"]: valeur for cle, valeur in metriques.ECHECS_EXTRACTION.valeurs.items()}
+
+
+def test_metrique_abstraite():
+    with pytest.raises(TypeError):
+        metriques.Metrique("abstraite", "sans lignes")
+
+    class SansLignes(metriques.Metrique):
+        pass
+
+    with pytest.raises(TypeError):
+        SansLignes("sans_lignes", "sans lignes")
+
+
+def test_echecs_par_extracteur(metriques_actives):
+    partants.analyser_page("https://www.geny.com/partants-pmu/2024-08-29-page_c1", b"<html><body></body></html>")
+    assert echecs() == {"extraire_hippodrome": 1, "extraire_numero_course": 1,
+                        "extraire_prix_et_partants": 1, "extraire_chevaux_et_gains": 1}
+    assert 'geny_echecs_extraction_total{extracteur="extraire_hippodrome",script="partants"} 1' in metriques.exposer()
+
+
+def test_page_complete_sans_echec(metriques_actives):
+    with open(os.path.join(RACINE, "index.html"), "rb") as f:
+        page_partants = f.read()
+    with open(os.path.join(RACINE, "benchmarks", "pages", "arrivee.html"), "rb") as f:
+        page_arrivee = f.read()
+    partants.analyser_page("https://www.geny.com/partants-pmu/2024-08-29-page_c1", page_partants)
+    asyncio.run(arrivees.extraire_donnees_arrivee(page_arrivee))
+    assert echecs() == {}
+
+    # Une page de partants n'a ni tableau d'arrivée ni rapports PMU
+    asyncio.run(arrivees.extraire_donnees_arrivee(page_partants))
+    assert echecs() == {"extraire_places": 1, "extraire_donnees_arrivee": 1}
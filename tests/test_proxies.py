@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+
+import proxies
+from proxies import AucunProxyDisponible, ReserveProxies
+from proxies_locaux import CORPS_PAGE, ProxyLocal, SiteLocal
+
+
+@pytest.fixture(autouse=True)
+def delais_courts(monkeypatch):
+    monkeypatch.setattr(proxies, "INTERVALLE_SONDAGE", 0.05)
+    monkeypatch.setattr(proxies, "DUREE_EXCLUSION", 0.0)
+    monkeypatch.setattr(proxies, "ATTENTE_PROXY_DISPONIBLE", 0.5)
+
+
+async def demarrer(*protocoles):
+    site = await SiteLocal().demarrer()
+    locaux = [await ProxyLocal(protocole).demarrer() for protocole in protocoles]
+    return site, locaux
+
+
+async def arreter(reserve, site, locaux):
+    await reserve.fermer()
+    for local in locaux:
+        await local.arreter()
+    await site.arreter()
+
+
+async def attendre(condition, delai: float = 2.0):
+    for _ in range(int(delai / 0.02)):
+        if condition():
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError("condition jamais remplie")
+
+
+def test_tourniquet_et_socks5():
+    async def scenario():
+        site, locaux = await demarrer("http", "socks5")
+        reserve = ReserveProxies([local.url for local in locaux])
+        try:
+            for numero in range(4):
+                statut, contenu, _, _ = await reserve.requete(f"{site.url}/page{numero}")
+                assert (statut, contenu) == (200, CORPS_PAGE)
+            assert [proxy.requetes for proxy in reserve.proxies] == [2, 2]
+        finally:
+            await arreter(reserve, site, locaux)
+
+    asyncio.run(scenario())
+
+
+def test_proxy_mort_exclu_puis_de_retour():
+    async def scenario():
+        site, locaux = await demarrer("http", "http")
+        locaux[0].changer(actif=False)
+        reserve = ReserveProxies([local.url for local in locaux])
+        try:
+            await reserve.requete(f"{site.url}/a")
+            assert not reserve.proxies[0].disponible
+            assert reserve.proxies[1].requetes == 1
+
+            locaux[0].changer()
+            await attendre(lambda: reserve.proxies[0].disponible)
+            for numero in range(4):
+                await reserve.requete(f"{site.url}/b{numero}")
+            assert reserve.proxies[0].requetes > 0
+        finally:
+            await arreter(reserve, site, locaux)
+
+    asyncio.run(scenario())
+
+
+def test_proxy_limite_exclu_apres_echecs_consecutifs():
+    async def scenario():
+        site, locaux = await demarrer("http")
+        reserve = ReserveProxies([locaux[0].url])
+        try:
+            await reserve.requete(f"{site.url}/a")
+            locaux[0].changer(statut_force=429)
+            for _ in range(proxies.ECHECS_AVANT_EXCLUSION):
+                statut, _, _, _ = await reserve.requete(f"{site.url}/b")
+                assert statut == 429
+            assert not reserve.proxies[0].disponible
+
+            # Tant que le proxy est limité, la sonde échoue : il reste exclu
+            await asyncio.sleep(0.2)
+            assert not reserve.proxies[0].disponible
+
+            locaux[0].changer()
+            await attendre(lambda: reserve.proxies[0].disponible)
+            statut, _, _, _ = await reserve.requete(f"{site.url}/c")
+            assert statut == 200
+        finally:
+            await arreter(reserve, site, locaux)
+
+    asyncio.run(scenario())
+
+
+def test_erreur_de_connexion_retentee_par_un_autre_proxy():
+    async def scenario():
+        site, locaux = await demarrer("http", "http")
+        reserve = ReserveProxies([local.url for local in locaux])
+        try:
+            await reserve.requete(f"{site.url}/a")
+            locaux[0].changer(actif=False)
+            for numero in range(3):
+                statut, _, _, _ = await reserve.requete(f"{site.url}/b{numero}")
+                assert statut == 200
+        finally:
+            await arreter(reserve, site, locaux)
+
+    asyncio.run(scenario())
+
+
+def test_aucun_proxy_disponible():
+    async def scenario():
+        site, locaux = await demarrer("http")
+        locaux[0].changer(actif=False)
+        reserve = ReserveProxies([locaux[0].url])
+        try:
+            with pytest.raises(AucunProxyDisponible):
+                await reserve.requete(f"{site.url}/a")
+        finally:
+            await arreter(reserve, site, locaux)
+
+    asyncio.run(scenario())
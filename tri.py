@@ -0,0 +1,111 @@
+import os
+import csv
+import heapq
+import tempfile
+from itertools import chain, islice
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+from loguru import logger
+
+from chronometre import chronometrer
+from fichiers import ENCODAGE_CSV, TAILLE_TAMPON, ecrire_csv
+
+
+# Au-delà de ce nombre de lignes, le tri se fait par lots triés sur disque puis fusionnés
+TAILLE_LOT_TRI = 200_000
+
+Numero = Tuple[int, Union[int, str]]
+CleTri = Tuple[str, Numero, Numero]
+
+
+def valeur_numerique(valeur: str) -> Numero:
+    """Clé d'un champ numérique : les nombres dans l'ordre croissant, puis les valeurs vides ou
+    non numériques (dans l'ordre alphabétique)."""
+    valeur = valeur.strip() if valeur else ''
+    if valeur.isdigit():
+        return (0, int(valeur))
+    return (1, valeur)
+
+
+def identite(nom_hippodrome: str) -> str:
+    return nom_hippodrome
+
+
+def cle_tri(ligne: Dict[str, str], normaliser: Callable[[str], str] = identite) -> CleTri:
+    """Hippodrome (passé par `normaliser`, par exemple normaliser_nom_hippodrome pour regrouper les
+    variantes d'un même nom), puis numéro de course, puis place. Un cheval sans place est classé
+    après les chevaux placés de sa course, dans l'ordre d'origine (le tri est stable)."""
+    return (normaliser(ligne['Hippodrome']), valeur_numerique(ligne['COURSE']),
+            valeur_numerique(ligne.get('PLACE', '')))
+
+
+def ecrire_lot(dossier: str, numero: int, noms_champs: List[str], lot: List[Dict[str, str]],
+               cle: Callable[[Dict[str, str]], CleTri] = cle_tri) -> str:
+    chemin = os.path.join(dossier, f"lot_{numero:05d}.csv")
+    lot.sort(key=cle)
+    with open(chemin, 'w', newline='', encoding='utf-8', buffering=TAILLE_TAMPON) as f:
+        ecrivain = csv.DictWriter(f, fieldnames=noms_champs)
+        ecrivain.writerows(lot)
+    return chemin
+
+
+def lire_lot(chemin: str, noms_champs: List[str]) -> Iterator[Dict[str, str]]:
+    with open(chemin, 'r', newline='', encoding='utf-8', buffering=TAILLE_TAMPON) as f:
+        yield from csv.DictReader(f, fieldnames=noms_champs)
+
+
+def trier_lignes(lignes: Iterable[Dict[str, str]], taille_lot: int = TAILLE_LOT_TRI,
+                 normaliser: Callable[[str], str] = identite) -> Iterator[Dict[str, str]]:
+    """Trie les lignes selon cle_tri (avec `normaliser` pour le nom de l'hippodrome).
+
+    Si elles tiennent dans un lot, le tri se fait en mémoire. Sinon chaque lot est trié puis écrit
+    dans un fichier temporaire, et les lots sont fusionnés avec heapq.merge : seule une ligne par
+    lot est alors en mémoire. La fusion est stable, comme le tri en mémoire."""
+    def cle(ligne: Dict[str, str]) -> CleTri:
+        return cle_tri(ligne, normaliser)
+
+    iterateur = iter(lignes)
+    lot = list(islice(iterateur, taille_lot))
+    suite = list(islice(iterateur, 1))
+    if not suite:
+        lot.sort(key=cle)
+        yield from lot
+        return
+
+    noms_champs = list(lot[0].keys())
+    with tempfile.TemporaryDirectory(prefix="tri_") as dossier:
+        chemins = []
+        while lot:
+            chemins.append(ecrire_lot(dossier, len(chemins), noms_champs, lot, cle))
+            lot = suite + list(islice(iterateur, taille_lot - len(suite)))
+            suite = []
+        logger.info(f"Tri externe : {len(chemins)} lots de {taille_lot} lignes au plus")
+        yield from heapq.merge(*(lire_lot(chemin, noms_champs) for chemin in chemins), key=cle)
+
+
+@chronometrer("tri_csv")
+def trier_fichier_csv(fichier_entree: str, fichier_sortie: str, taille_lot: int = TAILLE_LOT_TRI) -> int:
+    """Trie un CSV d'arrivées sans le charger en entier. Retourne le nombre de lignes écrites.
+
+    `fichier_sortie` peut être `fichier_entree` : le tri lit toute l'entrée (en mémoire ou dans ses
+    lots sur disque) avant de rendre la première ligne, le fichier d'entrée est donc fermé avant
+    d'être remplacé, ce que Windows exige."""
+    try:
+        with open(fichier_entree, 'r', newline='', encoding=ENCODAGE_CSV, buffering=TAILLE_TAMPON) as f:
+            lecteur = csv.DictReader(f)
+            if not lecteur.fieldnames:
+                logger.error(f"Le fichier CSV {fichier_entree} est vide.")
+                return 0
+            noms_champs = lecteur.fieldnames
+            lignes = trier_lignes(lecteur, taille_lot)
+            premiere = next(lignes, None)
+        lignes_triees = chain([premiere], lignes) if premiere is not None else []
+        nombre_lignes = ecrire_csv(fichier_sortie, noms_champs, lignes_triees)
+        logger.info(f"Tri du fichier CSV {fichier_entree} vers {fichier_sortie} réussi ({nombre_lignes} lignes).")
+        return nombre_lignes
+    except FileNotFoundError:
+        logger.error(f"Le fichier CSV {fichier_entree} n'a pas été trouvé.")
+        return 0
+    except Exception as e:
+        logger.error(f"Erreur lors du tri du fichier CSV {fichier_entree}: {e}")
+        return 0